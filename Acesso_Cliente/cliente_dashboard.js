@@ -77,13 +77,22 @@ document.addEventListener('DOMContentLoaded', function() {
     const chatInput = document.querySelector('.chat-input-field');
     const chatMessages = document.querySelector('.chat-messages');
     
-    // Função para adicionar mensagem na tela
-    function adicionarMensagemAoChat(texto, tipo) { // tipo = 'user' or 'bot'
+    const TAMANHO_PAGINA_HISTORICO = 50;
+    let idMaisAntigo = null; // cursor para buscar mensagens anteriores
+    let historicoCompleto = false;
+    let carregandoAnteriores = false;
+
+    function criarBolha(texto, tipo) {
         const bubble = document.createElement('div');
         bubble.classList.add('chat-bubble');
         bubble.classList.add(tipo === 'user' ? 'user-message' : 'bot-message');
         bubble.innerHTML = texto.replace(/\n/g, '<br>'); // Converte quebras de linha
-        chatMessages.appendChild(bubble);
+        return bubble;
+    }
+
+    // Função para adicionar mensagem na tela
+    function adicionarMensagemAoChat(texto, tipo) { // tipo = 'user' or 'bot'
+        chatMessages.appendChild(criarBolha(texto, tipo));
         chatMessages.scrollTop = chatMessages.scrollHeight; // Rola para a última mensagem
     }
 
@@ -115,10 +124,10 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // --- 5. Carregamento de Dados das Abas ---
 
-    // Carregar histórico do chat ao abrir a página
+    // Carregar histórico do chat ao abrir a página (só a última página; o resto vem ao rolar para cima)
     async function carregarHistoricoChat() {
         try {
-            const response = await fetch(`/api/chat/${ID_CLIENTE_LOGADO}/historico`);
+            const response = await fetch(`/api/chat/${ID_CLIENTE_LOGADO}/historico?limit=${TAMANHO_PAGINA_HISTORICO}`);
             if (!response.ok) throw new Error('Falha ao carregar histórico');
             
             const historico = await response.json();
@@ -126,6 +135,8 @@ document.addEventListener('DOMContentLoaded', function() {
             historico.forEach(msg => {
                 adicionarMensagemAoChat(msg.texto, msg.role);
             });
+            idMaisAntigo = historico.length ? historico[0].id_conversa : null;
+            historicoCompleto = historico.length < TAMANHO_PAGINA_HISTORICO;
             // Saudação inicial se o histórico estiver vazio
             if(historico.length === 0) {
                  adicionarMensagemAoChat(`Olá, ${NOME_CLIENTE}! Estou pronto para ajudar com seu plano. O que você gostaria de saber?`, 'bot');
@@ -136,6 +147,34 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    // Mensagens anteriores ao rolar até o topo
+    async function carregarMensagensAnteriores() {
+        if (historicoCompleto || carregandoAnteriores || idMaisAntigo === null) return;
+        carregandoAnteriores = true;
+        try {
+            const response = await fetch(`/api/chat/${ID_CLIENTE_LOGADO}/historico?before=${idMaisAntigo}&limit=${TAMANHO_PAGINA_HISTORICO}`);
+            if (!response.ok) throw new Error('Falha ao carregar mensagens anteriores');
+
+            const anteriores = await response.json();
+            const alturaAntes = chatMessages.scrollHeight;
+            const fragmento = document.createDocumentFragment();
+            anteriores.forEach(msg => fragmento.appendChild(criarBolha(msg.texto, msg.role)));
+            chatMessages.insertBefore(fragmento, chatMessages.firstChild);
+            chatMessages.scrollTop += chatMessages.scrollHeight - alturaAntes; // Mantém a posição de leitura
+
+            if (anteriores.length) idMaisAntigo = anteriores[0].id_conversa;
+            historicoCompleto = anteriores.length < TAMANHO_PAGINA_HISTORICO;
+        } catch (error) {
+            console.error('Erro ao carregar mensagens anteriores:', error);
+        } finally {
+            carregandoAnteriores = false;
+        }
+    }
+
+    chatMessages.addEventListener('scroll', () => {
+        if (chatMessages.scrollTop === 0) carregarMensagensAnteriores();
+    });
+
     // Carregar dados do perfil (chamado ao clicar na aba)
     async function carregarDadosPerfil() {
         const perfilContainer = document.querySelector('#perfil .card-container');
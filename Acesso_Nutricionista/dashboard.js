@@ -29,6 +29,7 @@ document.addEventListener('DOMContentLoaded', function() {
 
             contentSections.forEach(section => section.classList.remove('active'));
             document.getElementById(targetId).classList.add('active');
+            pararAtualizacoesChat(); // saiu da conversa do cliente
             
             // Carregar dados da aba clicada
             if (targetId === 'dashboard') {
@@ -61,10 +62,11 @@ document.addEventListener('DOMContentLoaded', function() {
     async function carregarClientesDashboard() {
         clientList.innerHTML = '<li>Carregando clientes...</li>';
         try {
-            const response = await fetch(`/api/nutricionistas/${ID_NUTRI_LOGADA}/clientes`);
+            // Portfólio: uma única chamada já traz consumo de hoje, metas e atividade de todos os clientes
+            const response = await fetch(`/api/nutricionistas/${ID_NUTRI_LOGADA}/portfolio`);
             if (!response.ok) throw new Error('Falha ao carregar clientes');
             
-            const clientes = await response.json();
+            const { clientes } = await response.json();
             clientList.innerHTML = ''; 
             
             if (clientes.length === 0) {
@@ -72,7 +74,12 @@ document.addEventListener('DOMContentLoaded', function() {
                 return;
             }
 
+            const UM_DIA_MS = 24 * 60 * 60 * 1000;
             clientes.forEach(cliente => {
+                const chatAtivo = cliente.ultima_mensagem && (Date.now() - Date.parse(cliente.ultima_mensagem)) < UM_DIA_MS;
+                const consumo = cliente.tdee_kcal
+                    ? `${Math.round(cliente.kcal_hoje)} / ${Math.round(cliente.tdee_kcal)} kcal hoje`
+                    : `${Math.round(cliente.kcal_hoje)} kcal hoje`;
                 const li = document.createElement('li');
                 li.classList.add('client-item');
                 li.setAttribute('data-client-id', cliente.id_cliente);
@@ -80,9 +87,10 @@ document.addEventListener('DOMContentLoaded', function() {
                     <div class="client-info">
                         <img src="https://via.placeholder.com/40" alt="Foto ${cliente.nome}" class="client-avatar">
                         <span>${cliente.nome} (${cliente.email})</span>
+                        <small>${consumo} · ${cliente.imc_class} · ${cliente.itens_plano} itens no plano</small>
                     </div>
-                    <div class="client-status inactive-chat">
-                        <span class="status-indicator"></span> Chat Inativo
+                    <div class="client-status ${chatAtivo ? 'active-chat' : 'inactive-chat'}">
+                        <span class="status-indicator"></span> ${chatAtivo ? 'Chat Ativo' : 'Chat Inativo'}
                     </div>
                     <button class="btn-view-chat">Gerenciar Cliente</button>
                 `;
@@ -119,24 +127,87 @@ document.addEventListener('DOMContentLoaded', function() {
         carregarPlanoAtual(clienteId);
     }
     
+    const TAMANHO_PAGINA_HISTORICO = 50;
+    const INTERVALO_POLLING_MS = 5000;
+    let ultimoIdConversa = 0; // cursor "since" do polling
+    let etagHistorico = null;
+    let timerPolling = null;
+    let streamEventos = null;
+
+    function adicionarBolhaChat(msg) {
+        const bubble = document.createElement('div');
+        bubble.classList.add('chat-bubble');
+        bubble.classList.add(msg.role === 'user' ? 'user-message' : 'bot-message');
+        bubble.innerText = msg.texto;
+        chatContainer.appendChild(bubble);
+    }
+
     async function carregarHistoricoChat(clienteId) {
+        pararAtualizacoesChat();
         chatContainer.innerHTML = '<p>Carregando histórico...</p>';
         try {
-            const response = await fetch(`/api/chat/${clienteId}/historico`);
+            const response = await fetch(`/api/chat/${clienteId}/historico?limit=${TAMANHO_PAGINA_HISTORICO}`);
             const historico = await response.json();
             chatContainer.innerHTML = '';
-            historico.forEach(msg => {
-                const bubble = document.createElement('div');
-                bubble.classList.add('chat-bubble');
-                bubble.classList.add(msg.role === 'user' ? 'user-message' : 'bot-message');
-                bubble.innerText = msg.texto;
-                chatContainer.appendChild(bubble);
-            });
+            historico.forEach(adicionarBolhaChat);
+            ultimoIdConversa = historico.length ? historico[historico.length - 1].id_conversa : 0;
+            etagHistorico = null;
             chatContainer.scrollTop = chatContainer.scrollHeight;
+            iniciarAtualizacoesChat(clienteId);
         } catch (err) {
             chatContainer.innerHTML = '<p>Erro ao carregar histórico.</p>';
         }
     }
+
+    function pararAtualizacoesChat() {
+        clearInterval(timerPolling);
+        if (streamEventos) {
+            streamEventos.close();
+            streamEventos = null;
+        }
+    }
+
+    // Mensagens novas chegam por SSE; sem suporte a EventSource, cai para o polling
+    function iniciarAtualizacoesChat(clienteId) {
+        if (!window.EventSource) {
+            timerPolling = setInterval(() => buscarNovasMensagens(clienteId), INTERVALO_POLLING_MS);
+            return;
+        }
+        streamEventos = new EventSource(`/api/chat/${clienteId}/eventos?since=${ultimoIdConversa}`);
+        streamEventos.addEventListener('mensagem', (evento) => {
+            if (clienteId !== clienteIdAtual || !document.getElementById('chat-view').classList.contains('active')) {
+                pararAtualizacoesChat();
+                return;
+            }
+            const msg = JSON.parse(evento.data);
+            if (msg.id_conversa <= ultimoIdConversa) return;
+            adicionarBolhaChat(msg);
+            ultimoIdConversa = msg.id_conversa;
+            chatContainer.scrollTop = chatContainer.scrollHeight;
+        });
+    }
+
+    // Polling leve: só traz mensagens novas, e o servidor responde 304 quando não há nada
+    async function buscarNovasMensagens(clienteId) {
+        if (clienteId !== clienteIdAtual || !document.getElementById('chat-view').classList.contains('active')) {
+            clearInterval(timerPolling);
+            return;
+        }
+        try {
+            const headers = etagHistorico ? { 'If-None-Match': etagHistorico } : {};
+            const response = await fetch(`/api/chat/${clienteId}/historico?since=${ultimoIdConversa}&limit=${TAMANHO_PAGINA_HISTORICO}`, { headers });
+            if (response.status === 304 || !response.ok) return;
+            etagHistorico = response.headers.get('ETag');
+            const novas = await response.json();
+            if (!novas.length) return;
+            novas.forEach(adicionarBolhaChat);
+            ultimoIdConversa = novas[novas.length - 1].id_conversa;
+            etagHistorico = null; // o cursor mudou, a ETag antiga não vale mais
+            chatContainer.scrollTop = chatContainer.scrollHeight;
+        } catch (err) {
+            console.error('Erro ao buscar novas mensagens:', err);
+        }
+    }
     
 
     btnConfigBotChat.addEventListener('click', () => {
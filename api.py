@@ -1,12 +1,19 @@
 
+import os
+import json
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import chatbot_nutri as bot 
-from fastapi import FastAPI, HTTPException, Depends, APIRouter
+import relatorio
+from fastapi import FastAPI, HTTPException, Depends, APIRouter, Query, Request
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
 
 class ChatMessage(BaseModel):
     texto: str
@@ -28,6 +35,7 @@ class ClienteRequest(BaseModel):
     peso_kg: float
     altura_cm: float
     atividade: str = "sedentario"
+    fuso_horario: str = bot.FUSO_PADRAO
 
 class OpcaoPlanoRequest(BaseModel):
     refeicao: str
@@ -37,6 +45,16 @@ class OpcaoPlanoRequest(BaseModel):
     carb_100g: float = 0.0
     fat_100g: float = 0.0
 
+class PlanoLoteRequest(BaseModel):
+    itens: List[OpcaoPlanoRequest]
+
+class ModeloPlanoRequest(BaseModel):
+    nome: str
+    itens: List[OpcaoPlanoRequest] = []
+
+class AtribuirModeloRequest(BaseModel):
+    id_modelo: Optional[str] = None
+
 class BotConfigRequest(BaseModel):
     persona: Optional[str] = None
     restricoes: Optional[str] = None
@@ -47,6 +65,88 @@ class NutriPerfilRequest(BaseModel):
     email: str
     senha: Optional[str] = None
 
+RETRY_AFTER_S = 2
+SSE_FILA_MAX = int(os.environ.get("OTRI_SSE_FILA", "256"))
+SSE_HEARTBEAT_S = 15
+SSE_REPLAY_MAX = 500
+HISTORICO_PAGINA_PADRAO = 100
+
+class ExecutorLimitado:
+    def __init__(self, nome: str, threads: int, fila: int, timeout_s: float):
+        self.nome = nome
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix=nome)
+        self.threads = threads
+        self.capacidade = threads + fila
+        self.timeout_s = timeout_s
+        self._lock = threading.Lock()
+        self._em_uso = 0
+        self.concluidas = 0
+        self.rejeitadas = 0
+        self.timeouts = 0
+
+    def _liberar(self, _futuro):
+        with self._lock:
+            self._em_uso -= 1
+            self.concluidas += 1
+
+    def liberar(self):
+        self._liberar(None)
+
+    def reservar(self):
+        with self._lock:
+            if self._em_uso >= self.capacidade:
+                self.rejeitadas += 1
+                raise HTTPException(status_code=503, detail="Servidor ocupado. Tente novamente em instantes.",
+                                    headers={"Retry-After": str(RETRY_AFTER_S)})
+            self._em_uso += 1
+
+    async def rodar(self, fn, *args, **kwargs):
+        self.reservar()
+        # o slot só é liberado quando a thread termina (ou a tarefa é cancelada ainda na fila),
+        # mesmo que a requisição já tenha estourado o timeout
+        futuro = self.executor.submit(functools.partial(fn, *args, **kwargs))
+        futuro.add_done_callback(self._liberar)
+        return await self._aguardar(futuro)
+
+    async def rodar_reservado(self, fn, *args, **kwargs):
+        # para quem já segura um slot (ex.: um stream inteiro): não passa de novo pela admissão
+        return await self._aguardar(self.executor.submit(functools.partial(fn, *args, **kwargs)))
+
+    async def _aguardar(self, futuro):
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(futuro), timeout=self.timeout_s)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise HTTPException(status_code=504, detail="Tempo de processamento excedido.")
+
+    def estatisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "threads": self.threads,
+                "capacidade": self.capacidade,
+                "em_uso": self._em_uso,
+                "concluidas": self.concluidas,
+                "rejeitadas": self.rejeitadas,
+                "timeouts": self.timeouts,
+            }
+
+    def encerrar(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+EXECUTOR_INFERENCIA = ExecutorLimitado(
+    "inferencia",
+    threads=int(os.environ.get("OTRI_INFERENCIA_THREADS", "2")),
+    fila=int(os.environ.get("OTRI_INFERENCIA_FILA", "16")),
+    timeout_s=float(os.environ.get("OTRI_INFERENCIA_TIMEOUT_S", "30")),
+)
+EXECUTOR_IO = ExecutorLimitado(
+    "io",
+    threads=int(os.environ.get("OTRI_IO_THREADS", "8")),
+    fila=int(os.environ.get("OTRI_IO_FILA", "64")),
+    timeout_s=float(os.environ.get("OTRI_IO_TIMEOUT_S", "10")),
+)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("Iniciando API...")
@@ -55,6 +155,9 @@ async def lifespan(app: FastAPI):
     print("API pronta para receber requisições.")
     yield
     print("Encerrando API.")
+    EXECUTOR_INFERENCIA.encerrar()
+    EXECUTOR_IO.encerrar()
+    bot.encerrar()
 
 app = FastAPI(
     title="OTRI/Gruwth API",
@@ -75,54 +178,235 @@ api_router = APIRouter()
 
 @api_router.post("/login/cliente")
 async def login_cliente(request: LoginRequest):
-    cliente = bot.login_cliente(request.email, request.senha)
+    cliente = await EXECUTOR_IO.rodar(bot.login_cliente, request.email, request.senha)
     if not cliente:
         raise HTTPException(status_code=401, detail="Email ou senha inválidos")
     return {"id_cliente": cliente["id_cliente"], "nome": cliente["nome"], "nome_nutri": cliente["nome_nutri"], "id_nutri": cliente["id_nutri"]}
 
 @api_router.post("/login/nutricionista")
 async def login_nutri(request: LoginRequest):
-    nutri = bot.login_nutri(request.email, request.senha)
+    nutri = await EXECUTOR_IO.rodar(bot.login_nutri, request.email, request.senha)
     if not nutri:
         raise HTTPException(status_code=401, detail="Email ou senha inválidos")
     return {"id_nutri": nutri["id_nutri"], "nome": nutri["nome"]}
 
 @api_router.post("/chat/{id_cliente}", response_model=ChatResponse)
-async def post_chat_message(id_cliente: str, message: ChatMessage):
-    if not bot.get_cliente_por_id(id_cliente):
+async def post_chat_message(id_cliente: str, message: ChatMessage, response: Response):
+    # o cliente carregado aqui é o mesmo que as regras do turno usam: uma leitura só
+    ctx = bot.ContextoTurno(id_cliente)
+    if not await EXECUTOR_IO.rodar(lambda: ctx.cliente):
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
-    resposta = bot.responder_pergunta(id_cliente, message.texto)
+    resposta = await EXECUTOR_INFERENCIA.rodar(bot.responder_pergunta, id_cliente, message.texto, ctx)
+    response.headers["X-Consultas-Banco"] = str(ctx.consultas)
     return {"resposta": resposta}
 
 @api_router.get("/chat/{id_cliente}/historico")
-async def get_chat_historico(id_cliente: str):
-    return bot.get_historico_conversa(id_cliente)
+async def get_chat_historico(
+    id_cliente: str,
+    request: Request,
+    response: Response,
+    before: Optional[int] = Query(None, ge=1),
+    after: Optional[int] = Query(None, ge=0),
+    since: Optional[int] = Query(None, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=500)
+):
+    # "since" é o cursor de quem faz polling: só mensagens com id_conversa maior
+    depois = since if since is not None else after
+    # sem cursor nem limit devolve o histórico inteiro, como sempre; com cursor, página padrão
+    if limit is None and (before is not None or depois is not None):
+        limit = HISTORICO_PAGINA_PADRAO
+    ultimo = await EXECUTOR_IO.rodar(bot.ultimo_id_conversa, id_cliente)
+    etag = f'W/"{id_cliente}-{ultimo}-{before or 0}-{depois or 0}-{limit or 0}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    response.headers["X-Ultimo-Id"] = str(ultimo)
+    return await EXECUTOR_IO.rodar(bot.get_historico_conversa, id_cliente, antes=before, depois=depois, limite=limit)
+
+def _formatar_sse(evento: Dict[str, Any]) -> str:
+    linhas = []
+    if evento.get("id_conversa"):
+        linhas.append(f"id: {evento['id_conversa']}")
+    linhas.append(f"event: {evento['tipo']}")
+    linhas.append(f"data: {json.dumps(evento, ensure_ascii=False)}")
+    return "\n".join(linhas) + "\n\n"
+
+@api_router.get("/chat/{id_cliente}/eventos")
+async def stream_eventos_chat(id_cliente: str, request: Request, since: Optional[int] = Query(None, ge=0)):
+    # o EventSource reenvia o último id recebido ao reconectar; as mensagens perdidas vêm do banco
+    ultimo_visto = request.headers.get("last-event-id")
+    ultimo_visto = int(ultimo_visto) if ultimo_visto and ultimo_visto.isdigit() else since
+
+    loop = asyncio.get_running_loop()
+    fila: asyncio.Queue = asyncio.Queue(maxsize=SSE_FILA_MAX)
+    # maior id_conversa descartado com a fila cheia: se o replay não cobrir, o stream encerra
+    estado = {"perdido_ate": 0}
+
+    def _enfileirar(evento):
+        try:
+            fila.put_nowait(evento)
+        except asyncio.QueueFull:
+            # cliente lento: encerra o stream e deixa a reconexão recuperar pelo Last-Event-ID
+            estado["perdido_ate"] = max(estado["perdido_ate"], evento.get("id_conversa") or float("inf"))
+
+    def entregar(evento):
+        loop.call_soon_threadsafe(_enfileirar, evento)
+
+    def _descartar_ja_enviados():
+        # o que o replay já mandou não precisa ocupar a fila
+        restantes = []
+        while not fila.empty():
+            evento = fila.get_nowait()
+            if evento.get("id_conversa", 0) > maximo_replay:
+                restantes.append(evento)
+        for evento in restantes:
+            fila.put_nowait(evento)
+
+    # a primeira página sai antes da resposta, para o 503 de executor lotado ainda ser um 503
+    pendentes = []
+    if ultimo_visto is not None:
+        pendentes = await EXECUTOR_IO.rodar(bot.get_historico_conversa, id_cliente, depois=ultimo_visto, limite=SSE_REPLAY_MAX)
+    maximo_replay = pendentes[-1]["id_conversa"] if pendentes else (ultimo_visto or 0)
+
+    async def gerar():
+        nonlocal pendentes, maximo_replay
+        # assina só quando o stream começa: se o cliente cair antes, nada fica pendurado no hub
+        bot.HUB_EVENTOS.assinar(id_cliente, entregar)
+        try:
+            yield "retry: 3000\n\n"
+            # o replay vai em páginas até alcançar o presente; a primeira foi lida antes da assinatura,
+            # então sempre há ao menos mais uma leitura depois dela
+            conferido = False
+            while ultimo_visto is not None:
+                for msg in pendentes:
+                    yield _formatar_sse({"tipo": "mensagem", **msg})
+                if conferido and len(pendentes) < SSE_REPLAY_MAX:
+                    break
+                conferido = True
+                try:
+                    pendentes = await EXECUTOR_IO.rodar(bot.get_historico_conversa, id_cliente, depois=maximo_replay, limite=SSE_REPLAY_MAX)
+                except HTTPException:
+                    return
+                if pendentes:
+                    maximo_replay = pendentes[-1]["id_conversa"]
+                _descartar_ja_enviados()
+            while estado["perdido_ate"] <= maximo_replay:
+                if await request.is_disconnected():
+                    break
+                try:
+                    evento = await asyncio.wait_for(fila.get(), timeout=SSE_HEARTBEAT_S)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if evento.get("id_conversa", 0) <= maximo_replay:
+                    continue
+                yield _formatar_sse(evento)
+        finally:
+            bot.HUB_EVENTOS.cancelar(id_cliente, entregar)
+
+    return StreamingResponse(gerar(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @api_router.get("/clientes/{id_cliente}/perfil")
 async def get_perfil_cliente(id_cliente: str):
-    perfil = bot.get_cliente_perfil(id_cliente)
+    perfil = await EXECUTOR_IO.rodar(bot.get_cliente_perfil, id_cliente)
     if not perfil:
         raise HTTPException(status_code=404, detail="Perfil do cliente não encontrado")
     return perfil
 
+def _proximo_bloco(iterador, fim, cancelado, estado):
+    # roda na thread do executor; se o stream já desistiu enquanto o bloco era montado (timeout),
+    # fecha o gerador aqui mesmo, assim a conexão e a transação de leitura não ficam abertas
+    with estado["trava"]:
+        estado["rodando"] = True
+    try:
+        return next(iterador, fim)
+    finally:
+        with estado["trava"]:
+            estado["rodando"] = False
+            if cancelado.is_set():
+                iterador.close()
+
+async def _iterar_no_executor(iterador, cancelado: threading.Event):
+    # cada bloco do relatório é produzido numa thread do executor de I/O, sem prender o event loop;
+    # o stream inteiro ocupa um único slot, então não há 503 no meio dele
+    fim = object()
+    estado = {"trava": threading.Lock(), "rodando": False}
+    try:
+        EXECUTOR_IO.reservar()
+    except HTTPException:
+        iterador.close()
+        raise
+    try:
+        while True:
+            bloco = await EXECUTOR_IO.rodar_reservado(_proximo_bloco, iterador, fim, cancelado, estado)
+            if bloco is fim:
+                break
+            yield bloco
+    finally:
+        try:
+            cancelado.set()
+            with estado["trava"]:
+                # bloco ainda preso na thread: quem fecha é _proximo_bloco, ao terminar
+                if not estado["rodando"]:
+                    iterador.close()
+        except Exception as e:
+            print(f"Erro ao fechar relatório: {e}")
+        finally:
+            EXECUTOR_IO.liberar()
+
+@api_router.get("/clientes/{id_cliente}/relatorio")
+async def get_relatorio_cliente(
+    id_cliente: str,
+    inicio: Optional[str] = Query(None, description="AAAA-MM-DD"),
+    fim: Optional[str] = Query(None, description="AAAA-MM-DD"),
+    formato: str = Query("html", pattern="^(html|csv|json)$")
+):
+    cliente = await EXECUTOR_IO.rodar(bot.get_cliente_por_id, id_cliente)
+    if not cliente:
+        raise HTTPException(status_code=404, detail="Cliente não encontrado")
+    try:
+        dia_inicio, dia_fim = relatorio.intervalo_relatorio(cliente.get("fuso_horario"), inicio, fim)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    cancelado = threading.Event()
+    iterador = relatorio.gerar_relatorio(id_cliente, dia_inicio, dia_fim, formato, cancelado)
+    headers = {"Cache-Control": "no-store"}
+    if formato == "csv":
+        headers["Content-Disposition"] = f'attachment; filename="relatorio-{id_cliente}-{dia_inicio}-{dia_fim}.csv"'
+    return StreamingResponse(_iterar_no_executor(iterador, cancelado), media_type=relatorio.FORMATOS_RELATORIO[formato], headers=headers)
+
 @api_router.delete("/clientes/{id_cliente}")
 async def delete_cliente(id_cliente: str):
-    sucesso = bot.delete_cliente(id_cliente)
+    sucesso = await EXECUTOR_IO.rodar(bot.delete_cliente, id_cliente)
     if not sucesso:
         raise HTTPException(status_code=500, detail="Erro ao deletar cliente do banco de dados.")
     return {"status": "sucesso", "deleted_id": id_cliente}
 
 @api_router.get("/planos/{id_cliente}")
-async def get_plano_cliente(id_cliente: str):
-    return bot.listar_plano(id_cliente)
+async def get_plano_cliente(id_cliente: str, request: Request, response: Response):
+    # a versão sobe a cada mudança no plano (itens próprios ou do modelo): com a mesma versão o navegador reaproveita o que tem
+    versao = await EXECUTOR_IO.rodar(bot.versao_plano, id_cliente)
+    if versao is None:
+        return {}
+    etag = f'W/"plano-{id_cliente}-{versao}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    return await EXECUTOR_IO.rodar(bot.listar_plano, id_cliente)
 
 @api_router.get("/nutricionistas/{id_nutri}/clientes")
 async def get_lista_clientes(id_nutri: str):
-    return bot.listar_clientes_por_nutri(id_nutri)
+    return await EXECUTOR_IO.rodar(bot.listar_clientes_por_nutri, id_nutri)
+
+@api_router.get("/nutricionistas/{id_nutri}/portfolio")
+async def get_portfolio_nutri(id_nutri: str):
+    return await EXECUTOR_IO.rodar(bot.portfolio_nutri, id_nutri)
 
 @api_router.get("/nutricionistas/{id_nutri}/perfil")
 async def get_perfil_nutri(id_nutri: str):
-    perfil = bot.get_nutri_perfil(id_nutri)
+    perfil = await EXECUTOR_IO.rodar(bot.get_nutri_perfil, id_nutri)
     if not perfil:
         raise HTTPException(status_code=404, detail="Perfil do nutricionista não encontrado")
     return perfil
@@ -131,28 +415,29 @@ async def get_perfil_nutri(id_nutri: str):
 async def put_perfil_nutri(id_nutri: str, request: NutriPerfilRequest):
     senha_para_salvar = request.senha if request.senha else None
     
-    sucesso = bot.update_nutri_perfil(id_nutri, request.nome, request.email, senha_para_salvar)
+    sucesso = await EXECUTOR_IO.rodar(bot.update_nutri_perfil, id_nutri, request.nome, request.email, senha_para_salvar)
     if not sucesso:
         raise HTTPException(status_code=400, detail="Erro ao atualizar perfil. O email pode já estar em uso.")
     return {"status": "sucesso", "nome": request.nome, "email": request.email}
 
 @api_router.get("/nutricionistas/{id_nutri}/bot-config")
 async def get_config_bot(id_nutri: str):
-    config = bot.get_bot_config(id_nutri)
+    config = await EXECUTOR_IO.rodar(bot.get_bot_config, id_nutri)
     if not config:
         raise HTTPException(status_code=404, detail="Configuração não encontrada")
     return config
 
 @api_router.post("/nutricionistas/{id_nutri}/bot-config")
 async def post_config_bot(id_nutri: str, config: BotConfigRequest):
-    sucesso = bot.update_bot_config(id_nutri, config.persona, config.restricoes, config.cor)
+    sucesso = await EXECUTOR_IO.rodar(bot.update_bot_config, id_nutri, config.persona, config.restricoes, config.cor)
     if not sucesso:
         raise HTTPException(status_code=500, detail="Erro ao salvar configuração")
     return {"status": "sucesso"}
 
 @api_router.post("/clientes", status_code=201)
 async def criar_novo_cliente(request: ClienteRequest):
-    idc = bot.criar_cliente(
+    idc = await EXECUTOR_IO.rodar(
+        bot.criar_cliente,
         id_nutri=request.id_nutri,
         nome=request.nome,
         email=request.email,
@@ -161,22 +446,30 @@ async def criar_novo_cliente(request: ClienteRequest):
         sexo=request.sexo,
         peso_kg=request.peso_kg,
         altura_cm=request.altura_cm,
-        atividade=request.atividade
+        atividade=request.atividade,
+        fuso_horario=request.fuso_horario
     )
     if not idc:
-        raise HTTPException(status_code=400, detail="Email de cliente já cadastrado.")
+        raise HTTPException(status_code=400, detail="Email de cliente já cadastrado ou fuso horário inválido.")
     return {"id_cliente": idc, "nome": request.nome}
 
 @api_router.get("/admin/buscar-alimento")
-async def buscar_alimento(q: str):
+async def buscar_alimento(q: str, limit: int = Query(5, ge=1, le=50), offset: int = Query(0, ge=0), score_min: float = Query(60, ge=0, le=100)):
     if len(q) < 3:
         raise HTTPException(status_code=400, detail="Query deve ter pelo menos 3 caracteres")
-    matches = bot.buscar_alimento_base_dados(q)
+    matches = await EXECUTOR_IO.rodar(bot.buscar_alimento_base_dados, q, limite=limit, deslocamento=offset, score_min=score_min)
     return matches
 
+@api_router.get("/admin/metricas")
+async def get_metricas():
+    metricas = bot.metricas()
+    metricas["executores"] = {"inferencia": EXECUTOR_INFERENCIA.estatisticas(), "io": EXECUTOR_IO.estatisticas()}
+    return metricas
+
 @api_router.post("/planos/{id_cliente}")
 async def adicionar_item_plano(id_cliente: str, item: OpcaoPlanoRequest):
-    sucesso = bot.adicionar_opcao_plano(
+    sucesso = await EXECUTOR_INFERENCIA.rodar(
+        bot.adicionar_opcao_plano,
         id_cliente=id_cliente,
         refeicao=item.refeicao,
         nome_alimento=item.nome_alimento,
@@ -189,6 +482,70 @@ async def adicionar_item_plano(id_cliente: str, item: OpcaoPlanoRequest):
         raise HTTPException(status_code=400, detail="Falha ao adicionar item. Talvez já exista.")
     return {"status": "sucesso", "id_cliente": id_cliente, "item_nome": item.nome_alimento}
 
+@api_router.post("/planos/{id_cliente}/lote")
+async def adicionar_plano_lote(id_cliente: str, request: PlanoLoteRequest):
+    if not await EXECUTOR_IO.rodar(bot.get_cliente_por_id, id_cliente):
+        raise HTTPException(status_code=404, detail="Cliente não encontrado")
+    itens = [dict(item) for item in request.itens]
+    return await EXECUTOR_INFERENCIA.rodar(bot.adicionar_opcoes_plano_lote, id_cliente, itens)
+
+@api_router.post("/planos/{id_cliente}/lote/csv")
+async def importar_plano_csv(id_cliente: str, request: Request):
+    try:
+        texto = (await request.body()).decode("utf-8")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="CSV deve estar em UTF-8.")
+    itens = bot.ler_plano_csv(texto)
+    if not itens:
+        raise HTTPException(status_code=400, detail="CSV vazio ou sem cabeçalho.")
+    if not await EXECUTOR_IO.rodar(bot.get_cliente_por_id, id_cliente):
+        raise HTTPException(status_code=404, detail="Cliente não encontrado")
+    return await EXECUTOR_INFERENCIA.rodar(bot.adicionar_opcoes_plano_lote, id_cliente, itens)
+
+@api_router.post("/nutricionistas/{id_nutri}/modelos", status_code=201)
+async def criar_modelo_plano(id_nutri: str, request: ModeloPlanoRequest):
+    id_modelo = await EXECUTOR_IO.rodar(bot.criar_modelo_plano, id_nutri, request.nome)
+    if not id_modelo:
+        raise HTTPException(status_code=400, detail="Erro ao criar modelo de plano.")
+    resposta = {"id_modelo": id_modelo, "nome": request.nome}
+    if request.itens:
+        itens = [dict(item) for item in request.itens]
+        resposta["importacao"] = await EXECUTOR_INFERENCIA.rodar(bot.adicionar_itens_modelo, id_modelo, itens)
+    return resposta
+
+@api_router.get("/nutricionistas/{id_nutri}/modelos")
+async def get_modelos_plano(id_nutri: str):
+    return await EXECUTOR_IO.rodar(bot.listar_modelos_plano, id_nutri)
+
+@api_router.get("/modelos/{id_modelo}")
+async def get_modelo_plano(id_modelo: str):
+    modelo = await EXECUTOR_IO.rodar(bot.get_modelo_plano, id_modelo)
+    if not modelo:
+        raise HTTPException(status_code=404, detail="Modelo de plano não encontrado")
+    modelo["plano"] = await EXECUTOR_IO.rodar(bot.listar_itens_modelo, id_modelo)
+    return modelo
+
+@api_router.post("/modelos/{id_modelo}/itens")
+async def adicionar_itens_modelo(id_modelo: str, request: PlanoLoteRequest):
+    if not await EXECUTOR_IO.rodar(bot.get_modelo_plano, id_modelo):
+        raise HTTPException(status_code=404, detail="Modelo de plano não encontrado")
+    itens = [dict(item) for item in request.itens]
+    return await EXECUTOR_INFERENCIA.rodar(bot.adicionar_itens_modelo, id_modelo, itens)
+
+@api_router.delete("/modelos/{id_modelo}")
+async def delete_modelo_plano(id_modelo: str):
+    sucesso = await EXECUTOR_IO.rodar(bot.delete_modelo_plano, id_modelo)
+    if not sucesso:
+        raise HTTPException(status_code=500, detail="Erro ao deletar modelo de plano.")
+    return {"status": "sucesso", "deleted_id": id_modelo}
+
+@api_router.put("/clientes/{id_cliente}/modelo")
+async def atribuir_modelo_cliente(id_cliente: str, request: AtribuirModeloRequest):
+    sucesso = await EXECUTOR_IO.rodar(bot.atribuir_modelo_cliente, id_cliente, request.id_modelo)
+    if not sucesso:
+        raise HTTPException(status_code=404, detail="Cliente ou modelo não encontrado (o modelo deve ser da mesma nutricionista).")
+    return {"status": "sucesso", "id_cliente": id_cliente, "id_modelo": request.id_modelo}
+
 app.include_router(api_router, prefix="/api")
 
 app.mount("/Acesso_Cliente", StaticFiles(directory="Acesso_Cliente", html=True), name="cliente_app")
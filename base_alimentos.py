@@ -0,0 +1,253 @@
+import os
+import bisect
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from rapidfuzz import process, fuzz, utils
+from unidecode import unidecode
+
+ARQUIVO_XLSX = "base-comidas-tratada.xlsx"
+ABA_XLSX = "basona"
+ARQUIVO_COMPILADO = "base-comidas-tratada.npz"
+VERSAO_FORMATO = 1
+PESO_SEMANTICO = 0.5
+MAX_CANDIDATOS_SEMANTICOS = 20
+PENALIDADE_PALAVRA_EXTRA = 3.0
+
+COLUNAS_VAZIAS = ["descricao_alimento", "descricao_alimento_norm", "energia_kcal", "proteina_g", "carboidrato_g", "lipideo_g"]
+
+def normalizar_descricoes(serie: pd.Series) -> pd.Series:
+    return serie.astype(str).str.lower().str.strip().map(unidecode)
+
+def _assinatura_rapida(caminho: str) -> str:
+    st = os.stat(caminho)
+    return f"{VERSAO_FORMATO}:{st.st_size}:{st.st_mtime_ns}"
+
+def _hash_arquivo(caminho: str) -> str:
+    h = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloco)
+    return f"{VERSAO_FORMATO}:{h.hexdigest()}"
+
+def compilar_base_alimentos(caminho_xlsx: str = ARQUIVO_XLSX, destino: str = ARQUIVO_COMPILADO) -> pd.DataFrame:
+    df = pd.read_excel(caminho_xlsx, sheet_name=ABA_XLSX)
+    df["descricao_alimento_norm"] = normalizar_descricoes(df["descricao_alimento"])
+
+    arrays = {}
+    for i, coluna in enumerate(df.columns):
+        serie = df[coluna]
+        if pd.api.types.is_numeric_dtype(serie):
+            arrays[f"num_{i}"] = serie.to_numpy()
+        else:
+            # colunas mistas (ex.: "Tr" no meio de números) guardam a parte numérica e a textual separadas
+            numeros = pd.to_numeric(serie, errors="coerce")
+            textos = serie.where(numeros.isna() & serie.notna(), "").astype(str)
+            arrays[f"num_{i}"] = numeros.to_numpy(dtype=np.float64)
+            arrays[f"txt_{i}"] = textos.to_numpy(dtype=str)
+
+    temporario = destino + ".tmp"
+    try:
+        with open(temporario, "wb") as f:
+            np.savez(
+                f,
+                colunas=np.array([str(c) for c in df.columns]),
+                assinatura=np.array(_assinatura_rapida(caminho_xlsx)),
+                hash_xlsx=np.array(_hash_arquivo(caminho_xlsx)),
+                **arrays
+            )
+        os.replace(temporario, destino)
+    except OSError as e:
+        print(f"[AVISO] não foi possível salvar a base compilada '{destino}': {e}")
+    return df
+
+def _ler_compilado(destino: str) -> pd.DataFrame:
+    with np.load(destino, allow_pickle=False) as dados:
+        colunas = [str(c) for c in dados["colunas"]]
+        dados_colunas = {}
+        for i, coluna in enumerate(colunas):
+            numeros = dados[f"num_{i}"]
+            if f"txt_{i}" not in dados.files:
+                dados_colunas[coluna] = numeros
+                continue
+            textos = dados[f"txt_{i}"]
+            valores = np.empty(len(numeros), dtype=object)
+            eh_numero = ~np.isnan(numeros)
+            valores[eh_numero] = numeros[eh_numero]
+            tem_texto = ~eh_numero & (textos != "")
+            valores[tem_texto] = textos[tem_texto]
+            valores[~eh_numero & ~tem_texto] = None
+            dados_colunas[coluna] = valores
+    return pd.DataFrame(dados_colunas, columns=colunas)
+
+def _compilado_valido(caminho_xlsx: str, destino: str) -> bool:
+    if not os.path.exists(destino):
+        return False
+    try:
+        with np.load(destino, allow_pickle=False) as dados:
+            assinatura = str(dados["assinatura"])
+            hash_salvo = str(dados["hash_xlsx"])
+    except Exception:
+        return False
+    if assinatura == _assinatura_rapida(caminho_xlsx):
+        return True
+    # mtime mudou (ex.: checkout do git), mas o conteúdo pode ser o mesmo
+    return hash_salvo == _hash_arquivo(caminho_xlsx)
+
+def carregar_base_alimentos(caminho_xlsx: str = ARQUIVO_XLSX, destino: str = ARQUIVO_COMPILADO) -> pd.DataFrame:
+    if not os.path.exists(caminho_xlsx):
+        if os.path.exists(destino):
+            return _ler_compilado(destino)
+        raise FileNotFoundError(f"Base de alimentos '{caminho_xlsx}' não encontrada.")
+
+    if _compilado_valido(caminho_xlsx, destino):
+        try:
+            return _ler_compilado(destino)
+        except Exception as e:
+            print(f"[AVISO] base compilada '{destino}' ilegível, recompilando: {e}")
+
+    return compilar_base_alimentos(caminho_xlsx, destino)
+
+def _trigramas(texto: str) -> set:
+    texto = f"  {texto} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+class IndiceAlimentos:
+    def __init__(self, df: pd.DataFrame, max_candidatos: int = 200, tamanho_cache: int = 512):
+        self.escolhas = df["descricao_alimento_norm"].astype(str).tolist() if len(df) else []
+        self.resultados = [
+            {k: (v if pd.notna(v) else None) for k, v in linha.items()}
+            for linha in df.to_dict(orient="records")
+        ]
+        self.ordenados = sorted((texto, idx) for idx, texto in enumerate(self.escolhas))
+        self.num_palavras = np.array([len(utils.default_process(texto).split()) for texto in self.escolhas], dtype=np.float64)
+        self.max_candidatos = max_candidatos
+
+        postings: Dict[str, List[int]] = {}
+        for idx, texto in enumerate(self.escolhas):
+            for tri in _trigramas(texto):
+                postings.setdefault(tri, []).append(idx)
+        self.trigramas = {tri: np.asarray(ids, dtype=np.int32) for tri, ids in postings.items()}
+
+        self._cache: "OrderedDict[Tuple[str, float], Tuple[List[Tuple[int, float]], bool]]" = OrderedDict()
+        self._tamanho_cache = tamanho_cache
+        self._lock = threading.Lock()
+        # uma linha normalizada por alimento, na mesma ordem de self.escolhas (normalmente um .npy mapeado em memória)
+        self.embeddings: Optional[np.ndarray] = None
+
+    def usar_embeddings(self, matriz: np.ndarray):
+        if matriz.shape[0] != len(self.escolhas):
+            raise ValueError(f"Matriz com {matriz.shape[0]} linhas para {len(self.escolhas)} alimentos.")
+        self.embeddings = matriz
+
+    def __len__(self) -> int:
+        return len(self.escolhas)
+
+    def _prefixos(self, consulta: str) -> List[int]:
+        inicio = bisect.bisect_left(self.ordenados, (consulta, -1))
+        ids = []
+        for texto, idx in self.ordenados[inicio:]:
+            if not texto.startswith(consulta):
+                break
+            ids.append(idx)
+        return ids
+
+    def _candidatos(self, consulta: str) -> np.ndarray:
+        listas = [self.trigramas[tri] for tri in _trigramas(consulta) if tri in self.trigramas]
+        if not listas:
+            return np.zeros(0, dtype=np.int32)
+        contagem = np.bincount(np.concatenate(listas), minlength=len(self.escolhas))
+        com_hits = np.flatnonzero(contagem)
+        if len(com_hits) <= self.max_candidatos:
+            return com_hits
+        melhores = np.argpartition(-contagem, self.max_candidatos - 1)[:self.max_candidatos]
+        return melhores
+
+    def _ranquear(self, consulta: str, score_min: float, minimo: int) -> Tuple[List[Tuple[int, float]], bool]:
+        # devolve também se o ranking cobriu a base toda
+        candidatos = set(self._candidatos(consulta).tolist())
+        candidatos.update(self._prefixos(consulta))
+        if candidatos:
+            ranking = self._extrair(consulta, candidatos, score_min)
+            # o pré-filtro perde acertos sem trigramas em comum ("peixe" -> "mexerica, murcote"):
+            # se não sobrou o bastante para a página pedida, cai na varredura completa
+            if len(ranking) >= minimo:
+                return ranking, False
+        return self._extrair(consulta, range(len(self.escolhas)), score_min), True
+
+    def _extrair(self, consulta: str, candidatos, score_min: float) -> List[Tuple[int, float]]:
+        escolhas = {idx: self.escolhas[idx] for idx in candidatos}
+        achados = process.extract(consulta, escolhas, scorer=fuzz.WRatio, score_cutoff=score_min, limit=None)
+        return sorted(((idx, score) for _, score, idx in achados), key=lambda par: (-par[1], par[0]))
+
+    def _ranking_texto(self, consulta: str, score_min: float, minimo: int) -> List[Tuple[int, float]]:
+        chave = (consulta, float(score_min))
+        with self._lock:
+            entrada = self._cache.get(chave)
+            if entrada is not None:
+                self._cache.move_to_end(chave)
+        # um ranking pré-filtrado curto demais para esta página é refeito com a varredura completa
+        if entrada is None or (not entrada[1] and len(entrada[0]) < minimo):
+            entrada = self._ranquear(consulta, score_min, minimo)
+            with self._lock:
+                self._cache[chave] = entrada
+                while len(self._cache) > self._tamanho_cache:
+                    self._cache.popitem(last=False)
+        return entrada[0]
+
+    def buscar(self, consulta: str, limite: int = 5, deslocamento: int = 0, score_min: float = 60) -> List[Dict[str, Any]]:
+        consulta = unidecode(consulta.lower().strip())
+        if not consulta or not self.escolhas:
+            return []
+        ranking = self._ranking_texto(consulta, score_min, limite + deslocamento)
+        return [dict(self.resultados[idx], score=score) for idx, score in ranking[deslocamento:deslocamento + limite]]
+
+    def _ranking_hibrido(self, consulta: str, sims: np.ndarray, score_min: float) -> List[Tuple[int, float, float, float]]:
+        # candidatos: os do texto (trigramas/prefixo) mais os mais próximos no espaço semântico
+        k = min(MAX_CANDIDATOS_SEMANTICOS, sims.shape[0])
+        semanticos = np.argpartition(-sims, k - 1)[:k] if k < sims.shape[0] else np.arange(sims.shape[0])
+        conjunto = set(self._candidatos(consulta).tolist()) | set(self._prefixos(consulta)) | set(semanticos.tolist())
+        candidatos = np.fromiter(conjunto, dtype=np.int64, count=len(conjunto))
+
+        # as descrições são longas ("ovo, de galinha, inteiro, cozido/10minutos") e o usuário escreve pouco:
+        # token_set compara só as palavras em comum; cada palavra a mais na descrição custa um pouco,
+        # senão "frango grelhado" empata com todo "frango, <parte>, grelhado"
+        score_texto = process.cdist([consulta], [self.escolhas[i] for i in candidatos.tolist()],
+                                    scorer=fuzz.token_set_ratio, processor=utils.default_process)[0].astype(np.float64)
+        extras = np.maximum(self.num_palavras[candidatos] - len(utils.default_process(consulta).split()), 0.0)
+        score_texto = np.clip(score_texto - PENALIDADE_PALAVRA_EXTRA * extras, 0.0, 100.0)
+        score_semantico = np.clip(sims[candidatos], 0.0, 1.0) * 100.0
+        score = PESO_SEMANTICO * score_semantico + (1.0 - PESO_SEMANTICO) * score_texto
+        ordem = np.lexsort((candidatos, -score))
+        return [(int(candidatos[i]), float(score[i]), float(score_texto[i]), float(score_semantico[i]))
+                for i in ordem if score[i] >= score_min]
+
+    def buscar_lote(self, consultas: List[str], vetores: Optional[np.ndarray] = None, limite: int = 5,
+                    deslocamento: int = 0, score_min: float = 60, score_min_texto: Optional[float] = None) -> List[List[Dict[str, Any]]]:
+        # sem vetores (modelo fora do ar) cai para a busca só por texto; o WRatio tem outra escala que o
+        # score híbrido, então esse caminho usa o próprio limiar (score_min_texto)
+        if vetores is None or self.embeddings is None or not self.escolhas:
+            limiar = score_min if score_min_texto is None else score_min_texto
+            return [self.buscar(c, limite, deslocamento, limiar) for c in consultas]
+
+        # uma multiplicação só para todas as consultas da mensagem
+        sims = np.asarray(vetores, dtype=np.float32) @ np.asarray(self.embeddings, dtype=np.float32).T
+        resultados = []
+        for consulta, linha in zip(consultas, sims):
+            consulta = unidecode(consulta.lower().strip())
+            if not consulta:
+                resultados.append([])
+                continue
+            ranking = self._ranking_hibrido(consulta, linha, score_min)
+            resultados.append([
+                dict(self.resultados[idx], score=score, score_texto=texto, score_semantico=semantico)
+                for idx, score, texto, semantico in ranking[deslocamento:deslocamento + limite]
+            ])
+        return resultados
+
+if __name__ == "__main__":
+    df = compilar_base_alimentos()
+    print(f"Base compilada em '{ARQUIVO_COMPILADO}': {len(df)} itens, {len(df.columns)} colunas.")
@@ -1,10 +1,8 @@
-import pandas as pd
 from rapidfuzz import process
-from unidecode import unidecode
+from base_alimentos import carregar_base_alimentos
 
 
-df = pd.read_excel(r"base-comidas-tratada.xlsx", sheet_name="basona")
-df["descricao_alimento_norm"] = df["descricao_alimento"].str.lower().str.strip().apply(lambda x: unidecode(x))
+df = carregar_base_alimentos()
 
 def buscar_alimento(nome_alimento, quantidade=None, limite_similaridade=50):
     nome_alimento = nome_alimento.lower().strip()
@@ -2,16 +2,31 @@
 import os
 import json
 import re
+import time
+import hashlib
 import math
+import threading
+import queue
+from concurrent.futures import Future
+import numpy as np
 import pandas as pd
-from rapidfuzz import process
 import uuid
+import csv
+import io
+from collections import OrderedDict
 from unidecode import unidecode
-from datetime import datetime, date
-from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime, timezone, tzinfo
+from functools import lru_cache
+from contextlib import contextmanager
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from typing import List, Dict, Any, Optional, Tuple, Callable
 import sqlite3 
+from base_alimentos import carregar_base_alimentos, IndiceAlimentos, COLUNAS_VAZIAS
+from vetores import codificar_vetor, ler_cabecalho, id_modelo, MatrizCompacta, FORMATOS
+from metricas_nutri import (FATORES_ATIVIDADE, calcular_bmr, calcular_tdee, recomendacao_agua_ml, calcular_imc,
+                            classificar_imc, metricas_dataframe, metricas_de_cliente, CacheMetricas, chave_metricas)
 try:
-    from sentence_transformers import SentenceTransformer, util
+    from sentence_transformers import SentenceTransformer
 except Exception as e:
     raise RuntimeError("Erro ao importar sentence-transformers. "
                        "Instale com: pip install sentence-transformers torch numpy") from e
@@ -19,67 +34,452 @@ except Exception as e:
 MODELO_EMBEDDING = "paraphrase-multilingual-MiniLM-L12-v2"
 MODELO_IA = None
 DF_ALIMENTOS = None
-INTENCOES_EMBED = {}
+INDICE_ALIMENTOS: Optional[IndiceAlimentos] = None
+INTENCOES_CHAVES: List[str] = []
+INTENCOES_MATRIZ = np.zeros((0, 0), dtype=np.float32)
+INTENCOES_ROTULOS = np.zeros(0, dtype=np.int32)
+INTENCOES_INICIOS = np.zeros(0, dtype=np.int64)
+INTENCOES_CENTROIDES = np.zeros((0, 0), dtype=np.float32)
+MODOS_INTENCAO = ("exemplos", "centroide")
+MODO_INTENCAO = os.environ.get("OTRI_MODO_INTENCAO", "exemplos")
+if MODO_INTENCAO not in MODOS_INTENCAO:
+    print(f"[AVISO] OTRI_MODO_INTENCAO inválido ({MODO_INTENCAO}), usando exemplos.")
+    MODO_INTENCAO = "exemplos"
 
 ARQUIVO_BANCO = "nutri.db" 
+FUSO_PADRAO = "America/Sao_Paulo"
+TAMANHO_CACHE_EMBEDDINGS = 2048
+TAMANHO_CACHE_PLANOS = 1024
+TAMANHO_CACHE_METRICAS = 4096
+TAMANHO_CACHE_MATRIZES_CLIENTES = 1024
+TAMANHO_CACHE_MATRIZES_MODELOS = 128
+FORMATO_EMBEDDING = os.environ.get("OTRI_FORMATO_EMBEDDING", "int8")
+if FORMATO_EMBEDDING not in FORMATOS:
+    print(f"[AVISO] OTRI_FORMATO_EMBEDDING inválido ({FORMATO_EMBEDDING}), usando int8.")
+    FORMATO_EMBEDDING = "int8"
+LOG_SINCRONO = os.environ.get("OTRI_LOG_SINCRONO", "0") == "1"
+LOG_FILA_MAX = int(os.environ.get("OTRI_LOG_FILA", "1000"))
+LOG_LOTE_MAX = int(os.environ.get("OTRI_LOG_LOTE_MAX", "200"))
+LOG_ESPERA_MAX_MS = float(os.environ.get("OTRI_LOG_ESPERA_MAX_MS", "0"))
+GRAVACAO_TIMEOUT_S = 10.0
+CODIFICACAO_TIMEOUT_S = 30.0
+LOTE_ATIVO = os.environ.get("OTRI_LOTE_ATIVO", "1") == "1"
+LOTE_MAX_ITENS = int(os.environ.get("OTRI_LOTE_MAX_ITENS", "32"))
+LOTE_ESPERA_MAX_MS = float(os.environ.get("OTRI_LOTE_ESPERA_MAX_MS", "5"))
+DIRETORIO_CACHE = "cache_embeddings"
+TEMPOS_INICIALIZACAO: Dict[str, float] = {}
+_NAO_CARREGADO = object()
 
-FATORES_ATIVIDADE = {
-    "sedentario": 1.2,
-    "leve": 1.375,
-    "moderado": 1.55,
-    "ativo": 1.725,
-    "muito_ativo": 1.9
-}
 MEAL_KEYS = ["cafe da manha", "almoco", "lanche", "lanche da tarde", "janta", "ceia", "lanche noturno"]
-GRAMAS_PATTERN = re.compile(r'(\d+(?:[.,]\d+)?)\s*(g|gramas|grama|gr)\b', re.I)
-ITEM_GRAMA_PAIR_PATTERN = re.compile(r'([A-Za-zÀ-ú0-9\s\-\+]+?)\s*,?\s*(\d+(?:[.,]\d+)?\s*(?:g|gramas|gr)\b)', re.I)
+# ml conta como grama (água e bebidas)
+GRAMAS_PATTERN = re.compile(r'(\d+(?:[.,]\d+)?)\s*(g|gramas|grama|gr|ml)\b', re.I)
+ITEM_GRAMA_PAIR_PATTERN = re.compile(r'([A-Za-zÀ-ú0-9\s\-\+]+?)\s*,?\s*(\d+(?:[.,]\d+)?\s*(?:g|gramas|gr|ml)\b)', re.I)
+# "300 ml de água", "100g de arroz e 50g de feijão no almoço": a quantidade vem antes do alimento
+QUANTIDADE_DE_ITEM_PATTERN = re.compile(
+    r'(\d+(?:[.,]\d+)?)\s*(?:g|gramas|grama|gr|ml)\s+(?:de|do|da|dos|das)\s+(.+?)(?=\s+e\s+\d|\s*[,;]|\s+(?:no|na|em|pro|pra)\s|$)', re.I)
+
+def _hash_conteudo(*partes: bytes) -> str:
+    h = hashlib.sha256()
+    for parte in partes:
+        h.update(parte)
+    return h.hexdigest()
+
+def carregar_artefato_embeddings(nome: str, chave: str, gerar) -> np.ndarray:
+    caminho = os.path.join(DIRETORIO_CACHE, f"{nome}-{chave[:16]}.npy")
+    if os.path.exists(caminho):
+        try:
+            return np.load(caminho, mmap_mode="r")
+        except Exception as e:
+            print(f"[AVISO] cache '{caminho}' inválido, gerando de novo: {e}")
+
+    matriz = np.asarray(gerar(), dtype=np.float32)
+    try:
+        os.makedirs(DIRETORIO_CACHE, exist_ok=True)
+        for antigo in os.listdir(DIRETORIO_CACHE):
+            if antigo.startswith(f"{nome}-") and antigo.endswith(".npy"):
+                os.remove(os.path.join(DIRETORIO_CACHE, antigo))
+        temporario = caminho + ".tmp"
+        with open(temporario, "wb") as f:
+            np.save(f, matriz)
+        os.replace(temporario, caminho)
+    except Exception as e:
+        print(f"[AVISO] não foi possível salvar o cache '{caminho}': {e}")
+    return matriz
 
 def carregar_modelos():
-    global MODELO_IA, DF_ALIMENTOS, INTENCOES_EMBED
+    global MODELO_IA, DF_ALIMENTOS, INDICE_ALIMENTOS
     
     if MODELO_IA: 
         return
 
+    inicio_total = time.perf_counter()
+
     print("Carregando modelo de IA...")
+    inicio = time.perf_counter()
     MODELO_IA = SentenceTransformer(MODELO_EMBEDDING)
+    if LOTE_ATIVO:
+        iniciar_codificador(MODELO_IA)
+    TEMPOS_INICIALIZACAO["modelo"] = time.perf_counter() - inicio
     print("Modelo de IA carregado.")
 
     print("Carregando base de alimentos...")
+    inicio = time.perf_counter()
     try:
-        DF_ALIMENTOS = pd.read_csv("base-comidas-tratada.xlsx - basona.csv")
-        if "descricao_alimento" not in DF_ALIMENTOS.columns:
-            raise ValueError("Coluna 'descricao_alimento' não encontrada no CSV.")
-            
-        DF_ALIMENTOS["descricao_alimento_norm"] = DF_ALIMENTOS["descricao_alimento"].astype(str).str.lower().str.strip().apply(lambda x: unidecode(x))
+        DF_ALIMENTOS = carregar_base_alimentos()
         print(f"Base de alimentos carregada: {len(DF_ALIMENTOS)} itens.")
     except Exception as e:
-        print(f"Erro ao carregar 'base-comidas-tratada.xlsx - basona.csv': {e}")
+        print(f"Erro fatal ao carregar base de alimentos: {e}")
+        DF_ALIMENTOS = pd.DataFrame(columns=COLUNAS_VAZIAS)
+    INDICE_ALIMENTOS = IndiceAlimentos(DF_ALIMENTOS)
+    if len(INDICE_ALIMENTOS):
+        # matriz da base calculada uma vez por (modelo, conteúdo da base) e mapeada do disco nas próximas subidas
+        escolhas = INDICE_ALIMENTOS.escolhas
+        chave_cache = _hash_conteudo(MODELO_EMBEDDING.encode("utf-8"), "\n".join(escolhas).encode("utf-8"))
         try:
-            DF_ALIMENTOS = pd.read_excel("base-comidas-tratada.xlsx", sheet_name="basona")
-            DF_ALIMENTOS["descricao_alimento_norm"] = DF_ALIMENTOS["descricao_alimento"].astype(str).str.lower().str.strip().apply(lambda x: unidecode(x))
-            print(f"Base de alimentos (Excel) carregada: {len(DF_ALIMENTOS)} itens.")
-        except Exception as e_xlsx:
-            print(f"Erro fatal ao carregar base de alimentos: {e_xlsx}")
-            DF_ALIMENTOS = pd.DataFrame(columns=["descricao_alimento", "descricao_alimento_norm", "energia_kcal", "proteina_g", "carboidrato_g", "lipideo_g"])
+            INDICE_ALIMENTOS.usar_embeddings(carregar_artefato_embeddings(
+                "alimentos", chave_cache,
+                lambda: MODELO_IA.encode(escolhas, convert_to_numpy=True, normalize_embeddings=True, batch_size=64)
+            ))
+        except Exception as e:
+            print(f"[AVISO] busca semântica na base de alimentos desativada: {e}")
+    TEMPOS_INICIALIZACAO["base_alimentos"] = time.perf_counter() - inicio
 
     print("Carregando intenções...")
+    inicio = time.perf_counter()
     CAMINHO_INTENCOES = "intencoes.json"
     if os.path.exists(CAMINHO_INTENCOES):
-        with open(CAMINHO_INTENCOES, "r", encoding="utf-8") as f:
-            INTENCOES_EXEMPLO = json.load(f)
-        
-        INTENCOES_EMBED = {k: MODELO_IA.encode(v, convert_to_tensor=True) for k, v in INTENCOES_EXEMPLO.items()}
-        print("Intenções carregadas.")
+        with open(CAMINHO_INTENCOES, "rb") as f:
+            conteudo = f.read()
+        INTENCOES_EXEMPLO = json.loads(conteudo.decode("utf-8"))
+
+        chaves = [k for k, v in INTENCOES_EXEMPLO.items() if v]
+        exemplos = [ex for k in chaves for ex in INTENCOES_EXEMPLO[k]]
+        rotulos = [i for i, k in enumerate(chaves) for _ in INTENCOES_EXEMPLO[k]]
+        embs = None
+        if exemplos:
+            chave_cache = _hash_conteudo(MODELO_EMBEDDING.encode("utf-8"), conteudo)
+            embs = carregar_artefato_embeddings(
+                "intencoes", chave_cache,
+                lambda: MODELO_IA.encode(exemplos, convert_to_numpy=True, normalize_embeddings=True, batch_size=64)
+            )
+        _montar_indice_intencoes(chaves, rotulos, embs)
+        print(f"Intenções carregadas: {len(chaves)} intenções, {len(exemplos)} exemplos.")
     else:
         print(f"Aviso: Arquivo '{CAMINHO_INTENCOES}' não encontrado. A IA de intenção ficará limitada.")
-        INTENCOES_EXEMPLO = {}
-        INTENCOES_EMBED = {}
+        _montar_indice_intencoes([], [], None)
+    TEMPOS_INICIALIZACAO["intencoes"] = time.perf_counter() - inicio
 
-def get_db():
-    db = sqlite3.connect(ARQUIVO_BANCO, check_same_thread=False)
+    TEMPOS_INICIALIZACAO["total"] = time.perf_counter() - inicio_total
+    print("Tempos de inicialização: " + ", ".join(f"{fase}={seg:.2f}s" for fase, seg in TEMPOS_INICIALIZACAO.items()))
+
+def _montar_indice_intencoes(chaves: List[str], rotulos: List[int], embs: Optional[np.ndarray]):
+    global INTENCOES_CHAVES, INTENCOES_MATRIZ, INTENCOES_ROTULOS, INTENCOES_INICIOS, INTENCOES_CENTROIDES
+
+    if embs is None or len(chaves) == 0:
+        INTENCOES_CHAVES = []
+        INTENCOES_MATRIZ = np.zeros((0, 0), dtype=np.float32)
+        INTENCOES_ROTULOS = np.zeros(0, dtype=np.int32)
+        INTENCOES_INICIOS = np.zeros(0, dtype=np.int64)
+        INTENCOES_CENTROIDES = np.zeros((0, 0), dtype=np.float32)
+        return
+
+    matriz = np.asarray(embs, dtype=np.float32)
+    rotulos_arr = np.asarray(rotulos, dtype=np.int32)
+    # os exemplos chegam agrupados por intenção, então cada intenção é um bloco contíguo
+    inicios = np.flatnonzero(np.r_[True, rotulos_arr[1:] != rotulos_arr[:-1]])
+
+    centroides = np.add.reduceat(matriz, inicios, axis=0)
+    normas = np.linalg.norm(centroides, axis=1, keepdims=True)
+    normas[normas == 0] = 1.0
+
+    INTENCOES_CHAVES = list(chaves)
+    INTENCOES_MATRIZ = matriz
+    INTENCOES_ROTULOS = rotulos_arr
+    INTENCOES_INICIOS = inicios
+    INTENCOES_CENTROIDES = (centroides / normas).astype(np.float32)
+
+PRAGMAS_BANCO = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=134217728",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+_CONEXOES: Dict[threading.Thread, sqlite3.Connection] = {}
+_CONEXOES_LOCK = threading.Lock()
+METRICAS_CONEXOES = {"abertas": 0, "fechadas": 0, "aquisicoes": 0}
+
+def abrir_conexao() -> sqlite3.Connection:
+    db = sqlite3.connect(ARQUIVO_BANCO, check_same_thread=False, timeout=5.0, cached_statements=256)
     db.row_factory = sqlite3.Row 
+    for pragma in PRAGMAS_BANCO:
+        db.execute(pragma)
+    return db
+
+def _fechar_conexoes_de_threads_mortas():
+    for thread in [t for t in _CONEXOES if not t.is_alive()]:
+        _CONEXOES.pop(thread).close()
+        METRICAS_CONEXOES["fechadas"] += 1
+
+def get_db():
+    thread = threading.current_thread()
+    with _CONEXOES_LOCK:
+        METRICAS_CONEXOES["aquisicoes"] += 1
+        db = _CONEXOES.get(thread)
+        if db is not None:
+            return db
+        _fechar_conexoes_de_threads_mortas()
+
+    db = abrir_conexao()
+    with _CONEXOES_LOCK:
+        _CONEXOES[thread] = db
+        METRICAS_CONEXOES["abertas"] += 1
     return db
 
+def fechar_conexoes():
+    with _CONEXOES_LOCK:
+        for db in _CONEXOES.values():
+            try:
+                db.close()
+            except Exception as e:
+                print(f"Erro ao fechar conexão: {e}")
+            METRICAS_CONEXOES["fechadas"] += 1
+        _CONEXOES.clear()
+
+def estatisticas_conexoes() -> Dict[str, Any]:
+    with _CONEXOES_LOCK:
+        estat = dict(METRICAS_CONEXOES)
+        estat["ativas"] = len(_CONEXOES)
+    estat["reutilizadas"] = estat["aquisicoes"] - estat["abertas"]
+    return estat
+
+@lru_cache(maxsize=64)
+def obter_fuso(nome: Optional[str]) -> tzinfo:
+    try:
+        return ZoneInfo(nome or FUSO_PADRAO)
+    except (ZoneInfoNotFoundError, ValueError):
+        print(f"[AVISO] fuso horário '{nome}' desconhecido, usando UTC.")
+        return timezone.utc
+
+def fuso_valido(nome: str) -> bool:
+    try:
+        ZoneInfo(nome)
+        return True
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+
+def instante_atual() -> Tuple[str, int]:
+    agora = datetime.now(timezone.utc)
+    return agora.replace(tzinfo=None).isoformat(), int(agora.timestamp() * 1000)
+
+def iso_utc_para_ms(texto: str) -> Optional[int]:
+    try:
+        dt = datetime.fromisoformat(texto)
+    except (TypeError, ValueError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+def chave_dia(ts_ms: int, fuso: Optional[str]) -> int:
+    dt = datetime.fromtimestamp(ts_ms / 1000.0, tz=obter_fuso(fuso))
+    return dt.year * 10000 + dt.month * 100 + dt.day
+
+def chave_dia_hoje(fuso: Optional[str]) -> int:
+    return chave_dia(int(time.time() * 1000), fuso)
+
+def _migrar_timestamps(db: sqlite3.Connection):
+    fusos = {r[0]: r[1] for r in db.execute("SELECT id_cliente, fuso_horario FROM clientes")}
+
+    atualizacoes = []
+    for id_registro, id_cliente, data_hora in db.execute("SELECT id_registro, id_cliente, data_hora FROM registros_consumo"):
+        ts = iso_utc_para_ms(data_hora)
+        if ts is not None:
+            atualizacoes.append((ts, chave_dia(ts, fusos.get(id_cliente)), id_registro))
+    db.executemany("UPDATE registros_consumo SET ts_ms = ?, dia = ? WHERE id_registro = ?", atualizacoes)
+
+    atualizacoes = []
+    for id_conversa, momento in db.execute("SELECT id_conversa, time FROM conversas"):
+        ts = iso_utc_para_ms(momento)
+        if ts is not None:
+            atualizacoes.append((ts, id_conversa))
+    db.executemany("UPDATE conversas SET ts_ms = ? WHERE id_conversa = ?", atualizacoes)
+
+def reconstruir_consumo_diario(db: sqlite3.Connection, id_cliente: Optional[str]=None):
+    filtro = "AND id_cliente = ?" if id_cliente else ""
+    parametros = (id_cliente,) if id_cliente else ()
+    db.execute(f"DELETE FROM consumo_diario WHERE 1=1 {filtro}", parametros)
+    db.execute(
+        f"""INSERT INTO consumo_diario (id_cliente, dia, kcal, prot_g, carb_g, fat_g, agua_ml, itens)
+            SELECT id_cliente, dia, COALESCE(SUM(kcal), 0), COALESCE(SUM(prot_g), 0), COALESCE(SUM(carb_g), 0),
+                   COALESCE(SUM(fat_g), 0), COALESCE(SUM(agua_ml), 0), COUNT(*)
+            FROM registros_consumo WHERE dia IS NOT NULL {filtro}
+            GROUP BY id_cliente, dia""",
+        parametros
+    )
+
+def _migrar_embeddings_compartilhados(db: sqlite3.Connection):
+    db.execute(
+        """INSERT OR IGNORE INTO embeddings_itens (texto, vec)
+           SELECT embedding_texto, embedding_vec FROM planos
+           WHERE embedding_vec IS NOT NULL AND embedding_texto IS NOT NULL"""
+    )
+    db.execute(
+        """UPDATE planos SET id_embedding = (SELECT e.id_embedding FROM embeddings_itens e WHERE e.texto = planos.embedding_texto)
+           WHERE embedding_vec IS NOT NULL AND embedding_texto IS NOT NULL"""
+    )
+    db.execute("UPDATE planos SET embedding_vec = NULL WHERE id_embedding IS NOT NULL")
+
+def _compactar_embeddings(db: sqlite3.Connection):
+    # vetores gravados até aqui são float32 crus do modelo atual
+    linhas = db.execute("SELECT id_embedding, vec FROM embeddings_itens").fetchall()
+    db.executemany(
+        "UPDATE embeddings_itens SET vec = ?, modelo = ? WHERE id_embedding = ?",
+        [(codificar_vetor(np.frombuffer(vec, dtype=np.float32), MODELO_EMBEDDING, FORMATO_EMBEDDING), MODELO_EMBEDDING, id_embedding)
+         for id_embedding, vec in linhas]
+    )
+
+def _popular_historico_peso(db: sqlite3.Connection):
+    # ponto de partida: peso inicial no cadastro e, se mudou, o peso atual agora
+    _, agora_ms = instante_atual()
+    linhas = []
+    for c in db.execute("SELECT id_cliente, peso_inicial, peso_kg, criado_em, fuso_horario FROM clientes"):
+        criado_ms = iso_utc_para_ms(c["criado_em"]) if c["criado_em"] else None
+        if c["peso_inicial"] is not None and criado_ms is not None:
+            linhas.append((c["id_cliente"], criado_ms, chave_dia(criado_ms, c["fuso_horario"]), c["peso_inicial"]))
+        if c["peso_kg"] is not None and (c["peso_kg"] != c["peso_inicial"] or criado_ms is None):
+            linhas.append((c["id_cliente"], agora_ms, chave_dia(agora_ms, c["fuso_horario"]), c["peso_kg"]))
+    db.executemany("INSERT OR REPLACE INTO historico_peso (id_cliente, ts_ms, dia, peso_kg) VALUES (?, ?, ?, ?)", linhas)
+
+MIGRACOES: List[Tuple[int, str, List[Any]]] = [
+    (1, "índices por cliente", [
+        "CREATE INDEX IF NOT EXISTS idx_clientes_nutri ON clientes (id_nutri)",
+        "CREATE INDEX IF NOT EXISTS idx_conversas_cliente_time ON conversas (id_cliente, time)",
+        "CREATE INDEX IF NOT EXISTS idx_conversas_cliente_role_time ON conversas (id_cliente, role, time)",
+        "CREATE INDEX IF NOT EXISTS idx_consumo_cliente_data ON registros_consumo (id_cliente, data_hora)",
+    ]),
+    (2, "timestamps inteiros e fuso horário por cliente", [
+        f"ALTER TABLE clientes ADD COLUMN fuso_horario TEXT DEFAULT '{FUSO_PADRAO}'",
+        "ALTER TABLE registros_consumo ADD COLUMN ts_ms INTEGER",
+        "ALTER TABLE registros_consumo ADD COLUMN dia INTEGER",
+        "ALTER TABLE conversas ADD COLUMN ts_ms INTEGER",
+        _migrar_timestamps,
+        "DROP INDEX IF EXISTS idx_consumo_cliente_data",
+        "DROP INDEX IF EXISTS idx_conversas_cliente_time",
+        "DROP INDEX IF EXISTS idx_conversas_cliente_role_time",
+        "CREATE INDEX IF NOT EXISTS idx_consumo_cliente_dia ON registros_consumo (id_cliente, dia, ts_ms)",
+        "CREATE INDEX IF NOT EXISTS idx_conversas_cliente_ts ON conversas (id_cliente, ts_ms)",
+        "CREATE INDEX IF NOT EXISTS idx_conversas_cliente_role_ts ON conversas (id_cliente, role, ts_ms)",
+    ]),
+    (3, "macros por registro e agregado diário de consumo", [
+        "ALTER TABLE registros_consumo ADD COLUMN prot_g REAL DEFAULT 0",
+        "ALTER TABLE registros_consumo ADD COLUMN carb_g REAL DEFAULT 0",
+        "ALTER TABLE registros_consumo ADD COLUMN fat_g REAL DEFAULT 0",
+        "ALTER TABLE registros_consumo ADD COLUMN agua_ml REAL DEFAULT 0",
+        """CREATE TABLE IF NOT EXISTS consumo_diario (
+            id_cliente TEXT NOT NULL,
+            dia INTEGER NOT NULL,
+            kcal REAL DEFAULT 0,
+            prot_g REAL DEFAULT 0,
+            carb_g REAL DEFAULT 0,
+            fat_g REAL DEFAULT 0,
+            agua_ml REAL DEFAULT 0,
+            itens INTEGER DEFAULT 0,
+            PRIMARY KEY (id_cliente, dia)
+        ) WITHOUT ROWID""",
+        reconstruir_consumo_diario,
+    ]),
+    (4, "modelos de plano compartilhados e embeddings por texto", [
+        """CREATE TABLE IF NOT EXISTS embeddings_itens (
+            id_embedding INTEGER PRIMARY KEY AUTOINCREMENT,
+            texto TEXT UNIQUE NOT NULL,
+            vec BLOB NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS modelos_plano (
+            id_modelo TEXT PRIMARY KEY,
+            id_nutri TEXT NOT NULL,
+            nome TEXT NOT NULL,
+            criado_em TEXT NOT NULL,
+            FOREIGN KEY (id_nutri) REFERENCES nutricionistas (id_nutri)
+        )""",
+        """CREATE TABLE IF NOT EXISTS modelos_plano_itens (
+            id_modelo TEXT NOT NULL,
+            refeicao TEXT NOT NULL,
+            id_item TEXT NOT NULL,
+            nome TEXT NOT NULL,
+            cal_100g REAL DEFAULT 0,
+            prot_100g REAL DEFAULT 0,
+            carb_100g REAL DEFAULT 0,
+            fat_100g REAL DEFAULT 0,
+            embedding_texto TEXT,
+            id_embedding INTEGER REFERENCES embeddings_itens (id_embedding),
+            PRIMARY KEY (id_modelo, refeicao, nome)
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_modelos_nutri ON modelos_plano (id_nutri)",
+        "ALTER TABLE clientes ADD COLUMN id_modelo TEXT",
+        "CREATE INDEX IF NOT EXISTS idx_clientes_modelo ON clientes (id_modelo)",
+        "ALTER TABLE planos ADD COLUMN id_embedding INTEGER REFERENCES embeddings_itens (id_embedding)",
+        _migrar_embeddings_compartilhados,
+    ]),
+    (5, "embeddings normalizados e quantizados com cabeçalho", [
+        "ALTER TABLE embeddings_itens ADD COLUMN modelo TEXT",
+        _compactar_embeddings,
+    ]),
+    (6, "índice para paginar o histórico por id_conversa", [
+        "CREATE INDEX IF NOT EXISTS idx_conversas_cliente_id ON conversas (id_cliente, id_conversa)",
+    ]),
+    (7, "histórico de peso por cliente", [
+        """CREATE TABLE IF NOT EXISTS historico_peso (
+            id_cliente TEXT NOT NULL,
+            ts_ms INTEGER NOT NULL,
+            dia INTEGER NOT NULL,
+            peso_kg REAL NOT NULL,
+            PRIMARY KEY (id_cliente, ts_ms)
+        ) WITHOUT ROWID""",
+        _popular_historico_peso,
+    ]),
+    (8, "versão do plano por cliente, para cache e ETag", [
+        "ALTER TABLE clientes ADD COLUMN versao_plano INTEGER NOT NULL DEFAULT 0",
+    ]),
+    (9, "versão do modelo de plano, para o cache da matriz de embeddings", [
+        "ALTER TABLE modelos_plano ADD COLUMN versao INTEGER NOT NULL DEFAULT 0",
+    ]),
+]
+
+def versao_schema(db: sqlite3.Connection) -> int:
+    return db.execute("SELECT COALESCE(MAX(versao), 0) FROM schema_version").fetchone()[0]
+
+def aplicar_migracoes(db: sqlite3.Connection):
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS schema_version (versao INTEGER PRIMARY KEY, descricao TEXT NOT NULL, aplicada_em TEXT NOT NULL)"
+    )
+    db.commit()
+    for versao, descricao, passos in MIGRACOES:
+        if versao <= versao_schema(db):
+            continue
+        # BEGIN IMMEDIATE serializa workers que sobem ao mesmo tempo; a versão é conferida de novo já com o lock
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if versao <= versao_schema(db):
+                db.rollback()
+                continue
+            for passo in passos:
+                if callable(passo):
+                    passo(db)
+                else:
+                    db.execute(passo)
+            db.execute(
+                "INSERT INTO schema_version (versao, descricao, aplicada_em) VALUES (?, ?, ?)",
+                (versao, descricao, datetime.utcnow().isoformat())
+            )
+            db.commit()
+            print(f"Migração {versao} aplicada: {descricao}")
+        except Exception:
+            db.rollback()
+            raise
+
 def init_db():
     schema = """
     CREATE TABLE IF NOT EXISTS nutricionistas (
@@ -146,6 +546,7 @@ def init_db():
     """
     with get_db() as db:
         db.executescript(schema)
+    aplicar_migracoes(get_db())
     
     try:
         with get_db() as db:
@@ -172,6 +573,7 @@ def init_db():
     except Exception as e:
         print(f"Erro ao criar dados de teste: {e}")
     
+    iniciar_gravador_conversas()
     print("Banco de dados SQLite inicializado.")
 
 def gerar_id() -> str:
@@ -182,6 +584,244 @@ def normalizar_texto(txt: str) -> str:
         return ""
     return re.sub(r'\s+', ' ', txt.strip().lower())
 
+class CacheEmbeddings:
+    def __init__(self, capacidade: int):
+        self.capacidade = capacidade
+        self._dados: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.remocoes = 0
+
+    def obter(self, chave: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vec = self._dados.get(chave)
+            if vec is None:
+                self.falhas += 1
+                return None
+            self._dados.move_to_end(chave)
+            self.acertos += 1
+            return vec
+
+    def guardar(self, chave: str, vec: np.ndarray):
+        with self._lock:
+            self._dados[chave] = vec
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.capacidade:
+                self._dados.popitem(last=False)
+                self.remocoes += 1
+
+    def limpar(self):
+        with self._lock:
+            self._dados.clear()
+
+    def estatisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.acertos + self.falhas
+            return {
+                "tamanho": len(self._dados),
+                "capacidade": self.capacidade,
+                "acertos": self.acertos,
+                "falhas": self.falhas,
+                "remocoes": self.remocoes,
+                "taxa_acerto": (self.acertos / total) if total else 0.0
+            }
+
+CACHE_EMBEDDINGS = CacheEmbeddings(TAMANHO_CACHE_EMBEDDINGS)
+
+def chave_cache_embedding(texto: str) -> str:
+    return unidecode(normalizar_texto(texto))
+
+class Histograma:
+    def __init__(self, limites: Tuple[float, ...]):
+        self.limites = limites
+        self.contagens = [0] * (len(limites) + 1)
+        self.soma = 0.0
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def observar(self, valor: float):
+        i = 0
+        while i < len(self.limites) and valor > self.limites[i]:
+            i += 1
+        with self._lock:
+            self.contagens[i] += 1
+            self.soma += valor
+            self.total += 1
+
+    def estatisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            rotulos = [f"<={l:g}" for l in self.limites] + [f">{self.limites[-1]:g}"]
+            return {
+                "buckets": dict(zip(rotulos, self.contagens)),
+                "total": self.total,
+                "media": (self.soma / self.total) if self.total else 0.0
+            }
+
+class CodificadorEmLote:
+    def __init__(self, modelo, max_itens: int, espera_max_ms: float):
+        self.modelo = modelo
+        self.max_itens = max_itens
+        self.espera_max_s = espera_max_ms / 1000.0
+        self.fila: "queue.Queue[Optional[Tuple[str, Future, float]]]" = queue.Queue()
+        self.hist_tamanho_lote = Histograma((1, 2, 4, 8, 16, 32, 64))
+        self.hist_espera_ms = Histograma((0.5, 1, 2, 5, 10, 25, 50, 100, 250))
+        self.encerrado = False
+        self._thread = threading.Thread(target=self._trabalhar, name="codificador-lote", daemon=True)
+        self._thread.start()
+
+    def codificar(self, textos: List[str]) -> np.ndarray:
+        if self.encerrado:
+            raise RuntimeError("Codificador em lote encerrado.")
+        agora = time.perf_counter()
+        futuros = []
+        for texto in textos:
+            futuro = Future()
+            self.fila.put((texto, futuro, agora))
+            futuros.append(futuro)
+        prazo = agora + CODIFICACAO_TIMEOUT_S
+        try:
+            return np.vstack([f.result(timeout=max(0.0, prazo - time.perf_counter())) for f in futuros])
+        except TimeoutError:
+            # o que ainda não começou sai da fila; o que já está no modelo termina e é descartado
+            for f in futuros:
+                f.cancel()
+            raise
+
+    def _coletar_lote(self, primeiro) -> list:
+        lote = [primeiro]
+        prazo = time.perf_counter() + self.espera_max_s
+        while len(lote) < self.max_itens:
+            restante = prazo - time.perf_counter()
+            if restante <= 0:
+                break
+            try:
+                item = self.fila.get(timeout=restante)
+            except queue.Empty:
+                break
+            if item is None:
+                self.fila.put(None)
+                break
+            lote.append(item)
+        return lote
+
+    def _trabalhar(self):
+        while True:
+            primeiro = self.fila.get()
+            if primeiro is None:
+                return
+            lote = [item for item in self._coletar_lote(primeiro) if item[1].set_running_or_notify_cancel()]
+            if not lote:
+                continue
+
+            inicio = time.perf_counter()
+            self.hist_tamanho_lote.observar(len(lote))
+            for _, _, enfileirado in lote:
+                self.hist_espera_ms.observar((inicio - enfileirado) * 1000.0)
+            try:
+                embs = self.modelo.encode([t for t, _, _ in lote], convert_to_numpy=True,
+                                          normalize_embeddings=True, batch_size=self.max_itens)
+                embs = np.asarray(embs, dtype=np.float32)
+                for (_, futuro, _), emb in zip(lote, embs):
+                    futuro.set_result(emb)
+            except Exception as e:
+                for _, futuro, _ in lote:
+                    futuro.set_exception(e)
+
+    def encerrar(self):
+        self.encerrado = True
+        self.fila.put(None)
+        self._thread.join(timeout=5)
+        # quem ainda espera na fila recebe erro em vez de ficar preso para sempre
+        while True:
+            try:
+                item = self.fila.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None and item[1].set_running_or_notify_cancel():
+                item[1].set_exception(RuntimeError("Codificador em lote encerrado."))
+
+    def estatisticas(self) -> Dict[str, Any]:
+        return {
+            "max_itens": self.max_itens,
+            "espera_max_ms": self.espera_max_s * 1000.0,
+            "fila": self.fila.qsize(),
+            "tamanho_lote": self.hist_tamanho_lote.estatisticas(),
+            "espera_fila_ms": self.hist_espera_ms.estatisticas()
+        }
+
+CODIFICADOR: Optional[CodificadorEmLote] = None
+
+def iniciar_codificador(modelo):
+    global CODIFICADOR
+    if CODIFICADOR is None:
+        CODIFICADOR = CodificadorEmLote(modelo, LOTE_MAX_ITENS, LOTE_ESPERA_MAX_MS)
+
+def encerrar_codificador():
+    global CODIFICADOR
+    if CODIFICADOR is not None:
+        CODIFICADOR.encerrar()
+        CODIFICADOR = None
+
+def codificar_lote(textos: List[str]) -> np.ndarray:
+    if not textos:
+        return np.zeros((0, 0), dtype=np.float32)
+    if CODIFICADOR is not None:
+        return CODIFICADOR.codificar(textos)
+    embs = MODELO_IA.encode(textos, convert_to_numpy=True, normalize_embeddings=True, batch_size=LOTE_MAX_ITENS)
+    return np.asarray(embs, dtype=np.float32)
+
+def codificar_textos(textos: List[str]) -> List[np.ndarray]:
+    chaves = [chave_cache_embedding(t) for t in textos]
+    vetores: Dict[str, np.ndarray] = {}
+    # o texto codificado é a própria chave: textos que dividem a chave dividem o vetor
+    faltando: List[str] = []
+    for chave in chaves:
+        if chave in vetores or chave in faltando:
+            continue
+        vec = CACHE_EMBEDDINGS.obter(chave)
+        if vec is not None:
+            vetores[chave] = vec
+        else:
+            faltando.append(chave)
+
+    if faltando:
+        embs = codificar_lote(faltando)
+        for chave, emb in zip(faltando, embs):
+            vec = np.array(emb, dtype=np.float32)
+            vec.setflags(write=False)
+            CACHE_EMBEDDINGS.guardar(chave, vec)
+            vetores[chave] = vec
+
+    return [vetores[chave] for chave in chaves]
+
+def codificar_texto(texto: str) -> np.ndarray:
+    return codificar_textos([texto])[0]
+
+def encerrar():
+    # a fila de conversas esvazia antes de fechar as conexões
+    encerrar_gravador_conversas()
+    encerrar_codificador()
+    fechar_conexoes()
+
+def metricas() -> Dict[str, Any]:
+    return {
+        "cache_embeddings": CACHE_EMBEDDINGS.estatisticas(),
+        "conexoes_banco": estatisticas_conexoes(),
+        "codificador_lote": CODIFICADOR.estatisticas() if CODIFICADOR else None,
+        "embeddings_itens": dict(METRICAS_EMBEDDINGS_ITENS),
+        "eventos": HUB_EVENTOS.estatisticas(),
+        "gravador_conversas": GRAVADOR_CONVERSAS.estatisticas() if GRAVADOR_CONVERSAS else None,
+        "cache_metricas": CACHE_METRICAS.estatisticas(),
+        "cache_planos": CACHE_PLANOS.estatisticas(),
+        "roteador": ROTEADOR.estatisticas(),
+        "intencoes": {"modo": MODO_INTENCAO, "margem_top2": HIST_MARGEM_INTENCAO.estatisticas()},
+        "turnos": estatisticas_turnos(),
+        "matrizes_em_cache": {"clientes": len(CACHE_PLANO_EMBED), "modelos": len(CACHE_MODELO_EMBED), "bytes": CACHE_PLANO_EMBED.bytes() + CACHE_MODELO_EMBED.bytes(),
+                              "remocoes": CACHE_PLANO_EMBED.remocoes + CACHE_MODELO_EMBED.remocoes},
+        "tempos_inicializacao": dict(TEMPOS_INICIALIZACAO)
+    }
+
 def criar_nutricionista(nome: str, email: str, senha: str) -> str:
     idn = gerar_id()
     try:
@@ -194,15 +834,19 @@ def criar_nutricionista(nome: str, email: str, senha: str) -> str:
     except sqlite3.IntegrityError:
         return None 
 
-def criar_cliente(id_nutri: str, nome: str, email: str, senha: str, idade: int, sexo: str, peso_kg: float, altura_cm: float, atividade: str="sedentario") -> str:
+def criar_cliente(id_nutri: str, nome: str, email: str, senha: str, idade: int, sexo: str, peso_kg: float, altura_cm: float, atividade: str="sedentario", fuso_horario: str=FUSO_PADRAO) -> str:
+    if not fuso_valido(fuso_horario):
+        print(f"Fuso horário inválido: {fuso_horario}")
+        return None
     idc = gerar_id()
     try:
         with get_db() as db:
             db.execute(
-                """INSERT INTO clientes (id_cliente, id_nutri, nome, email, senha, idade, sexo, peso_kg, altura_cm, atividade, peso_inicial, criado_em)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                (idc, id_nutri, nome, email, senha, int(idade), sexo, float(peso_kg), float(altura_cm), atividade, float(peso_kg), datetime.utcnow().isoformat())
+                """INSERT INTO clientes (id_cliente, id_nutri, nome, email, senha, idade, sexo, peso_kg, altura_cm, atividade, peso_inicial, criado_em, fuso_horario)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (idc, id_nutri, nome, email, senha, int(idade), sexo, float(peso_kg), float(altura_cm), atividade, float(peso_kg), datetime.utcnow().isoformat(), fuso_horario)
             )
+            _registrar_peso(db, idc, float(peso_kg), fuso_horario)
         return idc
     except sqlite3.IntegrityError:
         return None 
@@ -210,8 +854,44 @@ def criar_cliente(id_nutri: str, nome: str, email: str, senha: str, idade: int,
         print(f"Erro ao criar cliente: {e}")
         return None
 
-def atualizar_cliente(id_cliente: str, campos: Dict[str, Any]) -> bool:
-    campos_permitidos = {"nome", "idade", "sexo", "peso_kg", "altura_cm", "atividade", "meta", "agua_meta_ml"}
+def _registrar_peso(db: sqlite3.Connection, id_cliente: str, peso_kg: float, fuso: Optional[str]):
+    _, ts_ms = instante_atual()
+    db.execute(
+        "INSERT OR REPLACE INTO historico_peso (id_cliente, ts_ms, dia, peso_kg) VALUES (?, ?, ?, ?)",
+        (id_cliente, ts_ms, chave_dia(ts_ms, fuso), peso_kg)
+    )
+
+# o peso vigente no início do período vem do último registro anterior a ele
+SQL_HISTORICO_PESO = """
+    SELECT dia, ts_ms, peso_kg FROM (
+        SELECT dia, ts_ms, peso_kg FROM (
+            SELECT dia, ts_ms, peso_kg FROM historico_peso WHERE id_cliente = :id_cliente AND dia < :dia_inicio ORDER BY ts_ms DESC LIMIT 1
+        )
+        UNION ALL
+        SELECT dia, ts_ms, peso_kg FROM historico_peso WHERE id_cliente = :id_cliente AND dia BETWEEN :dia_inicio AND :dia_fim
+    ) ORDER BY ts_ms
+"""
+
+def historico_peso(id_cliente: str, dia_inicio: Optional[int]=None, dia_fim: Optional[int]=None,
+                   db: Optional[sqlite3.Connection]=None) -> List[Dict[str, Any]]:
+    # db: conexão de quem já está numa transação de leitura (ex.: relatório), para ler o mesmo snapshot
+    parametros = {"id_cliente": id_cliente, "dia_inicio": dia_inicio or 0, "dia_fim": dia_fim or 99991231}
+    if db is not None:
+        return [dict(row) for row in db.execute(SQL_HISTORICO_PESO, parametros)]
+    with get_db() as db:
+        return [dict(row) for row in db.execute(SQL_HISTORICO_PESO, parametros)]
+
+def _gravar_atualizacao_cliente(db: sqlite3.Connection, id_cliente: str, campos: Dict[str, Any], query: str, valores: tuple):
+    cursor = db.execute(query, valores)
+    if "peso_kg" in campos and campos["peso_kg"] is not None and cursor.rowcount:
+        fuso = db.execute("SELECT fuso_horario FROM clientes WHERE id_cliente = ?", (id_cliente,)).fetchone()["fuso_horario"]
+        _registrar_peso(db, id_cliente, float(campos["peso_kg"]), fuso)
+
+def atualizar_cliente(id_cliente: str, campos: Dict[str, Any], ctx: Optional["ContextoTurno"]=None) -> bool:
+    campos_permitidos = {"nome", "idade", "sexo", "peso_kg", "altura_cm", "atividade", "meta", "agua_meta_ml", "fuso_horario"}
+    if "fuso_horario" in campos and not fuso_valido(campos["fuso_horario"]):
+        print(f"Fuso horário inválido: {campos['fuso_horario']}")
+        return False
     
     set_clause = []
     valores = []
@@ -226,10 +906,16 @@ def atualizar_cliente(id_cliente: str, campos: Dict[str, Any]) -> bool:
         
     valores.append(id_cliente)
     query = f"UPDATE clientes SET {', '.join(set_clause)} WHERE id_cliente = ?"
-    
+
+    if ctx is not None:
+        # dentro de um turno a escrita vai junto com o resto dele, no commit final
+        ctx.escrever(lambda db: _gravar_atualizacao_cliente(db, id_cliente, campos, query, tuple(valores)))
+        ctx.atualizar_cliente_local({c: v for c, v in campos.items() if c in campos_permitidos})
+        return True
+
     try:
         with get_db() as db:
-            db.execute(query, tuple(valores))
+            _gravar_atualizacao_cliente(db, id_cliente, campos, query, tuple(valores))
         return True
     except Exception as e:
         print(f"Erro ao atualizar cliente: {e}")
@@ -245,7 +931,7 @@ def get_cliente_perfil(id_cliente: str) -> Optional[Dict[str, Any]]:
     with get_db() as db:
         query = """
             SELECT 
-                c.id_cliente, c.nome, c.email, c.idade, c.sexo, c.peso_kg, c.altura_cm, c.meta,
+                c.id_cliente, c.nome, c.email, c.idade, c.sexo, c.peso_kg, c.altura_cm, c.atividade, c.meta,
                 n.nome as nome_nutri,
                 n.email as email_nutri,
                 n.id_nutri
@@ -262,8 +948,9 @@ def get_cliente_perfil(id_cliente: str) -> Optional[Dict[str, Any]]:
         perfil_dict = dict(perfil)
         
         if perfil_dict.get("peso_kg") and perfil_dict.get("altura_cm"):
-            perfil_dict["imc"] = calcular_imc(perfil_dict["peso_kg"], perfil_dict["altura_cm"])
-            perfil_dict["imc_class"] = classificar_imc(perfil_dict["imc"])
+            metricas = metricas_cliente(perfil_dict)
+            perfil_dict["imc"] = metricas["imc"]
+            perfil_dict["imc_class"] = metricas["imc_class"]
         else:
             perfil_dict["imc"] = None
             perfil_dict["imc_class"] = "Dados insuficientes"
@@ -305,12 +992,17 @@ def delete_cliente(id_cliente: str) -> bool:
             db.execute("DELETE FROM planos WHERE id_cliente = ?", (id_cliente,))
             db.execute("DELETE FROM conversas WHERE id_cliente = ?", (id_cliente,))
             db.execute("DELETE FROM registros_consumo WHERE id_cliente = ?", (id_cliente,))
+            db.execute("DELETE FROM consumo_diario WHERE id_cliente = ?", (id_cliente,))
+            db.execute("DELETE FROM historico_peso WHERE id_cliente = ?", (id_cliente,))
             db.execute("COMMIT")
+        invalidar_matriz_plano(id_cliente)
+        CACHE_PLANOS.invalidar(id_cliente)
         return True
     except Exception as e:
         print(f"Erro ao deletar cliente: {e}")
-        with get_db() as db:
-            db.execute("ROLLBACK") 
+        db = get_db()
+        if db.in_transaction:
+            db.rollback()
         return False
 
 def listar_clientes_por_nutri(id_nutri: str) -> List[Dict[str, Any]]:
@@ -319,6 +1011,69 @@ def listar_clientes_por_nutri(id_nutri: str) -> List[Dict[str, Any]]:
         clientes = cursor.fetchall()
         return [dict(c) for c in clientes]
 
+def portfolio_nutri(id_nutri: str) -> Dict[str, Any]:
+    with get_db() as db:
+        fusos = [row["fuso_horario"] for row in db.execute("SELECT DISTINCT fuso_horario FROM clientes WHERE id_nutri = ?", (id_nutri,))]
+        if not fusos:
+            return {"clientes": [], "resumo": {"total_clientes": 0, "registraram_hoje": 0, "acima_da_meta": 0}}
+        # "hoje" depende do fuso de cada cliente; calcula uma vez por fuso e junta no SQL
+        hoje = [(fuso, chave_dia_hoje(fuso)) for fuso in fusos]
+        valores_hoje = ", ".join(f"(:fuso{i}, :dia{i})" for i in range(len(hoje)))
+        parametros = {"id_nutri": id_nutri}
+        for i, (fuso, dia) in enumerate(hoje):
+            parametros[f"fuso{i}"] = fuso
+            parametros[f"dia{i}"] = dia
+        cursor = db.execute(
+            f"""WITH hoje (fuso, dia) AS (VALUES {valores_hoje}),
+                     proprios AS (
+                         SELECT p.id_cliente, COUNT(*) AS itens,
+                                SUM(EXISTS (SELECT 1 FROM modelos_plano_itens i
+                                            WHERE i.id_modelo = c.id_modelo AND i.refeicao = p.refeicao AND i.nome = p.nome)) AS sobrepostos
+                         FROM planos p JOIN clientes c ON c.id_cliente = p.id_cliente
+                         WHERE c.id_nutri = :id_nutri
+                         GROUP BY p.id_cliente
+                     ),
+                     modelos AS (
+                         SELECT i.id_modelo, COUNT(*) AS itens
+                         FROM modelos_plano_itens i JOIN modelos_plano m ON m.id_modelo = i.id_modelo
+                         WHERE m.id_nutri = :id_nutri
+                         GROUP BY i.id_modelo
+                     )
+                SELECT c.id_cliente, c.nome, c.email, c.meta, c.idade, c.sexo, c.peso_kg, c.altura_cm, c.atividade,
+                       COALESCE(cd.kcal, 0) AS kcal_hoje, COALESCE(cd.itens, 0) AS registros_hoje,
+                       COALESCE(pr.itens, 0) + COALESCE(mo.itens, 0) - COALESCE(pr.sobrepostos, 0) AS itens_plano,
+                       (SELECT MAX(v.ts_ms) FROM conversas v WHERE v.id_cliente = c.id_cliente) AS ultima_mensagem_ms
+                FROM clientes c
+                LEFT JOIN hoje h ON h.fuso IS c.fuso_horario
+                LEFT JOIN consumo_diario cd ON cd.id_cliente = c.id_cliente AND cd.dia = h.dia
+                LEFT JOIN proprios pr ON pr.id_cliente = c.id_cliente
+                LEFT JOIN modelos mo ON mo.id_modelo = c.id_modelo
+                WHERE c.id_nutri = :id_nutri
+                ORDER BY c.nome""",
+            parametros
+        )
+        df = pd.DataFrame([dict(row) for row in cursor.fetchall()])
+
+    df = df.join(metricas_dataframe(df))
+    df["pct_tdee"] = (df["kcal_hoje"] / df["tdee_kcal"] * 100).round(1)
+    df["restante_kcal"] = (df["tdee_kcal"] - df["kcal_hoje"]).round(0)
+    df["ultima_mensagem"] = pd.to_datetime(df["ultima_mensagem_ms"], unit="ms", utc=True).dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+    for coluna in ("bmr_kcal", "tdee_kcal"):
+        df[coluna] = df[coluna].round(0)
+    df["imc"] = df["imc"].round(2)
+
+    colunas = ["id_cliente", "nome", "email", "meta", "peso_kg", "altura_cm", "imc", "imc_class", "bmr_kcal", "tdee_kcal",
+               "kcal_hoje", "pct_tdee", "restante_kcal", "registros_hoje", "itens_plano", "ultima_mensagem"]
+    saida = df[colunas].astype(object).where(df[colunas].notna(), None)
+    return {
+        "clientes": saida.to_dict(orient="records"),
+        "resumo": {
+            "total_clientes": int(len(df)),
+            "registraram_hoje": int((df["registros_hoje"] > 0).sum()),
+            "acima_da_meta": int((df["pct_tdee"] > 100).sum()),
+        }
+    }
+
 def login_cliente(email: str, senha: str) -> Optional[Dict[str, Any]]:
     with get_db() as db:
         query = """
@@ -356,30 +1111,74 @@ def update_bot_config(id_nutri: str, persona: str, restricoes: str, cor: str) ->
         print(f"Erro ao salvar config do bot: {e}")
         return False
 
+def texto_repr_item_plano(nome_alimento: str, cal_100g: float) -> str:
+    return f"{nome_alimento} - {cal_100g:.0f} kcal por 100g"
+
+METRICAS_EMBEDDINGS_ITENS = {"reaproveitados": 0, "codificados": 0}
+
+def _ids_embeddings(db: sqlite3.Connection, textos: List[str]) -> Dict[str, int]:
+    ids = {}
+    for i in range(0, len(textos), 500):
+        parte = textos[i:i + 500]
+        marcadores = ", ".join("?" * len(parte))
+        cursor = db.execute(
+            f"SELECT texto, id_embedding FROM embeddings_itens WHERE modelo = ? AND texto IN ({marcadores})",
+            [MODELO_EMBEDDING, *parte]
+        )
+        for row in cursor:
+            ids[row["texto"]] = row["id_embedding"]
+    return ids
+
+def garantir_embeddings(textos: List[str]) -> Dict[str, int]:
+    unicos = list(dict.fromkeys(textos))
+    db = get_db()
+    ids = _ids_embeddings(db, unicos)
+    faltando = [t for t in unicos if t not in ids]
+    METRICAS_EMBEDDINGS_ITENS["reaproveitados"] += len(unicos) - len(faltando)
+    if faltando:
+        embs = codificar_lote(faltando)
+        with db:
+            # textos gerados por outro modelo são recodificados no lugar, mantendo o id_embedding
+            db.executemany(
+                """INSERT INTO embeddings_itens (texto, vec, modelo) VALUES (?, ?, ?)
+                   ON CONFLICT (texto) DO UPDATE SET vec = excluded.vec, modelo = excluded.modelo""",
+                [(texto, codificar_vetor(emb, MODELO_EMBEDDING, FORMATO_EMBEDDING), MODELO_EMBEDDING) for texto, emb in zip(faltando, embs)]
+            )
+        METRICAS_EMBEDDINGS_ITENS["codificados"] += len(faltando)
+        ids.update(_ids_embeddings(db, faltando))
+    return ids
+
 def adicionar_opcao_plano(id_cliente: str, refeicao: str, nome_alimento: str,
                           cal_100g: float, prot_100g: float=0.0, carb_100g: float=0.0, fat_100g: float=0.0) -> bool:
     if MODELO_IA is None:
         print("Modelo de IA não carregado. Não é possível adicionar embedding.")
         return False
         
-    refeicao_key = refeicao.strip().lower()
+    # mesma normalização da importação em lote: "Arroz " e "Arroz" são o mesmo item
+    item, erro = _normalizar_item_plano({"refeicao": refeicao, "nome_alimento": nome_alimento, "cal_100g": cal_100g,
+                                         "prot_100g": prot_100g, "carb_100g": carb_100g, "fat_100g": fat_100g})
+    if erro:
+        print(f"Item inválido para o plano: {erro}")
+        return False
+    refeicao_key, nome_alimento = item["refeicao"], item["nome_alimento"]
     id_item = gerar_id()
     
-    texto_repr = f"{nome_alimento} - {cal_100g:.0f} kcal por 100g"
-    embedding_vec_blob = None
+    texto_repr = texto_repr_item_plano(nome_alimento, item["cal_100g"])
+    id_embedding = None
     try:
-        emb = MODELO_IA.encode(texto_repr, convert_to_tensor=True)
-        embedding_vec_blob = emb.cpu().detach().numpy().tobytes()
+        id_embedding = garantir_embeddings([texto_repr]).get(texto_repr)
     except Exception as e:
         print(f"[AVISO] falha ao gerar embedding para '{nome_alimento}': {e}")
 
     try:
         with get_db() as db:
             db.execute(
-                """INSERT INTO planos (id_cliente, refeicao, id_item, nome, cal_100g, prot_100g, carb_100g, fat_100g, embedding_texto, embedding_vec)
+                """INSERT INTO planos (id_cliente, refeicao, id_item, nome, cal_100g, prot_100g, carb_100g, fat_100g, embedding_texto, id_embedding)
                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                (id_cliente, refeicao_key, id_item, nome_alimento, float(cal_100g), float(prot_100g), float(carb_100g), float(fat_100g), texto_repr, embedding_vec_blob)
+                (id_cliente, refeicao_key, id_item, nome_alimento, item["cal_100g"], item["prot_100g"], item["carb_100g"], item["fat_100g"], texto_repr, id_embedding)
             )
+            nova_versao_plano(db, "id_cliente", id_cliente)
+        invalidar_matriz_plano(id_cliente)
         return True
     except sqlite3.IntegrityError:
         print(f"Item '{nome_alimento}' já existe para '{refeicao_key}' deste cliente.")
@@ -388,115 +1187,488 @@ def adicionar_opcao_plano(id_cliente: str, refeicao: str, nome_alimento: str,
         print(f"Erro ao adicionar opção ao plano: {e}")
         return False
 
-def listar_plano(id_cliente: str) -> Dict[str, List[Dict[str,Any]]]:
-    plano_dict = {}
+CAMPOS_ITEM_PLANO = ("refeicao", "nome_alimento", "cal_100g", "prot_100g", "carb_100g", "fat_100g")
+
+def _normalizar_item_plano(item: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    refeicao = str(item.get("refeicao") or "").strip().lower()
+    nome = str(item.get("nome_alimento") or "").strip()
+    if not refeicao or not nome:
+        return None, "refeição e nome do alimento são obrigatórios"
+    valores = {}
+    for campo in ("cal_100g", "prot_100g", "carb_100g", "fat_100g"):
+        bruto = item.get(campo)
+        if bruto is None or bruto == "":
+            if campo == "cal_100g":
+                return None, "cal_100g é obrigatório"
+            bruto = 0.0
+        try:
+            valores[campo] = float(str(bruto).replace(",", "."))
+        except ValueError:
+            return None, f"valor inválido em {campo}: {bruto!r}"
+    return {"refeicao": refeicao, "nome_alimento": nome, **valores}, None
+
+def ler_plano_csv(texto: str) -> List[Dict[str, Any]]:
+    texto = texto.lstrip("﻿")
+    try:
+        dialeto = csv.Sniffer().sniff(texto.split("\n", 1)[0], delimiters=",;\t")
+    except csv.Error:
+        dialeto = csv.excel
+    leitor = csv.DictReader(io.StringIO(texto), dialect=dialeto)
+    itens = []
+    for linha in leitor:
+        linha = {(k or "").strip().lower(): (v.strip() if isinstance(v, str) else v) for k, v in linha.items()}
+        if "nome" in linha and "nome_alimento" not in linha:
+            linha["nome_alimento"] = linha["nome"]
+        itens.append({campo: linha.get(campo) for campo in CAMPOS_ITEM_PLANO})
+    return itens
+
+def _inserir_itens_lote(tabela: str, coluna_dono: str, id_dono: str, itens: List[Dict[str, Any]]) -> Dict[str, Any]:
+    resultados: List[Dict[str, Any]] = [None] * len(itens)
+    validos: List[Tuple[int, Dict[str, Any]]] = []
+    vistos = set()
+    sql_existentes = f"SELECT refeicao, nome FROM {tabela} WHERE {coluna_dono} = ?"
+
     with get_db() as db:
-        cursor = db.execute("SELECT * FROM planos WHERE id_cliente = ? ORDER BY refeicao", (id_cliente,))
-        itens = cursor.fetchall()
-        
-    for item_row in itens:
-        item = dict(item_row)
-        refeicao = item["refeicao"]
-        if refeicao not in plano_dict:
-            plano_dict[refeicao] = []
-            
-        item_formatado = {
-            "id": item["id_item"],
-            "nome": item["nome"],
-            "per_100g": {
-                "cal": item["cal_100g"],
-                "prot": item["prot_100g"],
-                "carb": item["carb_100g"],
-                "fat": item["fat_100g"]
-            }
+        existentes = {(r["refeicao"], r["nome"]) for r in db.execute(sql_existentes, (id_dono,))}
+
+    for i, bruto in enumerate(itens):
+        item, erro = _normalizar_item_plano(bruto)
+        if erro:
+            resultados[i] = {"indice": i, "nome": bruto.get("nome_alimento"), "status": "invalido", "motivo": erro}
+            continue
+        chave = (item["refeicao"], item["nome_alimento"])
+        base = {"indice": i, "nome": item["nome_alimento"], "refeicao": item["refeicao"]}
+        if chave in vistos:
+            resultados[i] = {**base, "status": "conflito", "motivo": "item repetido no lote"}
+        elif chave in existentes:
+            resultados[i] = {**base, "status": "conflito", "motivo": "item já existe no plano"}
+        else:
+            vistos.add(chave)
+            validos.append((i, item))
+
+    if validos and MODELO_IA is None:
+        print("Modelo de IA não carregado. Não é possível adicionar embedding.")
+        for i, item in validos:
+            resultados[i] = {"indice": i, "nome": item["nome_alimento"], "refeicao": item["refeicao"], "status": "erro", "motivo": "modelo de IA não carregado"}
+        validos = []
+
+    if validos:
+        textos = [texto_repr_item_plano(item["nome_alimento"], item["cal_100g"]) for _, item in validos]
+        try:
+            ids_embedding = garantir_embeddings(textos)
+        except Exception as e:
+            print(f"[AVISO] falha ao gerar embeddings do lote: {e}")
+            ids_embedding = {}
+
+        linhas = [
+            (id_dono, item["refeicao"], gerar_id(), item["nome_alimento"], item["cal_100g"], item["prot_100g"],
+             item["carb_100g"], item["fat_100g"], texto, ids_embedding.get(texto))
+            for (_, item), texto in zip(validos, textos)
+        ]
+        db = get_db()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            # confere de novo já com o lock de escrita: outra requisição pode ter inserido no meio tempo
+            existentes = {(r["refeicao"], r["nome"]) for r in db.execute(sql_existentes, (id_dono,))}
+            novas = []
+            for (i, item), linha in zip(validos, linhas):
+                base = {"indice": i, "nome": item["nome_alimento"], "refeicao": item["refeicao"]}
+                if (item["refeicao"], item["nome_alimento"]) in existentes:
+                    resultados[i] = {**base, "status": "conflito", "motivo": "item já existe no plano"}
+                else:
+                    resultados[i] = {**base, "status": "inserido"}
+                    novas.append(linha)
+            db.executemany(
+                f"""INSERT INTO {tabela} ({coluna_dono}, refeicao, id_item, nome, cal_100g, prot_100g, carb_100g, fat_100g, embedding_texto, id_embedding)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                novas
+            )
+            if novas:
+                nova_versao_plano(db, coluna_dono, id_dono)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Erro ao importar plano em lote: {e}")
+            for i, item in validos:
+                resultados[i] = {"indice": i, "nome": item["nome_alimento"], "refeicao": item["refeicao"], "status": "erro", "motivo": str(e)}
+
+    inseridos = sum(1 for r in resultados if r["status"] == "inserido")
+    return {"inseridos": inseridos, "rejeitados": len(resultados) - inseridos, "itens": resultados}
+
+def adicionar_opcoes_plano_lote(id_cliente: str, itens: List[Dict[str, Any]]) -> Dict[str, Any]:
+    resultado = _inserir_itens_lote("planos", "id_cliente", id_cliente, itens)
+    invalidar_matriz_plano(id_cliente)
+    return resultado
+
+def criar_modelo_plano(id_nutri: str, nome: str) -> Optional[str]:
+    id_modelo = gerar_id()
+    try:
+        with get_db() as db:
+            db.execute(
+                "INSERT INTO modelos_plano (id_modelo, id_nutri, nome, criado_em) VALUES (?, ?, ?, ?)",
+                (id_modelo, id_nutri, nome.strip(), datetime.utcnow().isoformat())
+            )
+        return id_modelo
+    except Exception as e:
+        print(f"Erro ao criar modelo de plano: {e}")
+        return None
+
+def get_modelo_plano(id_modelo: str) -> Optional[Dict[str, Any]]:
+    with get_db() as db:
+        modelo = db.execute("SELECT id_modelo, id_nutri, nome, criado_em FROM modelos_plano WHERE id_modelo = ?", (id_modelo,)).fetchone()
+        return dict(modelo) if modelo else None
+
+def adicionar_itens_modelo(id_modelo: str, itens: List[Dict[str, Any]]) -> Dict[str, Any]:
+    resultado = _inserir_itens_lote("modelos_plano_itens", "id_modelo", id_modelo, itens)
+    invalidar_matriz_modelo(id_modelo)
+    return resultado
+
+def listar_modelos_plano(id_nutri: str) -> List[Dict[str, Any]]:
+    with get_db() as db:
+        cursor = db.execute(
+            """SELECT m.id_modelo, m.nome, m.criado_em,
+                      (SELECT COUNT(*) FROM modelos_plano_itens i WHERE i.id_modelo = m.id_modelo) AS itens,
+                      (SELECT COUNT(*) FROM clientes c WHERE c.id_modelo = m.id_modelo) AS clientes
+               FROM modelos_plano m WHERE m.id_nutri = ? ORDER BY m.nome""",
+            (id_nutri,)
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+def delete_modelo_plano(id_modelo: str) -> bool:
+    try:
+        with get_db() as db:
+            db.execute("UPDATE clientes SET id_modelo = NULL, versao_plano = versao_plano + 1 WHERE id_modelo = ?", (id_modelo,))
+            db.execute("DELETE FROM modelos_plano_itens WHERE id_modelo = ?", (id_modelo,))
+            db.execute("DELETE FROM modelos_plano WHERE id_modelo = ?", (id_modelo,))
+        invalidar_matriz_modelo(id_modelo)
+        return True
+    except Exception as e:
+        print(f"Erro ao deletar modelo de plano: {e}")
+        return False
+
+def atribuir_modelo_cliente(id_cliente: str, id_modelo: Optional[str]) -> bool:
+    with get_db() as db:
+        # o modelo precisa ser da mesma nutri do cliente
+        cursor = db.execute(
+            """UPDATE clientes SET id_modelo = ?, versao_plano = versao_plano + 1
+               WHERE id_cliente = ?
+                 AND (? IS NULL OR EXISTS (SELECT 1 FROM modelos_plano m WHERE m.id_modelo = ? AND m.id_nutri = clientes.id_nutri))""",
+            (id_modelo, id_cliente, id_modelo, id_modelo)
+        )
+        atualizado = cursor.rowcount == 1
+    invalidar_matriz_plano(id_cliente)
+    return atualizado
+
+# toda mudança no plano efetivo de um cliente (itens próprios ou do modelo dele) sobe a versão, na mesma transação
+SQL_NOVA_VERSAO_PLANO = {
+    "id_cliente": ("UPDATE clientes SET versao_plano = versao_plano + 1 WHERE id_cliente = ?",),
+    "id_modelo": ("UPDATE clientes SET versao_plano = versao_plano + 1 WHERE id_modelo = ?",
+                  "UPDATE modelos_plano SET versao = versao + 1 WHERE id_modelo = ?"),
+}
+
+def nova_versao_plano(db: sqlite3.Connection, coluna_dono: str, id_dono: str):
+    for sql in SQL_NOVA_VERSAO_PLANO[coluna_dono]:
+        db.execute(sql, (id_dono,))
+
+# itens próprios do cliente sobrepõem itens do modelo com a mesma (refeicao, nome)
+SQL_PLANO_EFETIVO = """
+    SELECT p.refeicao, p.id_item, p.nome, p.cal_100g, p.prot_100g, p.carb_100g, p.fat_100g, p.id_embedding
+    FROM planos p WHERE p.id_cliente = :id_cliente
+    UNION ALL
+    SELECT i.refeicao, i.id_item, i.nome, i.cal_100g, i.prot_100g, i.carb_100g, i.fat_100g, i.id_embedding
+    FROM clientes c JOIN modelos_plano_itens i ON i.id_modelo = c.id_modelo
+    WHERE c.id_cliente = :id_cliente
+      AND NOT EXISTS (SELECT 1 FROM planos p2 WHERE p2.id_cliente = c.id_cliente AND p2.refeicao = i.refeicao AND p2.nome = i.nome)
+"""
+
+def _formatar_item_plano(item) -> Dict[str, Any]:
+    return {
+        "id": item["id_item"],
+        "nome": item["nome"],
+        "per_100g": {
+            "cal": item["cal_100g"],
+            "prot": item["prot_100g"],
+            "carb": item["carb_100g"],
+            "fat": item["fat_100g"]
         }
-        plano_dict[refeicao].append(item_formatado)
-        
+    }
+
+def _agrupar_plano(itens) -> Dict[str, List[Dict[str,Any]]]:
+    plano_dict = {}
+    for item in itens:
+        plano_dict.setdefault(item["refeicao"], []).append(_formatar_item_plano(item))
     return plano_dict
 
-def _encontrar_item_por_nome_por_embedding(id_cliente: str, texto_item: str, limiar: float=0.55) -> Optional[Tuple[str, Dict[str,Any]]]:
-    if MODELO_IA is None: return None
+class CachePlanos:
+    # plano agrupado por cliente, válido enquanto clientes.versao_plano não mudar;
+    # o contador fica no banco, então escritas de outro processo também invalidam
+    def __init__(self, capacidade: int):
+        self.capacidade = capacidade
+        self._planos: "OrderedDict[str, Tuple[int, Dict[str, List[Dict[str, Any]]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.remocoes = 0
+
+    def obter(self, id_cliente: str, versao: int) -> Optional[Dict[str, List[Dict[str, Any]]]]:
+        with self._lock:
+            entrada = self._planos.get(id_cliente)
+            if entrada is not None and entrada[0] == versao:
+                self._planos.move_to_end(id_cliente)
+                self.acertos += 1
+                return entrada[1]
+            self.falhas += 1
+            return None
+
+    def guardar(self, id_cliente: str, versao: int, plano: Dict[str, List[Dict[str, Any]]]):
+        with self._lock:
+            atual = self._planos.get(id_cliente)
+            if atual is None or atual[0] <= versao:
+                self._planos[id_cliente] = (versao, plano)
+                self._planos.move_to_end(id_cliente)
+                while len(self._planos) > self.capacidade:
+                    self._planos.popitem(last=False)
+                    self.remocoes += 1
+
+    def invalidar(self, id_cliente: str):
+        with self._lock:
+            self._planos.pop(id_cliente, None)
+
+    def estatisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"clientes": len(self._planos), "capacidade": self.capacidade,
+                    "acertos": self.acertos, "falhas": self.falhas, "remocoes": self.remocoes}
+
+CACHE_PLANOS = CachePlanos(TAMANHO_CACHE_PLANOS)
 
+def versao_plano(id_cliente: str) -> Optional[int]:
     with get_db() as db:
-        cursor = db.execute("SELECT * FROM planos WHERE id_cliente = ? AND embedding_vec IS NOT NULL", (id_cliente,))
-        itens = cursor.fetchall()
+        linha = db.execute("SELECT versao_plano FROM clientes WHERE id_cliente = ?", (id_cliente,)).fetchone()
+    return linha["versao_plano"] if linha else None
 
-    if not itens:
-        return None
+def listar_plano(id_cliente: str) -> Dict[str, List[Dict[str,Any]]]:
+    # o dicionário devolvido é compartilhado pelo cache: quem chama só lê
+    versao = versao_plano(id_cliente)
+    if versao is None:
+        return {}
+    plano = CACHE_PLANOS.obter(id_cliente, versao)
+    if plano is not None:
+        return plano
+    with get_db() as db:
+        cursor = db.execute(
+            f"SELECT refeicao, id_item, nome, cal_100g, prot_100g, carb_100g, fat_100g FROM ({SQL_PLANO_EFETIVO}) ORDER BY refeicao",
+            {"id_cliente": id_cliente}
+        )
+        itens = cursor.fetchall()
+    # a versão foi lida antes dos itens: na pior das hipóteses o plano guardado é mais novo que a versão, e a próxima leitura refaz
+    plano = _agrupar_plano(itens)
+    CACHE_PLANOS.guardar(id_cliente, versao, plano)
+    return plano
 
-    emb_texto = MODELO_IA.encode(texto_item, convert_to_tensor=True)
-    melhor_sim = -1.0
-    melhor_match = None
-    
-    for item_row in itens:
-        item = dict(item_row)
-        vec_blob = item.get("embedding_vec")
-        if vec_blob is None:
-            continue
-            
+def listar_itens_modelo(id_modelo: str) -> Dict[str, List[Dict[str,Any]]]:
+    with get_db() as db:
+        cursor = db.execute(
+            "SELECT refeicao, id_item, nome, cal_100g, prot_100g, carb_100g, fat_100g FROM modelos_plano_itens WHERE id_modelo = ? ORDER BY refeicao",
+            (id_modelo,)
+        )
+        itens = cursor.fetchall()
+    return _agrupar_plano(itens)
+
+class CacheMatrizes:
+    def __init__(self, capacidade: int):
+        self.capacidade = capacidade
+        self._entradas: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._geracoes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.remocoes = 0
+
+    def obter(self, chave: str, montar, versao: Optional[int]=None) -> Dict[str, Any]:
+        # com versão (lida do banco), a entrada só vale se foi montada na mesma versão: escritas de outro processo também invalidam
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            geracao = self._geracoes.get(chave, 0)
+            if entrada is not None and entrada.get("versao") == versao:
+                self._entradas.move_to_end(chave)
+                return entrada
+
+        entrada = montar(chave)
+        entrada["versao"] = versao
+        with self._lock:
+            # só guarda se nada mudou enquanto a matriz era montada
+            if self._geracoes.get(chave, 0) == geracao:
+                self._entradas[chave] = entrada
+                self._entradas.move_to_end(chave)
+                while len(self._entradas) > self.capacidade:
+                    self._entradas.popitem(last=False)
+                    self.remocoes += 1
+        return entrada
+
+    def invalidar(self, chave: str):
+        with self._lock:
+            self._entradas.pop(chave, None)
+            self._geracoes[chave] = self._geracoes.get(chave, 0) + 1
+
+    def invalidar_onde(self, condicao):
+        with self._lock:
+            for chave in [c for c, e in self._entradas.items() if condicao(e)]:
+                self._entradas.pop(chave)
+                self._geracoes[chave] = self._geracoes.get(chave, 0) + 1
+
+    def __len__(self) -> int:
+        return len(self._entradas)
+
+    def bytes(self) -> int:
+        with self._lock:
+            entradas = list(self._entradas.values())
+        return sum(fonte["matriz"].nbytes for entrada in entradas for fonte in (entrada.get("proprio", entrada),))
+
+CACHE_PLANO_EMBED = CacheMatrizes(TAMANHO_CACHE_MATRIZES_CLIENTES)
+CACHE_MODELO_EMBED = CacheMatrizes(TAMANHO_CACHE_MATRIZES_MODELOS)
+
+def _montar_matriz(itens) -> Dict[str, Any]:
+    blobs = []
+    refeicoes = []
+    chaves = []
+    itens_formatados = []
+    modelo_atual = id_modelo(MODELO_EMBEDDING)
+    dim_esperada = None
+    for item in itens:
         try:
-            vec = pd.np.frombuffer(vec_blob, dtype=pd.np.float32) 
-            sim = float(util.cos_sim(emb_texto, vec))
-            
-            if sim > melhor_sim:
-                melhor_sim = sim
-                item_formatado = {
-                    "id": item["id_item"],
-                    "nome": item["nome"],
-                    "per_100g": {
-                        "cal": item["cal_100g"],
-                        "prot": item["prot_100g"],
-                        "carb": item["carb_100g"],
-                        "fat": item["fat_100g"]
-                    },
-                    "_embedding_vec": vec 
-                }
-                melhor_match = (item["refeicao"], item_formatado)
-        except Exception as e:
-            print(f"Erro ao processar embedding do item {item['id_item']}: {e}")
-            
-    if melhor_match and melhor_sim >= limiar:
-        return melhor_match
-        
-    return None
+            cabecalho = ler_cabecalho(item["vec"])
+        except ValueError as e:
+            print(f"[AVISO] embedding do item {item['id_item']} ilegível ({e}), ignorado.")
+            continue
+        dim = cabecalho[1] if cabecalho else len(item["vec"]) // 4
+        if cabecalho and cabecalho[3] != modelo_atual:
+            print(f"[AVISO] embedding do item {item['id_item']} foi gerado por outro modelo, ignorado.")
+            continue
+        if dim_esperada is not None and dim != dim_esperada:
+            print(f"[AVISO] embedding com dimensão inesperada no item {item['id_item']}, ignorado.")
+            continue
+        dim_esperada = dim
+        blobs.append(item["vec"])
+        refeicoes.append(item["refeicao"])
+        chaves.append((item["refeicao"], item["nome"]))
+        itens_formatados.append(_formatar_item_plano(item))
+
+    matriz = MatrizCompacta.de_blobs(blobs)
+    return {"matriz": matriz, "refeicoes": refeicoes, "chaves": chaves, "itens": itens_formatados}
+
+_SQL_ITENS_COM_VETOR = """
+    SELECT x.id_item, x.refeicao, x.nome, x.cal_100g, x.prot_100g, x.carb_100g, x.fat_100g, e.vec
+    FROM {tabela} x JOIN embeddings_itens e ON e.id_embedding = x.id_embedding
+    WHERE x.{coluna} = ?
+"""
+
+def _montar_matriz_modelo(id_modelo: str) -> Dict[str, Any]:
+    with get_db() as db:
+        itens = db.execute(_SQL_ITENS_COM_VETOR.format(tabela="modelos_plano_itens", coluna="id_modelo"), (id_modelo,)).fetchall()
+    return _montar_matriz(itens)
 
-def calcular_bmr(peso_kg: float, altura_cm: float, idade: int, sexo: str) -> float:
-    s = sexo.lower()[0] if sexo else "f"
-    if s in ("f", "m") and s == "f":
-        return 10 * peso_kg + 6.25 * altura_cm - 5 * idade - 161
+def _montar_matriz_plano(id_cliente: str) -> Dict[str, Any]:
+    with get_db() as db:
+        itens = db.execute(_SQL_ITENS_COM_VETOR.format(tabela="planos", coluna="id_cliente"), (id_cliente,)).fetchall()
+        proprias = {(r["refeicao"], r["nome"]) for r in db.execute("SELECT refeicao, nome FROM planos WHERE id_cliente = ?", (id_cliente,))}
+        linha = db.execute(
+            """SELECT c.id_modelo, m.versao AS versao_modelo
+               FROM clientes c LEFT JOIN modelos_plano m ON m.id_modelo = c.id_modelo
+               WHERE c.id_cliente = ?""", (id_cliente,)).fetchone()
+
+    entrada = {"proprio": _montar_matriz(itens), "id_modelo": linha["id_modelo"] if linha else None, "ocultos": None}
+    if entrada["id_modelo"]:
+        # a matriz do modelo é compartilhada entre todos os clientes; aqui só guardamos quais linhas o cliente sobrepõe
+        modelo = CACHE_MODELO_EMBED.obter(entrada["id_modelo"], _montar_matriz_modelo, linha["versao_modelo"])
+        entrada["ocultos"] = np.array([chave in proprias for chave in modelo["chaves"]], dtype=bool)
+        entrada["modelo"] = modelo
+    return entrada
+
+def invalidar_matriz_plano(id_cliente: str):
+    CACHE_PLANO_EMBED.invalidar(id_cliente)
+
+def invalidar_matriz_modelo(id_modelo: str):
+    CACHE_MODELO_EMBED.invalidar(id_modelo)
+    CACHE_PLANO_EMBED.invalidar_onde(lambda entrada: entrada["id_modelo"] == id_modelo)
+
+def _top_k(sims: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, sims.shape[0])
+    if k < sims.shape[0]:
+        indices = np.argpartition(-sims, k - 1)[:k]
     else:
-        return 10 * peso_kg + 6.25 * altura_cm - 5 * idade + 5
+        indices = np.arange(sims.shape[0])
+    return indices[np.argsort(-sims[indices])]
+
+def buscar_itens_plano_por_embedding(id_cliente: str, texto_item: str, top_k: int=3, limiar: float=0.0) -> List[Tuple[str, Dict[str,Any], float]]:
+    if MODELO_IA is None: return []
+
+    # mesma regra do CACHE_PLANOS: vale enquanto clientes.versao_plano não mudar
+    entrada = CACHE_PLANO_EMBED.obter(id_cliente, _montar_matriz_plano, versao_plano(id_cliente))
+    fontes = [(entrada["proprio"], None)]
+    if entrada.get("modelo") is not None:
+        fontes.append((entrada["modelo"], entrada["ocultos"]))
+    if all(fonte["matriz"].shape[0] == 0 for fonte, _ in fontes):
+        return []
 
-def calcular_tdee(bmr: float, atividade: str) -> float:
-    fator = FATORES_ATIVIDADE.get(atividade, FATORES_ATIVIDADE["sedentario"])
-    return bmr * fator
+    emb_texto = codificar_texto(texto_item)
+    candidatos = []
+    for fonte, ocultos in fontes:
+        matriz = fonte["matriz"]
+        if matriz.shape[0] == 0:
+            continue
+        if emb_texto.shape[0] != matriz.shape[1]:
+            print(f"[AVISO] dimensão do embedding da consulta ({emb_texto.shape[0]}) difere da do plano ({matriz.shape[1]}).")
+            continue
+        sims = matriz @ emb_texto
+        if ocultos is not None and ocultos.any():
+            sims = np.where(ocultos, -np.inf, sims)
+        for idx in _top_k(sims, top_k):
+            if np.isfinite(sims[idx]):
+                candidatos.append((float(sims[idx]), fonte, idx))
+
+    candidatos.sort(key=lambda c: -c[0])
+    resultados = []
+    for sim, fonte, idx in candidatos[:top_k]:
+        if sim < limiar:
+            break
+        item_formatado = dict(fonte["itens"][idx])
+        item_formatado["_embedding_vec"] = fonte["matriz"].linha(idx)
+        resultados.append((fonte["refeicoes"][idx], item_formatado, sim))
+    return resultados
 
-def recomendacao_agua_ml(peso_kg: float) -> float:
-    return peso_kg * 35
+def _encontrar_item_por_nome_por_embedding(id_cliente: str, texto_item: str, limiar: float=0.55) -> Optional[Tuple[str, Dict[str,Any]]]:
+    resultados = buscar_itens_plano_por_embedding(id_cliente, texto_item, top_k=1, limiar=limiar)
+    if resultados:
+        refeicao, item, _ = resultados[0]
+        return refeicao, item
+    return None
 
-def calcular_imc(peso_kg: float, altura_cm: float) -> Optional[float]:
-    try:
-        altura_m = float(altura_cm) / 100.0
-        if altura_m <= 0:
-            return None
-        return peso_kg / (altura_m * altura_m)
-    except Exception:
-        return None
+CACHE_METRICAS = CacheMetricas(TAMANHO_CACHE_METRICAS)
 
-def classificar_imc(imc: float) -> str:
-    if imc is None:
-        return "IMC não calculável"
-    if imc < 18.5:
-        return "Magreza (IMC < 18.5)"
-    if imc < 25:
-        return "Normal (IMC 18.5–24.9)"
-    if imc < 30:
-        return "Sobrepeso (IMC 25–29.9)"
-    return "Obesidade (IMC ≥ 30)"
+def metricas_cliente(cliente: Dict[str, Any]) -> Dict[str, Any]:
+    return CACHE_METRICAS.obter(chave_metricas(cliente), lambda: metricas_de_cliente(cliente))
+
+def metricas_populacao(id_nutri: Optional[str]=None) -> pd.DataFrame:
+    # caminho em lote (analytics, jobs noturnos): uma leitura, um cálculo vetorizado, e o cache já sai aquecido
+    sql = "SELECT id_cliente, id_nutri, nome, idade, sexo, peso_kg, altura_cm, atividade FROM clientes"
+    params: Tuple = ()
+    if id_nutri:
+        sql += " WHERE id_nutri = ?"
+        params = (id_nutri,)
+    with get_db() as db:
+        linhas = [dict(row) for row in db.execute(sql, params).fetchall()]
+    df = pd.DataFrame(linhas, columns=["id_cliente", "id_nutri", "nome", "idade", "sexo", "peso_kg", "altura_cm", "atividade"])
+    df = df.join(metricas_dataframe(df))
+    if not df.empty:
+        colunas = ["bmr_kcal", "tdee_kcal", "imc", "imc_class", "agua_ml"]
+        valores = df[colunas].astype(object).where(df[colunas].notna(), None)
+        CACHE_METRICAS.preencher(dict(zip(map(chave_metricas, linhas), valores.to_dict(orient="records"))))
+    return df
 
 def extrair_itens_e_gramas(frase: str) -> List[Tuple[str, float]]:
     frase = frase.lower()
     resultados = []
+    pares = [(m.group(2).strip(" ,.;"), float(m.group(1).replace(",", "."))) for m in QUANTIDADE_DE_ITEM_PATTERN.finditer(frase)]
+    if pares:
+        return pares
     matches = list(ITEM_GRAMA_PAIR_PATTERN.finditer(frase))
     if matches:
         for m in matches:
@@ -523,90 +1695,610 @@ def extrair_itens_e_gramas(frase: str) -> List[Tuple[str, float]]:
                 resultados.append((nome, 100.0))
     return resultados
 
-def registrar_consumo(id_cliente: str, refeicao: str, nome_item_usuario: str, gramas: float) -> Dict[str, Any]:
-    cliente = get_cliente_por_id(id_cliente)
+RE_KCAL_ITEM = re.compile(r'(\d+(?:[.,]\d+)?)\s*(kcal|calorias|cal)')
+RE_PREPOSICAO_INICIAL = re.compile(r'^(?:de|do|da|dos|das)\s+')
+# o híbrido (metade cosseno, metade texto) e o WRatio do caminho sem modelo não estão na mesma escala
+LIMIAR_ALIMENTO_BASE = float(os.environ.get("OTRI_LIMIAR_ALIMENTO_BASE", "65"))
+LIMIAR_ALIMENTO_BASE_TEXTO = float(os.environ.get("OTRI_LIMIAR_ALIMENTO_BASE_TEXTO", "90"))
+
+def _eh_agua(nome: str) -> bool:
+    nome_norm = unidecode(normalizar_texto(nome))
+    if nome_norm.startswith("de "):
+        nome_norm = nome_norm[3:]
+    return nome_norm == "agua"
+
+def _gravar_consumo(db: sqlite3.Connection, id_cliente: str, registro: Dict[str, Any], ts_ms: int, dia: int):
+    db.execute(
+        """INSERT INTO registros_consumo (id_cliente, data_hora, refeicao, nome_item, gramas, kcal, ts_ms, dia, prot_g, carb_g, fat_g, agua_ml)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        (id_cliente, registro["data_hora"], registro["refeicao"], registro["nome_item"], registro["gramas"], registro["kcal"], ts_ms, dia,
+         registro["prot_g"], registro["carb_g"], registro["fat_g"], registro["agua_ml"])
+    )
+    db.execute(
+        """INSERT INTO consumo_diario (id_cliente, dia, kcal, prot_g, carb_g, fat_g, agua_ml, itens)
+           VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+           ON CONFLICT (id_cliente, dia) DO UPDATE SET
+               kcal = kcal + excluded.kcal,
+               prot_g = prot_g + excluded.prot_g,
+               carb_g = carb_g + excluded.carb_g,
+               fat_g = fat_g + excluded.fat_g,
+               agua_ml = agua_ml + excluded.agua_ml,
+               itens = itens + 1""",
+        (id_cliente, dia, registro["kcal"], registro["prot_g"], registro["carb_g"], registro["fat_g"], registro["agua_ml"])
+    )
+
+def registrar_consumo(id_cliente: str, refeicao: str, nome_item_usuario: str, gramas: float, ctx: Optional["ContextoTurno"]=None) -> Dict[str, Any]:
+    if ctx is not None:
+        return _registrar_consumo(ctx, refeicao, nome_item_usuario, gramas)
+    with ContextoTurno(id_cliente) as ctx:
+        registro = _registrar_consumo(ctx, refeicao, nome_item_usuario, gramas)
+    return None if ctx.erro else registro
+
+def _numero_base(valor) -> float:
+    # a TACO usa "Tr" (traços) e vazios: contam como zero
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if math.isnan(numero) else numero
+
+def _item_da_base(alimento: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "nome": alimento["descricao_alimento"],
+        "per_100g": {
+            "cal": _numero_base(alimento.get("energia_kcal")),
+            "prot": _numero_base(alimento.get("proteina_g")),
+            "carb": _numero_base(alimento.get("carboidrato_g")),
+            "fat": _numero_base(alimento.get("lipideo_g")),
+        }
+    }
+
+def resolver_itens_consumo(id_cliente: str, nomes: List[str]) -> List[Optional[Dict[str, Any]]]:
+    # primeiro o plano do cliente; o que não estiver nele é procurado na base de alimentos, todos de uma vez
+    # o mesmo texto vai para o plano e para a base, então um único encode em lote serve às duas buscas (via cache)
+    consultas = [RE_PREPOSICAO_INICIAL.sub("", nome.strip()) or nome for nome in nomes]
+    if MODELO_IA is not None and consultas:
+        codificar_textos(consultas)
+    resolvidos: List[Optional[Dict[str, Any]]] = []
+    for consulta in consultas:
+        encontrado = _encontrar_item_por_nome_por_embedding(id_cliente, consulta)
+        resolvidos.append({**encontrado[1], "origem": "plano"} if encontrado else None)
+
+    faltando = [i for i, nome in enumerate(nomes)
+                if resolvidos[i] is None and not _eh_agua(nome) and not RE_KCAL_ITEM.search(nome)]
+    if faltando:
+        achados = buscar_alimentos_base_lote([consultas[i] for i in faltando], limite=1, score_min=LIMIAR_ALIMENTO_BASE,
+                                             score_min_texto=LIMIAR_ALIMENTO_BASE_TEXTO)
+        for i, achado in zip(faltando, achados):
+            if achado:
+                resolvidos[i] = {**_item_da_base(achado[0]), "origem": "base"}
+    return resolvidos
+
+def _registrar_consumo(ctx: "ContextoTurno", refeicao: str, nome_item_usuario: str, gramas: float,
+                       resolvido: Any=_NAO_CARREGADO) -> Dict[str, Any]:
+    id_cliente = ctx.id_cliente
+    cliente = ctx.cliente
     if not cliente:
         raise ValueError("Cliente não encontrado")
 
-    encontrado = _encontrar_item_por_nome_por_embedding(id_cliente, nome_item_usuario)
-    if encontrado:
-        refeicao_plano, item_plano = encontrado
-        cal100 = item_plano["per_100g"]["cal"]
-        kcal = cal100 * (gramas / 100.0)
-        nome_final = item_plano["nome"]
+    if resolvido is _NAO_CARREGADO:
+        resolvido = resolver_itens_consumo(id_cliente, [nome_item_usuario])[0]
+    prot = carb = fat = 0.0
+    if resolvido:
+        p = resolvido["per_100g"]
+        fator = gramas / 100.0
+        kcal = p["cal"] * fator
+        prot = (p.get("prot") or 0.0) * fator
+        carb = (p.get("carb") or 0.0) * fator
+        fat = (p.get("fat") or 0.0) * fator
+        nome_final = resolvido["nome"]
     else:
-        m = re.search(r'(\d+(?:[.,]\d+)?)\s*(kcal|calorias|cal)', nome_item_usuario)
+        m = RE_KCAL_ITEM.search(nome_item_usuario)
         if m:
             kcal = float(m.group(1).replace(",", "."))
             nome_final = nome_item_usuario
         else:
-            kcal = gramas * 1.0 
+            kcal = 0.0 if _eh_agua(nome_item_usuario) else gramas * 1.0 
             nome_final = nome_item_usuario
 
+    data_hora, ts_ms = instante_atual()
     registro = {
-        "data_hora": datetime.utcnow().isoformat(),
+        "data_hora": data_hora,
         "refeicao": refeicao,
         "nome_item": nome_final,
         "gramas": float(gramas),
-        "kcal": float(kcal)
+        "kcal": float(kcal),
+        "prot_g": float(prot),
+        "carb_g": float(carb),
+        "fat_g": float(fat),
+        "agua_ml": float(gramas) if _eh_agua(nome_final) else 0.0
     }
+    dia = chave_dia(ts_ms, cliente.get("fuso_horario"))
 
-    try:
-        with get_db() as db:
-            db.execute(
-                "INSERT INTO registros_consumo (id_cliente, data_hora, refeicao, nome_item, gramas, kcal) VALUES (?, ?, ?, ?, ?, ?)",
-                (id_cliente, registro["data_hora"], registro["refeicao"], registro["nome_item"], registro["gramas"], registro["kcal"])
-            )
-            
-            texto_log = f"registrei: {nome_final} {gramas}g no {refeicao}"
-            db.execute(
-                "INSERT INTO conversas (id_cliente, role, texto, time) VALUES (?, ?, ?, ?)",
-                (id_cliente, "user", texto_log, datetime.utcnow().isoformat())
-            )
-        return registro
-    except Exception as e:
-        print(f"Erro ao registrar consumo: {e}")
-        return None
+    # registro, total do dia e a linha de log entram na transação do turno;
+    # o evento de consumo sai junto com a linha de log, depois do commit
+    ctx.escrever(lambda db: _gravar_consumo(db, id_cliente, registro, ts_ms, dia))
+    texto_log = f"registrei: {nome_final} {gramas}g no {refeicao}"
+    ctx.salvar_conversa("user", texto_log, extras=[{"tipo": "consumo", "dia": dia, **registro}])
+    ctx.registrar_consumo_local(dia, registro)
+    return registro
 
-def consumo_total_hoje(id_cliente: str) -> Tuple[float, List[Dict[str,Any]]]:
-    hoje = date.today().isoformat()
+def _fuso_do_cliente(id_cliente: str) -> Optional[str]:
+    with get_db() as db:
+        linha = db.execute("SELECT fuso_horario FROM clientes WHERE id_cliente = ?", (id_cliente,)).fetchone()
+    return linha["fuso_horario"] if linha else None
+
+def consumo_total_hoje(id_cliente: str, fuso: Optional[str]=None, dia: Optional[int]=None) -> Tuple[float, List[Dict[str,Any]]]:
+    hoje = dia if dia is not None else chave_dia_hoje(fuso or _fuso_do_cliente(id_cliente))
     with get_db() as db:
         cursor = db.execute(
-            "SELECT * FROM registros_consumo WHERE id_cliente = ? AND data_hora LIKE ?",
-            (id_cliente, f"{hoje}%")
+            "SELECT * FROM registros_consumo WHERE id_cliente = ? AND dia = ? ORDER BY ts_ms",
+            (id_cliente, hoje)
         )
         itens = [dict(row) for row in cursor.fetchall()]
         
     total = sum(r.get("kcal", 0.0) for r in itens)
     return total, itens
 
-def _salvar_conversa(id_cliente: str, role: str, texto: str):
+def consumo_resumo_dia(id_cliente: str, fuso: Optional[str]=None, dia: Optional[int]=None) -> Dict[str, Any]:
+    if dia is None:
+        dia = chave_dia_hoje(fuso or _fuso_do_cliente(id_cliente))
+    with get_db() as db:
+        linha = db.execute(
+            "SELECT kcal, prot_g, carb_g, fat_g, agua_ml, itens FROM consumo_diario WHERE id_cliente = ? AND dia = ?",
+            (id_cliente, dia)
+        ).fetchone()
+    if not linha:
+        return {"dia": dia, "kcal": 0.0, "prot_g": 0.0, "carb_g": 0.0, "fat_g": 0.0, "agua_ml": 0.0, "itens": 0}
+    resumo = dict(linha)
+    resumo["dia"] = dia
+    return resumo
+
+class HubEventos:
+    def __init__(self):
+        self._assinantes: Dict[str, List[Any]] = {}
+        self._lock = threading.Lock()
+        self.publicados = 0
+        self.falhas = 0
+
+    def assinar(self, id_cliente: str, callback):
+        with self._lock:
+            self._assinantes.setdefault(id_cliente, []).append(callback)
+
+    def cancelar(self, id_cliente: str, callback):
+        with self._lock:
+            callbacks = self._assinantes.get(id_cliente, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks:
+                self._assinantes.pop(id_cliente, None)
+
+    def publicar(self, id_cliente: str, evento: Dict[str, Any]):
+        with self._lock:
+            callbacks = list(self._assinantes.get(id_cliente, ()))
+        self.publicados += 1
+        # callbacks não podem bloquear: quem assina (ex.: a API) só enfileira o evento
+        for callback in callbacks:
+            try:
+                callback(evento)
+            except Exception as e:
+                self.falhas += 1
+                print(f"[AVISO] falha ao entregar evento do cliente {id_cliente}: {e}")
+
+    def estatisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            assinantes = sum(len(c) for c in self._assinantes.values())
+            clientes = len(self._assinantes)
+        return {"clientes": clientes, "assinantes": assinantes, "publicados": self.publicados, "falhas": self.falhas}
+
+HUB_EVENTOS = HubEventos()
+
+def _evento_mensagem(id_conversa: int, role: str, texto: str, momento: str) -> Dict[str, Any]:
+    return {"tipo": "mensagem", "id_conversa": id_conversa, "role": role, "texto": texto, "time": momento}
+
+def _gravar_conversas(db: sqlite3.Connection, linhas: list) -> List[Tuple[str, List[Dict[str, Any]]]]:
+    # devolve os eventos para publicar só depois do commit
+    eventos = []
+    for id_cliente, role, texto, momento, ts_ms, extras in linhas:
+        cursor = db.execute(
+            "INSERT INTO conversas (id_cliente, role, texto, time, ts_ms) VALUES (?, ?, ?, ?, ?)",
+            (id_cliente, role, texto, momento, ts_ms)
+        )
+        id_conversa = cursor.lastrowid
+        eventos.append((id_cliente, [_evento_mensagem(id_conversa, role, texto, momento)] +
+                                    [{**extra, "id_conversa": id_conversa} for extra in extras]))
+    return eventos
+
+def _publicar_eventos(eventos: List[Tuple[str, List[Dict[str, Any]]]]):
+    for id_cliente, lista in eventos:
+        for evento in lista:
+            HUB_EVENTOS.publicar(id_cliente, evento)
+
+class UnidadeEscrita:
+    # o que precisa ir junto para o banco: escritas (funções que recebem a conexão) e as linhas de conversa
+    def __init__(self, escritas: List[Callable[[sqlite3.Connection], None]], linhas: list):
+        self.escritas = escritas
+        self.linhas = linhas
+        self.erro: Optional[Exception] = None
+        self.comandos = 0  # comandos que a unidade mandou ao banco (na thread do gravador)
+        self.pronta = threading.Event()
+        # quem esperou demais desiste da unidade, mas só se o gravador ainda não a pegou
+        self._lock = threading.Lock()
+        self.iniciada = False
+        self.abandonada = False
+
+    def _contar(self, _sql: str):
+        self.comandos += 1
+
+    def iniciar(self) -> bool:
+        with self._lock:
+            if not self.abandonada:
+                self.iniciada = True
+            return self.iniciada
+
+    def abandonar(self) -> bool:
+        with self._lock:
+            if not self.iniciada:
+                self.abandonada = True
+            return self.abandonada
+
+def _gravar_unidades(db: sqlite3.Connection, unidades: List[UnidadeEscrita]) -> List[Tuple[str, List[Dict[str, Any]]]]:
+    db.execute("BEGIN IMMEDIATE")
     try:
-        with get_db() as db:
-            db.execute(
-                "INSERT INTO conversas (id_cliente, role, texto, time) VALUES (?, ?, ?, ?)",
-                (id_cliente, role, texto, datetime.utcnow().isoformat())
-            )
+        eventos = []
+        # com o lock de escrita em mãos, o que foi abandonado fica de fora; o resto já não pode ser cancelado
+        for unidade in [u for u in unidades if u.iniciar()]:
+            unidade.comandos = 0
+            db.set_trace_callback(unidade._contar)
+            for escrita in unidade.escritas:
+                escrita(db)
+            eventos.extend(_gravar_conversas(db, unidade.linhas))
+            db.set_trace_callback(None)
+        db.commit()
+        return eventos
+    except Exception:
+        if db.in_transaction:
+            db.rollback()
+        raise
+    finally:
+        db.set_trace_callback(None)
+
+class GravadorConversas:
+    def __init__(self, fila_max: int, lote_max: int, espera_max_ms: float):
+        self.lote_max = lote_max
+        self.espera_max_s = espera_max_ms / 1000.0
+        self.fila: "queue.Queue[Optional[UnidadeEscrita]]" = queue.Queue(maxsize=fila_max)
+        self.hist_tamanho_lote = Histograma((1, 2, 4, 8, 16, 32, 64, 128))
+        self._cond = threading.Condition()
+        self._enfileirados = 0
+        self._concluidos = 0
+        self.falhas = 0
+        self.sincronas = 0
+        self._thread = threading.Thread(target=self._trabalhar, name="gravador-conversas", daemon=True)
+        self._thread.start()
+
+    def enfileirar(self, unidade: UnidadeEscrita) -> bool:
+        with self._cond:
+            self._enfileirados += 1
+        try:
+            # fila cheia por muito tempo: devolve para quem chamou gravar direto (contrapressão sem perder mensagem)
+            self.fila.put(unidade, timeout=1.0)
+            return True
+        except queue.Full:
+            with self._cond:
+                self._concluidos += 1
+                self.sincronas += 1
+                self._cond.notify_all()
+            return False
+
+    def _coletar_lote(self, primeiro) -> Tuple[list, bool]:
+        # pega o que acumulou enquanto o commit anterior rodava; só espera mais se houver janela configurada
+        lote = [primeiro]
+        prazo = time.perf_counter() + self.espera_max_s
+        while len(lote) < self.lote_max:
+            restante = prazo - time.perf_counter()
+            try:
+                item = self.fila.get(timeout=restante) if restante > 0 else self.fila.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return lote, True
+            lote.append(item)
+        return lote, False
+
+    def _gravar_lote(self, lote: List[UnidadeEscrita]):
+        db = get_db()
+        try:
+            eventos = _gravar_unidades(db, lote)
+        except Exception as e:
+            # uma unidade ruim não pode derrubar o lote inteiro: refaz uma a uma e marca só a que falhou
+            print(f"Erro ao gravar lote de {len(lote)} unidades, gravando separadamente: {e}")
+            eventos = []
+            for unidade in lote:
+                try:
+                    eventos.extend(_gravar_unidades(db, [unidade]))
+                except Exception as e_unidade:
+                    unidade.erro = e_unidade
+                    self.falhas += 1
+                    print(f"Erro ao gravar conversa: {e_unidade}")
+        _publicar_eventos(eventos)
+        for unidade in lote:
+            unidade.pronta.set()
+
+    def _trabalhar(self):
+        parar = False
+        while not parar:
+            primeiro = self.fila.get()
+            if primeiro is None:
+                break
+            lote, parar = self._coletar_lote(primeiro)
+            self.hist_tamanho_lote.observar(len(lote))
+            try:
+                self._gravar_lote(lote)
+            finally:
+                with self._cond:
+                    self._concluidos += len(lote)
+                    self._cond.notify_all()
+
+    def encerrar(self):
+        try:
+            self.fila.put(None, timeout=5.0)
+        except queue.Full:
+            # gravador travado com a fila cheia: o que ainda não foi pego é descartado, e isso fica no log
+            descartadas = 0
+            while True:
+                try:
+                    unidade = self.fila.get_nowait()
+                except queue.Empty:
+                    break
+                if unidade is not None and unidade.abandonar():
+                    unidade.erro = RuntimeError("Gravador de conversas encerrado.")
+                    unidade.pronta.set()
+                    descartadas += 1
+                    for id_cliente, role, texto, *_ in unidade.linhas:
+                        print(f"[AVISO] conversa descartada no encerramento ({id_cliente}, {role}): {texto[:80]}")
+            print(f"[AVISO] gravador de conversas não respondeu; {descartadas} unidades descartadas.")
+        self._thread.join(timeout=10)
+
+    def estatisticas(self) -> Dict[str, Any]:
+        with self._cond:
+            pendentes = self._enfileirados - self._concluidos
+            gravadas = self._concluidos
+        return {
+            "lote_max": self.lote_max,
+            "espera_max_ms": self.espera_max_s * 1000.0,
+            "pendentes": pendentes,
+            "processadas": gravadas,
+            "gravadas_direto": self.sincronas,
+            "falhas": self.falhas,
+            "tamanho_lote": self.hist_tamanho_lote.estatisticas()
+        }
+
+GRAVADOR_CONVERSAS: Optional[GravadorConversas] = None
+
+def iniciar_gravador_conversas():
+    global GRAVADOR_CONVERSAS
+    if GRAVADOR_CONVERSAS is None and not LOG_SINCRONO:
+        GRAVADOR_CONVERSAS = GravadorConversas(LOG_FILA_MAX, LOG_LOTE_MAX, LOG_ESPERA_MAX_MS)
+
+def encerrar_gravador_conversas():
+    global GRAVADOR_CONVERSAS
+    if GRAVADOR_CONVERSAS is not None:
+        GRAVADOR_CONVERSAS.encerrar()
+        GRAVADOR_CONVERSAS = None
+
+def gravar_unidade(unidade: UnidadeEscrita) -> Optional[Exception]:
+    # commit em grupo: quem grava espera o lote da sua unidade ser confirmado, então toda leitura
+    # posterior já enxerga a escrita e ninguém precisa esperar pela fila inteira
+    if GRAVADOR_CONVERSAS is not None and GRAVADOR_CONVERSAS.enfileirar(unidade):
+        if not unidade.pronta.wait(timeout=GRAVACAO_TIMEOUT_S):
+            if unidade.abandonar():
+                # o gravador vai pular a unidade: nada dela chega ao banco
+                return TimeoutError(f"gravação ainda pendente após {GRAVACAO_TIMEOUT_S:g}s")
+            # já está no commit: o resultado sai em instantes e é ele que vale
+            unidade.pronta.wait()
+        return unidade.erro
+    try:
+        _publicar_eventos(_gravar_unidades(get_db(), [unidade]))
     except Exception as e:
-        print(f"Erro ao salvar conversa: {e}")
+        unidade.erro = e
+    unidade.pronta.set()
+    return unidade.erro
+
+METRICAS_TURNOS = {"turnos": 0, "consultas": 0, "escritas": 0, "falhas": 0}
+HIST_CONSULTAS_TURNO = Histograma((1, 2, 4, 6, 8, 12, 16, 32))
+
+class ContextoTurno:
+    # unidade de trabalho de um turno: cliente, plano e consumo de hoje são lidos no máximo uma vez
+    # e tudo o que o turno grava vai para o banco numa única transação, no final
+    def __init__(self, id_cliente: str):
+        self.id_cliente = id_cliente
+        self.consultas = 0
+        self.erro: Optional[Exception] = None
+        self._cliente: Any = _NAO_CARREGADO
+        self._hoje: Optional[int] = None
+        self._plano: Optional[Dict[str, List[Dict[str, Any]]]] = None
+        self._resumo_hoje: Optional[Dict[str, Any]] = None
+        self._registros_hoje: Optional[List[Dict[str, Any]]] = None
+        self._escritas: List[Callable[[sqlite3.Connection], None]] = []
+        self._linhas: list = []
+        self._apos_confirmar: List[Callable[[], None]] = []
+        self._db_rastreado: Optional[sqlite3.Connection] = None
+
+    def _contar(self, _sql: str):
+        self.consultas += 1
+
+    @contextmanager
+    def rastrear(self):
+        # conta todo comando que o turno manda para o banco nesta thread (cache de matrizes, contexto etc.)
+        db = get_db()
+        if self._db_rastreado is db:
+            yield
+            return
+        anterior, self._db_rastreado = self._db_rastreado, db
+        db.set_trace_callback(self._contar)
+        try:
+            yield
+        finally:
+            db.set_trace_callback(None)
+            self._db_rastreado = anterior
+
+    @property
+    def cliente(self) -> Optional[Dict[str, Any]]:
+        if self._cliente is _NAO_CARREGADO:
+            with self.rastrear():
+                self._cliente = get_cliente_por_id(self.id_cliente)
+        return self._cliente
+
+    @property
+    def hoje(self) -> int:
+        if self._hoje is None:
+            self._hoje = chave_dia_hoje((self.cliente or {}).get("fuso_horario"))
+        return self._hoje
+
+    @property
+    def plano(self) -> Dict[str, List[Dict[str, Any]]]:
+        if self._plano is None:
+            with self.rastrear():
+                self._plano = listar_plano(self.id_cliente)
+        return self._plano
+
+    @property
+    def resumo_hoje(self) -> Dict[str, Any]:
+        if self._resumo_hoje is None:
+            with self.rastrear():
+                self._resumo_hoje = consumo_resumo_dia(self.id_cliente, dia=self.hoje)
+        return self._resumo_hoje
+
+    @property
+    def registros_hoje(self) -> List[Dict[str, Any]]:
+        if self._registros_hoje is None:
+            with self.rastrear():
+                self._registros_hoje = consumo_total_hoje(self.id_cliente, dia=self.hoje)[1]
+        return self._registros_hoje
+
+    def salvar_conversa(self, role: str, texto: str, extras: Optional[List[Dict[str, Any]]]=None):
+        momento, ts_ms = instante_atual()
+        self._linhas.append((self.id_cliente, role, texto, momento, ts_ms, extras or []))
+
+    def conversas_pendentes(self) -> List[Dict[str, Any]]:
+        return [{"id_conversa": None, "role": role, "texto": texto, "time": momento}
+                for _, role, texto, momento, _, _ in self._linhas]
+
+    def marcar(self) -> Tuple[int, int, int]:
+        return len(self._escritas), len(self._linhas), len(self._apos_confirmar)
+
+    def descartar_desde(self, marca: Tuple[int, int, int]):
+        # desfaz o que foi agendado depois da marca (ex.: regra que falhou no meio)
+        escritas, linhas, apos = marca
+        del self._escritas[escritas:], self._linhas[linhas:], self._apos_confirmar[apos:]
+
+    def escrever(self, escrita: Callable[[sqlite3.Connection], None], apos_confirmar: Optional[Callable[[], None]]=None):
+        self._escritas.append(escrita)
+        if apos_confirmar is not None:
+            self._apos_confirmar.append(apos_confirmar)
+
+    def atualizar_cliente_local(self, campos: Dict[str, Any]):
+        if self._cliente not in (_NAO_CARREGADO, None):
+            self._cliente = {**self._cliente, **campos}
+
+    def registrar_consumo_local(self, dia: int, registro: Dict[str, Any]):
+        # mantém o instantâneo coerente com o que o próprio turno já registrou
+        if dia != self._hoje:
+            return
+        if self._resumo_hoje is not None:
+            resumo = dict(self._resumo_hoje)
+            for campo in ("kcal", "prot_g", "carb_g", "fat_g", "agua_ml"):
+                resumo[campo] = (resumo.get(campo) or 0.0) + registro[campo]
+            resumo["itens"] = (resumo.get("itens") or 0) + 1
+            self._resumo_hoje = resumo
+        if self._registros_hoje is not None:
+            self._registros_hoje = self._registros_hoje + [{"id_cliente": self.id_cliente, "dia": dia, **registro}]
+
+    def confirmar(self) -> Optional[Exception]:
+        escritas, linhas, apos = self._escritas, self._linhas, self._apos_confirmar
+        self._escritas, self._linhas, self._apos_confirmar = [], [], []
+        if escritas or linhas:
+            unidade = UnidadeEscrita(escritas, linhas)
+            self.erro = gravar_unidade(unidade)
+            # os INSERT/UPDATE rodam na conexão do gravador, fora do rastrear(); entram na conta do turno aqui
+            self.consultas += unidade.comandos
+            if self.erro is None:
+                for acao in apos:
+                    acao()
+        HIST_CONSULTAS_TURNO.observar(self.consultas)
+        METRICAS_TURNOS["turnos"] += 1
+        METRICAS_TURNOS["consultas"] += self.consultas
+        METRICAS_TURNOS["escritas"] += len(escritas) + len(linhas)
+        if self.erro is not None:
+            METRICAS_TURNOS["falhas"] += 1
+        return self.erro
+
+    def __enter__(self) -> "ContextoTurno":
+        return self
+
+    def __exit__(self, tipo, valor, tb):
+        if tipo is None and self.confirmar() is not None:
+            print(f"Erro ao gravar turno do cliente {self.id_cliente}: {self.erro}")
+        return False
 
-def get_historico_conversa(id_cliente: str) -> List[Dict[str, Any]]:
+@contextmanager
+def _turno(id_cliente: str, ctx: Optional[ContextoTurno]=None):
+    # dentro de um turno usa o contexto dele; chamada avulsa abre (e confirma) um contexto próprio
+    if ctx is not None:
+        yield ctx
+        return
+    with ContextoTurno(id_cliente) as novo:
+        yield novo
+
+def estatisticas_turnos() -> Dict[str, Any]:
+    estat = dict(METRICAS_TURNOS)
+    estat["consultas_por_turno"] = HIST_CONSULTAS_TURNO.estatisticas()
+    return estat
+
+def get_historico_conversa(id_cliente: str, antes: Optional[int]=None, depois: Optional[int]=None, limite: Optional[int]=None) -> List[Dict[str, Any]]:
+    # paginação por chave (id_conversa cresce na ordem de gravação); sem cursor, "limite" traz as últimas N
+    filtros = ["id_cliente = ?"]
+    params: List[Any] = [id_cliente]
+    if antes is not None:
+        filtros.append("id_conversa < ?")
+        params.append(antes)
+    if depois is not None:
+        filtros.append("id_conversa > ?")
+        params.append(depois)
+    do_fim = depois is None and limite is not None
+    sql = f"SELECT id_conversa, role, texto, time FROM conversas WHERE {' AND '.join(filtros)} ORDER BY id_conversa {'DESC' if do_fim else 'ASC'}"
+    if limite is not None:
+        sql += " LIMIT ?"
+        params.append(limite)
     with get_db() as db:
-        cursor = db.execute(
-            "SELECT role, texto, time FROM conversas WHERE id_cliente = ? ORDER BY time ASC",
-            (id_cliente,)
-        )
-        return [dict(row) for row in cursor.fetchall()]
+        linhas = [dict(row) for row in db.execute(sql, params).fetchall()]
+    if do_fim:
+        linhas.reverse()
+    return linhas
 
-def saudacoes_cliente(id_cliente: str) -> str:
-    cliente = get_cliente_por_id(id_cliente)
-    nome = cliente.get('nome','Cliente') if cliente else 'Cliente'
-    resposta = f"Olá, {nome}! 👋 Estou aqui para te ajudar. Sobre o que vamos conversar hoje?"
-    _salvar_conversa(id_cliente, "bot", resposta)
+def ultimas_mensagens(id_cliente: str, n: int=10) -> List[Dict[str, Any]]:
+    return get_historico_conversa(id_cliente, limite=n)
+
+def ultimo_id_conversa(id_cliente: str) -> int:
+    with get_db() as db:
+        linha = db.execute("SELECT MAX(id_conversa) AS ultimo FROM conversas WHERE id_cliente = ?", (id_cliente,)).fetchone()
+    return linha["ultimo"] or 0
+
+def saudacoes_cliente(id_cliente: str, ctx: Optional[ContextoTurno]=None) -> str:
+    with _turno(id_cliente, ctx) as ctx:
+        cliente = ctx.cliente
+        nome = cliente.get('nome','Cliente') if cliente else 'Cliente'
+        resposta = f"Olá, {nome}! 👋 Estou aqui para te ajudar. Sobre o que vamos conversar hoje?"
+        ctx.salvar_conversa("bot", resposta)
     return resposta
 
-def recomendar_opcoes_refeicao(id_cliente: str, refeicao: str) -> str:
-    plano = listar_plano(id_cliente)
+def recomendar_opcoes_refeicao(id_cliente: str, refeicao: str, ctx: Optional[ContextoTurno]=None) -> str:
+    with _turno(id_cliente, ctx) as ctx:
+        return _recomendar_opcoes_refeicao(ctx, refeicao)
+
+def _recomendar_opcoes_refeicao(ctx: ContextoTurno, refeicao: str) -> str:
+    plano = ctx.plano
     refeicao_key = refeicao.strip().lower()
     opcoes = plano.get(refeicao_key, [])
     
@@ -619,25 +2311,28 @@ def recomendar_opcoes_refeicao(id_cliente: str, refeicao: str) -> str:
             linhas.append(f"• <b>{it['nome']}</b>: {p['cal']:.0f} kcal, {p.get('prot',0):.1f}g prot, {p.get('carb',0):.1f}g carb, {p.get('fat',0):.1f}g gord. (por 100g)")
         resposta = "\n".join(linhas)
 
-    _salvar_conversa(id_cliente, "bot", resposta.split('\n')[0]) 
+    ctx.salvar_conversa("bot", resposta.split('\n')[0])
     return resposta
 
-def recomendar_para_restante(id_cliente: str, margem_kcal: float = 0.0) -> str:
-    cliente = get_cliente_por_id(id_cliente)
+def recomendar_para_restante(id_cliente: str, margem_kcal: float = 0.0, ctx: Optional[ContextoTurno]=None) -> str:
+    with _turno(id_cliente, ctx) as ctx:
+        return _recomendar_para_restante(ctx, margem_kcal)
+
+def _recomendar_para_restante(ctx: ContextoTurno, margem_kcal: float) -> str:
+    cliente = ctx.cliente
     if not cliente:
         return "Cliente não encontrado."
     if not (cliente.get("peso_kg") and cliente.get("altura_cm") and cliente.get("idade")):
         return "Faltam dados (peso/altura/idade) para calcular sua meta calórica."
 
-    bmr = calcular_bmr(cliente["peso_kg"], cliente["altura_cm"], cliente["idade"], cliente["sexo"])
-    tdee = calcular_tdee(bmr, cliente.get("atividade", "sedentario"))
-    consumido, itens = consumo_total_hoje(id_cliente)
+    tdee = metricas_cliente(cliente)["tdee_kcal"]
+    consumido = ctx.resumo_hoje["kcal"]
     restante = tdee - consumido - margem_kcal
     
     if restante <= 50: 
         resposta = f"Parabéns! 🥳 Você já atingiu sua meta diária de ~{tdee:.0f} kcal (consumido: {consumido:.0f} kcal). Por hoje, o ideal é focar em bebidas sem calorias, como água ou chá."
     else:
-        plano = listar_plano(id_cliente)
+        plano = ctx.plano
         candidatos = []
         for refeicao, lista in plano.items():
             for item in lista:
@@ -657,37 +2352,59 @@ def recomendar_para_restante(id_cliente: str, margem_kcal: float = 0.0) -> str:
                 linhas.append(f"• <b>{nome}</b> ({refeicao}): Até <b>{maxg}g</b> (~{cal100:.0f} kcal/100g)")
             resposta = "\n".join(linhas)
 
-    _salvar_conversa(id_cliente, "bot", resposta.split('\n')[0])
+    ctx.salvar_conversa("bot", resposta.split('\n')[0])
     return resposta
 
-def interpretar_intencao(pergunta: str) -> Tuple[Optional[str], float]:
-    if MODELO_IA is None: return None, 0.0
-    
-    emb = MODELO_IA.encode(pergunta, convert_to_tensor=True)
-    melhor = None
-    melhor_sim = -1.0
-    for chave, embs in INTENCOES_EMBED.items():
-        sim = float(util.cos_sim(emb, embs).max())
-        if sim > melhor_sim:
-            melhor_sim = sim
-            melhor = chave
-    return melhor, melhor_sim
+def pontuar_intencoes(pergunta: str, modo: Optional[str]=None) -> np.ndarray:
+    if MODELO_IA is None or not INTENCOES_CHAVES:
+        return np.zeros(0, dtype=np.float32)
+
+    emb = codificar_texto(pergunta)
+    if (modo or MODO_INTENCAO) == "centroide":
+        return INTENCOES_CENTROIDES @ emb
+    sims = INTENCOES_MATRIZ @ emb
+    return np.maximum.reduceat(sims, INTENCOES_INICIOS)
+
+def classificar_intencao(pergunta: str, top_k: int=2, modo: Optional[str]=None) -> List[Tuple[str, float]]:
+    pontuacoes = pontuar_intencoes(pergunta, modo)
+    if pontuacoes.shape[0] == 0:
+        return []
+    k = min(top_k, pontuacoes.shape[0])
+    indices = np.argsort(-pontuacoes)[:k]
+    return [(INTENCOES_CHAVES[i], float(pontuacoes[i])) for i in indices]
+
+# distância entre a 1ª e a 2ª intenção em cada turno que chega ao classificador: margens baixas = rótulos ambíguos
+HIST_MARGEM_INTENCAO = Histograma((0.01, 0.02, 0.05, 0.1, 0.2))
+
+def margem_intencao(pergunta: str, modo: Optional[str]=None) -> Tuple[Optional[str], float, float]:
+    ranking = classificar_intencao(pergunta, top_k=2, modo=modo)
+    if not ranking:
+        return None, 0.0, 0.0
+    chave, sim = ranking[0]
+    margem = sim - ranking[1][1] if len(ranking) > 1 else sim
+    return chave, sim, margem
+
+def interpretar_intencao(pergunta: str, modo: Optional[str]=None) -> Tuple[Optional[str], float]:
+    ranking = classificar_intencao(pergunta, top_k=1, modo=modo)
+    if not ranking:
+        return None, 0.0
+    return ranking[0]
 
 def ultima_resposta_contexto(id_cliente: str) -> Optional[Dict[str,Any]]:
     with get_db() as db:
         cursor = db.execute(
-            "SELECT * FROM conversas WHERE id_cliente = ? AND role = 'bot' ORDER BY time DESC LIMIT 1",
+            "SELECT * FROM conversas WHERE id_cliente = ? AND role = 'bot' ORDER BY ts_ms DESC, id_conversa DESC LIMIT 1",
             (id_cliente,)
         )
         ultima = cursor.fetchone()
         return dict(ultima) if ultima else None
 
-def procurar_item_por_texto_no_plano(id_cliente: str, texto: str) -> Optional[Dict[str,Any]]:
+def procurar_item_por_texto_no_plano(id_cliente: str, texto: str, ctx: Optional[ContextoTurno]=None) -> Optional[Dict[str,Any]]:
     match_emb = _encontrar_item_por_nome_por_embedding(id_cliente, texto)
     if match_emb:
         return match_emb[1] 
 
-    plano = listar_plano(id_cliente)
+    plano = ctx.plano if ctx is not None else listar_plano(id_cliente)
     texto_norm = normalizar_texto(texto)
     for refeicao, itens in plano.items():
         for item in itens:
@@ -695,29 +2412,32 @@ def procurar_item_por_texto_no_plano(id_cliente: str, texto: str) -> Optional[Di
                 return item
     return None
 
-def mostrar_informacoes_cliente(id_cliente: str) -> str:
-    cliente = get_cliente_por_id(id_cliente)
+def mostrar_informacoes_cliente(id_cliente: str, ctx: Optional[ContextoTurno]=None) -> str:
+    with _turno(id_cliente, ctx) as ctx:
+        return _mostrar_informacoes_cliente(ctx)
+
+def _mostrar_informacoes_cliente(ctx: ContextoTurno) -> str:
+    cliente = ctx.cliente
     if not cliente:
         return "Cliente não encontrado."
     
     try:
         peso = cliente.get("peso_kg")
         altura = cliente.get("altura_cm")
-        idade = cliente.get("idade")
         
-        bmr = calcular_bmr(peso, altura, idade, cliente.get("sexo", "f"))
-        tdee = calcular_tdee(bmr, cliente.get("atividade", "sedentario"))
-        agua_ml = recomendacao_agua_ml(peso) if peso else None
-        consumo_hoje, itens = consumo_total_hoje(id_cliente)
-        imc = calcular_imc(peso, altura)
-        imc_class = classificar_imc(imc)
+        metricas = metricas_cliente(cliente)
+        tdee = metricas["tdee_kcal"]
+        agua_ml = metricas["agua_ml"]
+        resumo_hoje = ctx.resumo_hoje
+        imc = metricas["imc"]
+        imc_class = metricas["imc_class"]
 
         linhas = [
             f"Aqui está um resumo do seu perfil, {cliente.get('nome', 'Cliente')}:",
             f"• <b>Peso:</b> {peso} kg (Altura: {altura} cm)",
             f"• <b>IMC:</b> {imc:.2f} ({imc_class})",
             f"• <b>Meta Diária:</b> ~{tdee:.0f} kcal",
-            f"• <b>Consumo Hoje:</b> {consumo_hoje:.0f} kcal ({len(itens)} registros)",
+            f"• <b>Consumo Hoje:</b> {resumo_hoje['kcal']:.0f} kcal ({resumo_hoje['itens']} registros)",
         ]
         if agua_ml:
             linhas.append(f"• <b>Água:</b> ~{int(agua_ml)} ml/dia")
@@ -726,11 +2446,16 @@ def mostrar_informacoes_cliente(id_cliente: str) -> str:
     except Exception as e:
         resposta = "Parece que alguns dos seus dados de perfil (peso, altura, idade) não estão preenchidos. Peça para seu/sua nutri completar seu cadastro! 😉"
 
-    _salvar_conversa(id_cliente, "bot", resposta.split('\n')[0]) 
+    ctx.salvar_conversa("bot", resposta.split('\n')[0])
     return resposta
 
-def gerar_relatorio_completo_cliente(id_cliente: str) -> str:
-    cliente = get_cliente_por_id(id_cliente)
+def gerar_relatorio_completo_cliente(id_cliente: str, ctx: Optional[ContextoTurno]=None) -> str:
+    with _turno(id_cliente, ctx) as ctx:
+        return _gerar_relatorio_completo_cliente(ctx)
+
+def _gerar_relatorio_completo_cliente(ctx: ContextoTurno) -> str:
+    id_cliente = ctx.id_cliente
+    cliente = ctx.cliente
     if not cliente:
         return "Cliente não encontrado."
 
@@ -740,29 +2465,27 @@ def gerar_relatorio_completo_cliente(id_cliente: str) -> str:
     sexo = cliente.get("sexo", "F")
     atividade = cliente.get("atividade", "sedentario")
 
-    imc = calcular_imc(peso, altura) if peso and altura else None
+    metricas = metricas_cliente(cliente)
+    imc = metricas["imc"]
     imc_txt = f"{imc:.2f}" if imc else "—"
-    imc_class = classificar_imc(imc)
+    imc_class = metricas["imc_class"]
     
     agua_txt = "—"
-    if peso:
-        ml = recomendacao_agua_ml(peso)
+    if metricas["agua_ml"]:
+        ml = metricas["agua_ml"]
         agua_txt = f"~{int(ml)} ml/dia (~{ml/1000:.2f} L)"
 
     bmr_txt = "—"
     tdee_txt = "—"
-    if peso and altura and idade:
-        try:
-            bmr = calcular_bmr(peso, altura, int(idade), sexo)
-            tdee = calcular_tdee(bmr, atividade)
-            bmr_txt = f"{bmr:.0f} kcal/dia"
-            tdee_txt = f"{tdee:.0f} kcal/dia (atividade: {atividade})"
-        except Exception:
-            pass
+    if metricas["bmr_kcal"] is not None:
+        bmr_txt = f"{metricas['bmr_kcal']:.0f} kcal/dia"
+        tdee_txt = f"{metricas['tdee_kcal']:.0f} kcal/dia (atividade: {atividade})"
     
-    plano = listar_plano(id_cliente)
-    consumo_hoje_total, ultimos_registros = consumo_total_hoje(id_cliente)
-    conversas = get_historico_conversa(id_cliente)[-10:] 
+    plano = ctx.plano
+    ultimos_registros = ctx.registros_hoje
+    consumo_hoje_total = sum(r.get("kcal", 0.0) for r in ultimos_registros)
+    # o que o turno ainda não gravou também conta como conversa recente
+    conversas = (ultimas_mensagens(id_cliente, 10) + ctx.conversas_pendentes())[-10:]
 
     linhas = [
         "Aqui está o relatório completo que eu gero para seu/sua nutri (e para você, claro! 😉):",
@@ -805,113 +2528,249 @@ def gerar_relatorio_completo_cliente(id_cliente: str) -> str:
     return "\n".join(linhas)
 
 
-def responder_pergunta(id_cliente: str, texto: str) -> str:
-    _salvar_conversa(id_cliente, "user", texto)
-    
-    texto_lower = texto.lower().strip()
-    
-    if re.search(r'(forne(c|ç)a|me dê|me de|me mande|)\s+(todas as informa(c|ç)oes|meu resumo|meu relatório)', texto_lower):
-        resposta = gerar_relatorio_completo_cliente(id_cliente)
-        _salvar_conversa(id_cliente, "bot", "Gerando relatório completo...") 
-        return resposta
-
-    m_peso = re.search(r'\b(?:meu\s+)?peso\s*(?:é|=)?\s*(\d+(?:[.,]\d+)?)\s*(kg)?\b', texto_lower)
-    if m_peso:
-        peso_novo = float(m_peso.group(1).replace(",", "."))
-        if atualizar_cliente(id_cliente, {"peso_kg": peso_novo}):
-            resposta = f"Entendido! Atualizei seu peso para <b>{peso_novo:.1f} kg</b>. Vou usar esse valor para recalcular suas metas de calorias e água. 👍"
-        else:
-            resposta = "Erro ao atualizar peso. Peça para a nutricionista atualizar manualmente."
-        _salvar_conversa(id_cliente, "bot", resposta)
-        return resposta
-
-    if any(w in texto_lower for w in ["água", "agua", "quanta água", "quanta agua"]):
-        cliente = get_cliente_por_id(id_cliente)
-        if cliente and cliente.get("peso_kg"):
-            ml = recomendacao_agua_ml(cliente["peso_kg"])
-            resposta = f"Com base no seu peso, a sugestão de ingestão de água é de <b>~{int(ml)} ml/dia</b> (cerca de {ml/1000:.2f} L). Mantenha-se hidratado! 💧"
-        else:
-            resposta = "Não tenho seu peso cadastrado. Peça para a nutricionista cadastrar ou escreva 'Meu peso 72kg' para atualizar."
-        _salvar_conversa(id_cliente, "bot", resposta)
-        return resposta
+RE_RELATORIO = re.compile(r'(forne(c|ç)a|me dê|me de|me mande|)\s+(todas as informa(c|ç)oes|meu resumo|meu relatório)')
+RE_PESO = re.compile(r'\b(?:meu\s+)?peso\s*(?:é|=)?\s*(\d+(?:[.,]\d+)?)\s*(kg)?\b')
+RE_KCAL = re.compile(r'(\d+(?:[.,]\d+)?)\s*kcal')
+PALAVRAS_AGUA = ("água", "agua")
+PALAVRAS_CONSUMO = ("comi", "comemos", "comeu", "bebi", "tomei", "registrei", "anota aí")
+PALAVRAS_QUANTO = ("quanto isso", "quantas calorias", "quantas kcal", "quanto tem")
+LIMIAR_INTENCAO = 0.5
 
-    chave_intencao, sim = interpretar_intencao(texto_lower)
-    
-    if chave_intencao == "saudacoes" and sim > 0.5:
-        return saudacoes_cliente(id_cliente) 
-    if chave_intencao == "perguntar_opcoes_cafe" and sim > 0.5:
-        return recomendar_opcoes_refeicao(id_cliente, "cafe da manha") 
-    if chave_intencao == "perguntar_opcoes_almoco" and sim > 0.5:
-        return recomendar_opcoes_refeicao(id_cliente, "almoco") 
-    if chave_intencao == "perguntar_opcoes_janta" and sim > 0.5:
-        return recomendar_opcoes_refeicao(id_cliente, "janta") 
-    if chave_intencao == "calorias_disponiveis" and sim > 0.5:
-        return recomendar_para_restante(id_cliente) 
-    if chave_intencao == "mostrar_info" and sim > 0.5:
-        resposta = mostrar_informacoes_cliente(id_cliente)
-        return resposta
-
-    if "comi" in texto_lower or "comemos" in texto_lower or "comeu" in texto_lower or "registrei" in texto_lower or "anota aí" in texto_lower:
-        refeicao_encontrada = "refeicao" 
-        for mk in MEAL_KEYS:
-            if mk in texto_lower:
-                refeicao_encontrada = mk
-                break
-        
-        pares = extrair_itens_e_gramas(texto_lower)
-        if not pares:
-            resposta = "Não entendi o que você comeu. 😅 Para eu registrar, tente dizer o alimento e a quantidade, por exemplo: 'Comi 100g de arroz e 150g de frango no almoço'."
-        else:
-            mensagens = []
-            for nome_item, gramas in pares:
-                registro = registrar_consumo(id_cliente, refeicao_encontrada, nome_item, gramas)
-                if registro:
-                    mensagens.append(f"Anotado! ✅ <b>{registro['nome_item']}</b> ({registro['gramas']}g) com ~{registro['kcal']:.0f} kcal.")
-            resposta = "\n".join(mensagens)
-        
-        _salvar_conversa(id_cliente, "bot", resposta)
-        return resposta
+# classes de custo: regras de texto puro < classificador por embedding < busca no plano por embedding
+CUSTO_TEXTO = 0
+CUSTO_CLASSIFICADOR = 10
+CUSTO_BUSCA = 20
 
-    if any(k in texto_lower for k in ["quanto isso", "quantas calorias", "quantas kcal", "quanto tem"]):
-        ultima = ultima_resposta_contexto(id_cliente)
-        if not ultima:
-            resposta = "Não achei referência anterior clara."
-        else:
-            texto_bot = ultima.get("texto", "")
-            m = re.search(r'(\d+(?:[.,]\d+)?)\s*kcal', texto_bot)
-            if m:
-                resposta = f"A última opção que mencionei tem <b>~{float(m.group(1)):.0f} kcal</b> (a cada 100g, geralmente)."
-            else:
-                resposta = "Não consegui inferir as calorias da mensagem anterior."
-        
-        _salvar_conversa(id_cliente, "bot", resposta)
-        return resposta
+def _responder_relatorio(ctx: ContextoTurno, texto_lower: str, _match) -> str:
+    resposta = _gerar_relatorio_completo_cliente(ctx)
+    ctx.salvar_conversa("bot", "Gerando relatório completo...")
+    return resposta
 
-    match = procurar_item_por_texto_no_plano(id_cliente, texto_lower)
-    if match:
-        p = match["per_100g"]
-        resposta = f"Encontrei <b>{match['nome']}</b> no seu plano! Aqui estão os detalhes (para 100g):\n• <b>Calorias:</b> {p['cal']:.0f} kcal\n• <b>Proteínas:</b> {p.get('prot',0):.1f}g\n• <b>Carboidratos:</b> {p.get('carb',0):.1f}g\n• <b>Gorduras:</b> {p.get('fat',0):.1f}g"
+def _responder_peso(ctx: ContextoTurno, texto_lower: str, m_peso) -> str:
+    peso_novo = float(m_peso.group(1).replace(",", "."))
+    if atualizar_cliente(ctx.id_cliente, {"peso_kg": peso_novo}, ctx=ctx):
+        resposta = f"Entendido! Atualizei seu peso para <b>{peso_novo:.1f} kg</b>. Vou usar esse valor para recalcular suas metas de calorias e água. 👍"
     else:
-        resposta = "Desculpe, não consegui entender. 😅 Você pode tentar perguntar de outra forma? Lembre-se que eu funciono melhor com perguntas como 'O que posso jantar?' ou 'Comi 150g de frango'."
-    
-    _salvar_conversa(id_cliente, "bot", resposta)
+        resposta = "Erro ao atualizar peso. Peça para a nutricionista atualizar manualmente."
+    ctx.salvar_conversa("bot", resposta)
     return resposta
 
-def buscar_alimento_base_dados(nome_alimento: str) -> List[Dict[str, Any]]:
-    if DF_ALIMENTOS is None:
-        return []
+def _responder_agua(ctx: ContextoTurno, texto_lower: str, _match) -> str:
+    cliente = ctx.cliente
+    if cliente and cliente.get("peso_kg"):
+        ml = metricas_cliente(cliente)["agua_ml"]
+        resposta = f"Com base no seu peso, a sugestão de ingestão de água é de <b>~{int(ml)} ml/dia</b> (cerca de {ml/1000:.2f} L). Mantenha-se hidratado! 💧"
+    else:
+        resposta = "Não tenho seu peso cadastrado. Peça para a nutricionista cadastrar ou escreva 'Meu peso 72kg' para atualizar."
+    ctx.salvar_conversa("bot", resposta)
+    return resposta
 
-    nome_alimento = nome_alimento.lower().strip()
-    opcoes = DF_ALIMENTOS["descricao_alimento_norm"].tolist()
+def _responder_consumo(ctx: ContextoTurno, texto_lower: str, _match) -> str:
+    refeicao_encontrada = "refeicao" 
+    for mk in MEAL_KEYS:
+        if mk in texto_lower:
+            refeicao_encontrada = mk
+            break
     
-    resultados = process.extract(nome_alimento, opcoes, score_cutoff=60, limit=5)
+    pares = extrair_itens_e_gramas(texto_lower)
+    if not pares:
+        resposta = "Não entendi o que você comeu. 😅 Para eu registrar, tente dizer o alimento e a quantidade, por exemplo: 'Comi 100g de arroz e 150g de frango no almoço'."
+    else:
+        mensagens = []
+        resolvidos = resolver_itens_consumo(ctx.id_cliente, [nome_item for nome_item, _ in pares])
+        for (nome_item, gramas), resolvido in zip(pares, resolvidos):
+            registro = _registrar_consumo(ctx, refeicao_encontrada, nome_item, gramas, resolvido)
+            if registro:
+                mensagens.append(f"Anotado! ✅ <b>{registro['nome_item']}</b> ({registro['gramas']}g) com ~{registro['kcal']:.0f} kcal.")
+        resposta = "\n".join(mensagens)
     
-    matches = []
-    if resultados:
-        for melhor, score, idx in resultados:
-            alimento = DF_ALIMENTOS.iloc[idx].to_dict()
-            alimento_limpo = {k: (v if pd.notna(v) else None) for k, v in alimento.items()}
-            alimento_limpo['score'] = score 
-            matches.append(alimento_limpo)
-            
-    return matches
\ No newline at end of file
+    ctx.salvar_conversa("bot", resposta)
+    return resposta
+
+def _responder_quanto(ctx: ContextoTurno, texto_lower: str, _match) -> str:
+    ultima = ultima_resposta_contexto(ctx.id_cliente)
+    if not ultima:
+        resposta = "Não achei referência anterior clara."
+    else:
+        texto_bot = ultima.get("texto", "")
+        m = RE_KCAL.search(texto_bot)
+        if m:
+            resposta = f"A última opção que mencionei tem <b>~{float(m.group(1)):.0f} kcal</b> (a cada 100g, geralmente)."
+        else:
+            resposta = "Não consegui inferir as calorias da mensagem anterior."
+    
+    ctx.salvar_conversa("bot", resposta)
+    return resposta
+
+ACOES_INTENCAO = {
+    "saudacoes": lambda ctx: saudacoes_cliente(ctx.id_cliente, ctx),
+    "perguntar_opcoes_cafe": lambda ctx: _recomendar_opcoes_refeicao(ctx, "cafe da manha"),
+    "perguntar_opcoes_almoco": lambda ctx: _recomendar_opcoes_refeicao(ctx, "almoco"),
+    "perguntar_opcoes_janta": lambda ctx: _recomendar_opcoes_refeicao(ctx, "janta"),
+    "calorias_disponiveis": lambda ctx: _recomendar_para_restante(ctx, 0.0),
+    "mostrar_info": lambda ctx: _mostrar_informacoes_cliente(ctx),
+}
+
+def _classificar_para_rota(texto_lower: str):
+    chave_intencao, sim, margem = margem_intencao(texto_lower)
+    if chave_intencao is not None:
+        HIST_MARGEM_INTENCAO.observar(margem)
+    if chave_intencao in ACOES_INTENCAO and sim > LIMIAR_INTENCAO:
+        return chave_intencao
+    return None
+
+def _responder_intencao(ctx: ContextoTurno, texto_lower: str, chave_intencao: str) -> str:
+    return ACOES_INTENCAO[chave_intencao](ctx)
+
+def _responder_item_plano(ctx: ContextoTurno, texto_lower: str, match: Dict[str, Any]) -> str:
+    p = match["per_100g"]
+    resposta = f"Encontrei <b>{match['nome']}</b> no seu plano! Aqui estão os detalhes (para 100g):\n• <b>Calorias:</b> {p['cal']:.0f} kcal\n• <b>Proteínas:</b> {p.get('prot',0):.1f}g\n• <b>Carboidratos:</b> {p.get('carb',0):.1f}g\n• <b>Gorduras:</b> {p.get('fat',0):.1f}g"
+    ctx.salvar_conversa("bot", resposta)
+    return resposta
+
+def _responder_nao_entendi(ctx: ContextoTurno, texto_lower: str, _match) -> str:
+    resposta = "Desculpe, não consegui entender. 😅 Você pode tentar perguntar de outra forma? Lembre-se que eu funciono melhor com perguntas como 'O que posso jantar?' ou 'Comi 150g de frango'."
+    ctx.salvar_conversa("bot", resposta)
+    return resposta
+
+def _tem_palavra(palavras: Tuple[str, ...]):
+    return lambda ctx, texto_lower: any(p in texto_lower for p in palavras)
+
+class Rota:
+    def __init__(self, nome: str, custo: int, condicao, acao):
+        self.nome = nome
+        self.custo = custo
+        self.condicao = condicao
+        self.acao = acao
+        self.avaliacoes = 0
+        self.acertos = 0
+        self.tempo_condicao_s = 0.0
+        self.tempo_acao_s = 0.0
+
+class RoteadorIntencoes:
+    def __init__(self, rotas: List[Rota]):
+        # estável: dentro da mesma classe de custo vale a ordem da tabela
+        self.rotas = sorted(rotas, key=lambda r: r.custo)
+        self._lock = threading.Lock()
+        self.turnos = 0
+        self.sem_modelo = 0
+
+    def rotear(self, ctx: ContextoTurno, texto_lower: str) -> str:
+        for rota in self.rotas:
+            inicio = time.perf_counter()
+            match = rota.condicao(ctx, texto_lower)
+            meio = time.perf_counter()
+            if not match:
+                with self._lock:
+                    rota.avaliacoes += 1
+                    rota.tempo_condicao_s += meio - inicio
+                continue
+            resposta = rota.acao(ctx, texto_lower, match)
+            fim = time.perf_counter()
+            with self._lock:
+                rota.avaliacoes += 1
+                rota.acertos += 1
+                rota.tempo_condicao_s += meio - inicio
+                rota.tempo_acao_s += fim - meio
+                self.turnos += 1
+                if rota.custo < CUSTO_CLASSIFICADOR:
+                    self.sem_modelo += 1
+            return resposta
+        return None
+
+    def estatisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "turnos": self.turnos,
+                "sem_modelo": self.sem_modelo,
+                "rotas": [
+                    {
+                        "nome": r.nome,
+                        "custo": r.custo,
+                        "avaliacoes": r.avaliacoes,
+                        "acertos": r.acertos,
+                        "condicao_ms_media": round(r.tempo_condicao_s * 1000 / r.avaliacoes, 3) if r.avaliacoes else None,
+                        "acao_ms_media": round(r.tempo_acao_s * 1000 / r.acertos, 3) if r.acertos else None,
+                    }
+                    for r in self.rotas
+                ],
+            }
+
+ROTEADOR = RoteadorIntencoes([
+    Rota("relatorio", CUSTO_TEXTO, lambda ctx, t: RE_RELATORIO.search(t), _responder_relatorio),
+    Rota("peso", CUSTO_TEXTO, lambda ctx, t: RE_PESO.search(t), _responder_peso),
+    # com quantidade explícita ("comi 100g de ...", "bebi 300 ml de água") o registro é inequívoco e não precisa do modelo
+    Rota("consumo_com_gramas", CUSTO_TEXTO,
+         lambda ctx, t: any(p in t for p in PALAVRAS_CONSUMO) and GRAMAS_PATTERN.search(t), _responder_consumo),
+    # "água" sem verbo de consumo é pergunta sobre a meta de hidratação
+    Rota("agua", CUSTO_TEXTO,
+         lambda ctx, t: any(p in t for p in PALAVRAS_AGUA) and not any(p in t for p in PALAVRAS_CONSUMO), _responder_agua),
+    Rota("intencao", CUSTO_CLASSIFICADOR, lambda ctx, t: _classificar_para_rota(t), _responder_intencao),
+    # palavras-chave baratas, mas ambíguas: só valem se o classificador não reconheceu a frase
+    Rota("consumo", CUSTO_CLASSIFICADOR + 1, _tem_palavra(PALAVRAS_CONSUMO), _responder_consumo),
+    Rota("quanto_isso", CUSTO_CLASSIFICADOR + 1, _tem_palavra(PALAVRAS_QUANTO), _responder_quanto),
+    Rota("item_plano", CUSTO_BUSCA, lambda ctx, t: procurar_item_por_texto_no_plano(ctx.id_cliente, t, ctx), _responder_item_plano),
+    Rota("nao_entendi", CUSTO_BUSCA + 1, lambda ctx, t: True, _responder_nao_entendi),
+])
+
+def responder_pergunta(id_cliente: str, texto: str, ctx: Optional[ContextoTurno]=None) -> str:
+    # um turno = um contexto: leituras compartilhadas entre as regras e um único commit no final
+    ctx = ctx or ContextoTurno(id_cliente)
+    ctx.salvar_conversa("user", texto)
+    marca = ctx.marcar()
+    try:
+        with ctx.rastrear():
+            resposta = ROTEADOR.rotear(ctx, texto.lower().strip())
+    except Exception as e:
+        # a mensagem do usuário é gravada mesmo assim; o que a regra deixou pela metade, não
+        print(f"Erro ao responder cliente {id_cliente}: {e}")
+        ctx.descartar_desde(marca)
+        resposta = "Desculpe, tive um problema para responder. 😕 Pode repetir, por favor?"
+        ctx.salvar_conversa("bot", resposta)
+    if ctx.confirmar() is not None:
+        print(f"Erro ao gravar turno do cliente {id_cliente}: {ctx.erro}")
+        return "Desculpe, tive um problema para salvar nossa conversa. 😕 Pode repetir, por favor?"
+    return resposta
+
+def buscar_alimentos_base_lote(nomes: List[str], limite: int=5, deslocamento: int=0, score_min: float=60,
+                               score_min_texto: Optional[float]=None) -> List[List[Dict[str, Any]]]:
+    if INDICE_ALIMENTOS is None or not nomes:
+        return [[] for _ in nomes]
+    vetores = None
+    if MODELO_IA is not None and INDICE_ALIMENTOS.embeddings is not None:
+        vetores = np.vstack(codificar_textos(nomes))
+    return INDICE_ALIMENTOS.buscar_lote(nomes, vetores, limite=limite, deslocamento=deslocamento, score_min=score_min,
+                                        score_min_texto=score_min_texto)
+
+def buscar_alimento_base_dados(nome_alimento: str, limite: int=5, deslocamento: int=0, score_min: float=60) -> List[Dict[str, Any]]:
+    if INDICE_ALIMENTOS is None:
+        return []
+    return INDICE_ALIMENTOS.buscar(nome_alimento, limite=limite, deslocamento=deslocamento, score_min=score_min)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Tarefas de manutenção do banco do chatbot.")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p_consumo = sub.add_parser("reconstruir-consumo", help="Recalcula consumo_diario a partir de registros_consumo.")
+    p_consumo.add_argument("--cliente", help="Reconstrói apenas este cliente.")
+    p_metricas = sub.add_parser("metricas", help="Calcula BMR/TDEE/IMC/água de todos os clientes em lote.")
+    p_metricas.add_argument("--nutri", help="Só os clientes desta nutricionista.")
+    p_metricas.add_argument("--csv", help="Salva o resultado neste arquivo CSV.")
+    args = parser.parse_args()
+
+    init_db()
+    if args.comando == "reconstruir-consumo":
+        db = get_db()
+        with db:
+            reconstruir_consumo_diario(db, args.cliente)
+        total = db.execute("SELECT COUNT(*) FROM consumo_diario").fetchone()[0]
+        print(f"consumo_diario reconstruído: {total} dias-cliente.")
+    elif args.comando == "metricas":
+        df = metricas_populacao(args.nutri)
+        if args.csv:
+            df.to_csv(args.csv, index=False)
+            print(f"Métricas de {len(df)} clientes salvas em '{args.csv}'.")
+        else:
+            print(df[["id_cliente", "nome", "imc", "imc_class", "bmr_kcal", "tdee_kcal", "agua_ml"]].round(1).to_string(index=False))
+    fechar_conexoes()
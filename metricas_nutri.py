@@ -0,0 +1,154 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+FATORES_ATIVIDADE = {
+    "sedentario": 1.2,
+    "leve": 1.375,
+    "moderado": 1.55,
+    "ativo": 1.725,
+    "muito_ativo": 1.9
+}
+FAIXAS_IMC = [
+    (18.5, "Magreza (IMC < 18.5)"),
+    (25, "Normal (IMC 18.5–24.9)"),
+    (30, "Sobrepeso (IMC 25–29.9)"),
+    (np.inf, "Obesidade (IMC ≥ 30)"),
+]
+IMC_NAO_CALCULAVEL = "IMC não calculável"
+ML_AGUA_POR_KG = 35
+
+_LIMITES_IMC = np.array([limite for limite, _ in FAIXAS_IMC])
+_ROTULOS_IMC = np.array([rotulo for _, rotulo in FAIXAS_IMC] + [IMC_NAO_CALCULAVEL], dtype=object)
+
+# --- versões escalares (usadas pontualmente e como referência das vetorizadas) ---
+
+def calcular_bmr(peso_kg: float, altura_cm: float, idade: int, sexo: str) -> float:
+    s = sexo.lower()[0] if sexo else "f"
+    if s in ("f", "m") and s == "f":
+        return 10 * peso_kg + 6.25 * altura_cm - 5 * idade - 161
+    else:
+        return 10 * peso_kg + 6.25 * altura_cm - 5 * idade + 5
+
+def calcular_tdee(bmr: float, atividade: str) -> float:
+    fator = FATORES_ATIVIDADE.get(atividade, FATORES_ATIVIDADE["sedentario"])
+    return bmr * fator
+
+def recomendacao_agua_ml(peso_kg: float) -> float:
+    return peso_kg * ML_AGUA_POR_KG
+
+def calcular_imc(peso_kg: float, altura_cm: float) -> Optional[float]:
+    try:
+        altura_m = float(altura_cm) / 100.0
+        if altura_m <= 0:
+            return None
+        return peso_kg / (altura_m * altura_m)
+    except Exception:
+        return None
+
+def classificar_imc(imc: float) -> str:
+    if imc is None:
+        return IMC_NAO_CALCULAVEL
+    for limite, rotulo in FAIXAS_IMC:
+        if imc < limite:
+            return rotulo
+    return FAIXAS_IMC[-1][1]
+
+# --- versões vetorizadas: arrays de clientes -> arrays de métricas (NaN onde faltam dados) ---
+
+def _numeros(valores: Iterable) -> np.ndarray:
+    return pd.to_numeric(pd.Series(valores, dtype=object), errors="coerce").to_numpy(dtype=np.float64)
+
+def feminino(sexos: Iterable) -> np.ndarray:
+    return pd.Series(sexos, dtype=object).fillna("").astype(str).str.lower().str[:1].isin(["f", ""]).to_numpy()
+
+def fatores_atividade(atividades: Iterable) -> np.ndarray:
+    serie = pd.Series(atividades, dtype=object)
+    return serie.map(FATORES_ATIVIDADE).fillna(FATORES_ATIVIDADE["sedentario"]).to_numpy(dtype=np.float64)
+
+def bmr_lote(peso: np.ndarray, altura: np.ndarray, idade: np.ndarray, eh_feminino: np.ndarray) -> np.ndarray:
+    validos = (peso > 0) & (altura > 0) & (idade > 0)
+    return np.where(validos, 10 * peso + 6.25 * altura - 5 * idade + np.where(eh_feminino, -161, 5), np.nan)
+
+def imc_lote(peso: np.ndarray, altura: np.ndarray) -> np.ndarray:
+    altura_m = np.where(altura > 0, altura / 100.0, np.nan)
+    return np.where(peso > 0, peso / (altura_m * altura_m), np.nan)
+
+def classe_imc_lote(imc: np.ndarray) -> np.ndarray:
+    faixa = np.where(np.isnan(imc), len(FAIXAS_IMC), np.searchsorted(_LIMITES_IMC, np.nan_to_num(imc), side="right"))
+    return _ROTULOS_IMC[faixa]
+
+def agua_lote(peso: np.ndarray) -> np.ndarray:
+    return np.where(peso > 0, peso * ML_AGUA_POR_KG, np.nan)
+
+def calcular_lote(pesos: Iterable, alturas: Iterable, idades: Iterable, sexos: Iterable, atividades: Iterable) -> Dict[str, np.ndarray]:
+    peso, altura, idade = _numeros(pesos), _numeros(alturas), _numeros(idades)
+    bmr = bmr_lote(peso, altura, idade, feminino(sexos))
+    imc = imc_lote(peso, altura)
+    return {
+        "bmr_kcal": bmr,
+        "tdee_kcal": bmr * fatores_atividade(atividades),
+        "imc": imc,
+        "imc_class": classe_imc_lote(imc),
+        "agua_ml": agua_lote(peso),
+    }
+
+def metricas_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    if df.empty:
+        return pd.DataFrame(columns=["bmr_kcal", "tdee_kcal", "imc", "imc_class", "agua_ml"], index=df.index)
+    resultado = calcular_lote(df["peso_kg"], df["altura_cm"], df["idade"], df["sexo"], df["atividade"])
+    return pd.DataFrame(resultado, index=df.index)
+
+def _valor(x):
+    if isinstance(x, float) and np.isnan(x):
+        return None
+    return x.item() if isinstance(x, np.generic) else x
+
+def metricas_de_cliente(cliente: Dict[str, Any]) -> Dict[str, Any]:
+    resultado = calcular_lote([cliente.get("peso_kg")], [cliente.get("altura_cm")], [cliente.get("idade")],
+                              [cliente.get("sexo")], [cliente.get("atividade")])
+    return {chave: _valor(valores[0]) for chave, valores in resultado.items()}
+
+# --- cache chaveado pelas entradas da fórmula: cadastro alterado (em qualquer processo) é só outra chave ---
+
+CAMPOS_METRICAS = ("peso_kg", "altura_cm", "idade", "sexo", "atividade")
+
+def chave_metricas(cliente: Dict[str, Any]) -> Tuple:
+    return tuple(cliente.get(campo) for campo in CAMPOS_METRICAS)
+
+class CacheMetricas:
+    def __init__(self, capacidade: int):
+        self.capacidade = capacidade
+        self._valores: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.remocoes = 0
+
+    def obter(self, chave: Tuple, calcular: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        with self._lock:
+            valor = self._valores.get(chave)
+            if valor is not None:
+                self._valores.move_to_end(chave)
+                self.acertos += 1
+                return valor
+            self.falhas += 1
+        valor = calcular()
+        self.preencher({chave: valor})
+        return valor
+
+    def preencher(self, valores: Dict[Tuple, Dict[str, Any]]):
+        with self._lock:
+            for chave, valor in valores.items():
+                self._valores[chave] = valor
+                self._valores.move_to_end(chave)
+            while len(self._valores) > self.capacidade:
+                self._valores.popitem(last=False)
+                self.remocoes += 1
+
+    def estatisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entradas": len(self._valores), "capacidade": self.capacidade,
+                    "acertos": self.acertos, "falhas": self.falhas, "remocoes": self.remocoes}
@@ -0,0 +1,207 @@
+import io
+import csv
+import json
+import html
+import threading
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import chatbot_nutri as bot
+from metricas_nutri import metricas_de_cliente
+
+FORMATOS_RELATORIO = {"html": "text/html; charset=utf-8", "csv": "text/csv; charset=utf-8", "json": "application/json"}
+DIAS_PADRAO = 30
+DIAS_MAX = 366
+TAMANHO_BLOCO = 16 * 1024
+LINHAS_POR_LOTE = 500
+
+def dia_para_data(dia: int) -> date:
+    return date(dia // 10000, dia // 100 % 100, dia % 100)
+
+def data_para_dia(d: date) -> int:
+    return d.year * 10000 + d.month * 100 + d.day
+
+def intervalo_relatorio(fuso: Optional[str], inicio: Optional[str]=None, fim: Optional[str]=None) -> Tuple[int, int]:
+    fim_data = date.fromisoformat(fim) if fim else dia_para_data(bot.chave_dia_hoje(fuso))
+    inicio_data = date.fromisoformat(inicio) if inicio else fim_data - timedelta(days=DIAS_PADRAO - 1)
+    if inicio_data > fim_data:
+        raise ValueError("Data inicial depois da final.")
+    if (fim_data - inicio_data).days >= DIAS_MAX:
+        raise ValueError(f"Intervalo máximo é de {DIAS_MAX} dias.")
+    return data_para_dia(inicio_data), data_para_dia(fim_data)
+
+def _linhas_cursor(cursor) -> Iterator[tuple]:
+    while True:
+        lote = cursor.fetchmany(LINHAS_POR_LOTE)
+        if not lote:
+            return
+        for linha in lote:
+            yield tuple(linha)
+
+def _texto_dia(dia: int) -> str:
+    return dia_para_data(dia).isoformat()
+
+def _secoes(db, cliente: Dict[str, Any], dia_inicio: int, dia_fim: int) -> Iterator[Tuple[str, str, List[str], Iterator[tuple]]]:
+    id_cliente = cliente["id_cliente"]
+    metricas = metricas_de_cliente(cliente)
+    imc, bmr, tdee = metricas["imc"], metricas["bmr_kcal"], metricas["tdee_kcal"]
+
+    dados = [
+        ("nome", cliente.get("nome")),
+        ("idade", cliente.get("idade")),
+        ("sexo", cliente.get("sexo")),
+        ("altura_cm", cliente.get("altura_cm")),
+        ("peso_inicial_kg", cliente.get("peso_inicial")),
+        ("peso_atual_kg", cliente.get("peso_kg")),
+        ("meta", cliente.get("meta")),
+        ("imc", round(imc, 2) if imc else None),
+        ("imc_classe", metricas["imc_class"]),
+        ("agua_recomendada_ml", round(metricas["agua_ml"]) if metricas["agua_ml"] else None),
+        ("bmr_kcal", round(bmr) if bmr else None),
+        ("tdee_kcal", round(tdee) if tdee else None),
+        ("periodo", f"{_texto_dia(dia_inicio)} a {_texto_dia(dia_fim)}"),
+    ]
+    yield "cliente", "Dados do cliente", ["campo", "valor"], iter(dados)
+
+    cursor = db.execute(f"SELECT refeicao, nome, cal_100g, prot_100g, carb_100g, fat_100g FROM ({bot.SQL_PLANO_EFETIVO}) ORDER BY refeicao, nome", {"id_cliente": id_cliente})
+    yield "plano", "Plano alimentar", ["refeicao", "nome", "kcal_100g", "prot_100g", "carb_100g", "fat_100g"], _linhas_cursor(cursor)
+
+    cursor = db.execute(
+        "SELECT dia, kcal, prot_g, carb_g, fat_g, agua_ml, itens FROM consumo_diario WHERE id_cliente = ? AND dia BETWEEN ? AND ? ORDER BY dia",
+        (id_cliente, dia_inicio, dia_fim)
+    )
+    linhas = ((_texto_dia(d), round(k or 0, 1), round(p or 0, 1), round(c or 0, 1), round(f or 0, 1), round(a or 0), n)
+              for d, k, p, c, f, a, n in _linhas_cursor(cursor))
+    yield "consumo_diario", "Consumo por dia", ["dia", "kcal", "prot_g", "carb_g", "fat_g", "agua_ml", "itens"], linhas
+
+    cursor = db.execute(
+        """SELECT dia, data_hora, refeicao, nome_item, gramas, kcal FROM registros_consumo
+           WHERE id_cliente = ? AND dia BETWEEN ? AND ? ORDER BY dia, ts_ms""",
+        (id_cliente, dia_inicio, dia_fim)
+    )
+    linhas = ((_texto_dia(d), h, r, n, g, round(k or 0, 1)) for d, h, r, n, g, k in _linhas_cursor(cursor))
+    yield "registros", "Registros de consumo", ["dia", "data_hora", "refeicao", "item", "gramas", "kcal"], linhas
+
+    pesos = bot.historico_peso(id_cliente, dia_inicio, dia_fim, db=db)
+    def _tendencia():
+        anterior = None
+        for registro in pesos:
+            dia, peso_kg = registro["dia"], registro["peso_kg"]
+            variacao = round(peso_kg - anterior, 2) if anterior is not None else None
+            anterior = peso_kg
+            yield _texto_dia(dia), peso_kg, variacao
+    yield "peso", "Evolução do peso", ["dia", "peso_kg", "variacao_kg"], _tendencia()
+
+class _Formatador:
+    def inicio(self, cliente: Dict[str, Any]) -> str: return ""
+    def secao(self, chave: str, titulo: str, colunas: List[str]) -> str: return ""
+    def linha(self, colunas: List[str], valores: tuple) -> str: return ""
+    def fim_secao(self) -> str: return ""
+    def fim(self) -> str: return ""
+
+class _FormatadorJSON(_Formatador):
+    def __init__(self):
+        self.primeira_linha = True
+
+    def inicio(self, cliente):
+        return json.dumps({"id_cliente": cliente["id_cliente"], "gerado_em": datetime.utcnow().isoformat()}, ensure_ascii=False)[:-1]
+
+    def secao(self, chave, titulo, colunas):
+        self.primeira_linha = True
+        return f', {json.dumps(chave)}: ['
+
+    def linha(self, colunas, valores):
+        separador = "" if self.primeira_linha else ", "
+        self.primeira_linha = False
+        return separador + json.dumps(dict(zip(colunas, valores)), ensure_ascii=False)
+
+    def fim_secao(self):
+        return "]"
+
+    def fim(self):
+        return "}"
+
+class _FormatadorCSV(_Formatador):
+    def __init__(self):
+        self.buffer = io.StringIO()
+        self.escritor = csv.writer(self.buffer)
+
+    def _escrever(self, linha) -> str:
+        self.escritor.writerow(linha)
+        texto = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return texto
+
+    def inicio(self, cliente):
+        return "﻿"
+
+    def secao(self, chave, titulo, colunas):
+        return self._escrever([f"# {titulo}"]) + self._escrever(colunas)
+
+    def linha(self, colunas, valores):
+        return self._escrever(["" if v is None else v for v in valores])
+
+    def fim_secao(self):
+        return "\r\n"
+
+class _FormatadorHTML(_Formatador):
+    def inicio(self, cliente):
+        nome = html.escape(str(cliente.get("nome") or ""))
+        return (f"<!DOCTYPE html><html lang=\"pt-br\"><head><meta charset=\"utf-8\"><title>Relatório - {nome}</title>"
+                "<style>body{font-family:sans-serif;margin:2em}table{border-collapse:collapse;margin-bottom:2em}"
+                "th,td{border:1px solid #ccc;padding:4px 8px;text-align:left}th{background:#f0f0f0}</style></head>"
+                f"<body><h1>Relatório de {nome}</h1>")
+
+    def secao(self, chave, titulo, colunas):
+        cabecalho = "".join(f"<th>{html.escape(c)}</th>" for c in colunas)
+        return f"<h2>{html.escape(titulo)}</h2><table><thead><tr>{cabecalho}</tr></thead><tbody>"
+
+    def linha(self, colunas, valores):
+        return "<tr>" + "".join(f"<td>{html.escape('—' if v is None else str(v))}</td>" for v in valores) + "</tr>"
+
+    def fim_secao(self):
+        return "</tbody></table>"
+
+    def fim(self):
+        return "</body></html>"
+
+FORMATADORES = {"html": _FormatadorHTML, "csv": _FormatadorCSV, "json": _FormatadorJSON}
+
+def gerar_relatorio(id_cliente: str, dia_inicio: int, dia_fim: int, formato: str="html",
+                    cancelado: Optional[threading.Event]=None) -> Iterator[str]:
+    # conexão própria e uma transação de leitura: o relatório inteiro enxerga o mesmo snapshot (WAL)
+    # e pode ser consumido aos poucos, de threads diferentes, sem segurar a conexão da thread;
+    # se quem consome desistir (cancelado), para na próxima seção/bloco e fecha a conexão aqui mesmo
+    cancelado = cancelado or threading.Event()
+    formatador = FORMATADORES[formato]()
+    db = bot.abrir_conexao()
+    try:
+        db.execute("BEGIN")
+        linha = db.execute("SELECT * FROM clientes WHERE id_cliente = ?", (id_cliente,)).fetchone()
+        if not linha:
+            return
+        cliente = dict(linha)
+
+        partes: List[str] = [formatador.inicio(cliente)]
+        tamanho = 0
+        for chave, titulo, colunas, linhas in _secoes(db, cliente, dia_inicio, dia_fim):
+            if cancelado.is_set():
+                return
+            partes.append(formatador.secao(chave, titulo, colunas))
+            for valores in linhas:
+                texto = formatador.linha(colunas, valores)
+                partes.append(texto)
+                tamanho += len(texto)
+                if tamanho >= TAMANHO_BLOCO:
+                    if cancelado.is_set():
+                        return
+                    yield "".join(partes)
+                    partes, tamanho = [], 0
+            partes.append(formatador.fim_secao())
+            # cada seção pronta já sai, para o navegador começar a renderizar
+            yield "".join(partes)
+            partes, tamanho = [], 0
+        yield formatador.fim()
+    finally:
+        db.rollback()
+        db.close()
@@ -0,0 +1,101 @@
+import struct
+import hashlib
+from typing import List, Optional, Tuple
+import numpy as np
+
+# cabeçalho: marca, versão, formato, dimensão, escala, id do modelo (4 bytes do blake2s do nome)
+MARCA = b"OTRV"
+VERSAO_VETOR = 1
+CABECALHO = struct.Struct("<4sBBHf4s")
+
+FORMATOS = {"float32": 0, "float16": 1, "int8": 2}
+NOMES_FORMATOS = {codigo: nome for nome, codigo in FORMATOS.items()}
+DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+def id_modelo(nome_modelo: str) -> bytes:
+    return hashlib.blake2s(nome_modelo.encode("utf-8"), digest_size=4).digest()
+
+def normalizar(vec: np.ndarray) -> np.ndarray:
+    vec = np.asarray(vec, dtype=np.float32).ravel()
+    norma = float(np.linalg.norm(vec))
+    return vec / norma if norma else vec
+
+def codificar_vetor(vec: np.ndarray, nome_modelo: str, formato: str = "int8") -> bytes:
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato de vetor desconhecido: {formato}")
+    vec = normalizar(vec)
+    escala = 1.0
+    if formato == "int8":
+        maximo = float(np.abs(vec).max()) if vec.size else 0.0
+        escala = maximo / 127.0 if maximo else 1.0
+        dados = np.clip(np.rint(vec / escala), -127, 127).astype(np.int8)
+    else:
+        dados = vec.astype(DTYPES[formato])
+    cabecalho = CABECALHO.pack(MARCA, VERSAO_VETOR, FORMATOS[formato], vec.shape[0], escala, id_modelo(nome_modelo))
+    return cabecalho + dados.tobytes()
+
+def ler_cabecalho(blob: bytes) -> Optional[Tuple[str, int, float, bytes]]:
+    if len(blob) < CABECALHO.size or blob[:4] != MARCA:
+        return None
+    marca, versao, formato, dim, escala, modelo = CABECALHO.unpack_from(blob)
+    if versao != VERSAO_VETOR or formato not in NOMES_FORMATOS:
+        raise ValueError(f"Vetor com versão {versao} / formato {formato} não suportado.")
+    return NOMES_FORMATOS[formato], dim, escala, modelo
+
+def decodificar_vetor(blob: bytes) -> Tuple[np.ndarray, float, Optional[bytes]]:
+    cabecalho = ler_cabecalho(blob)
+    if cabecalho is None:
+        # formato antigo: float32 cru, sem cabeçalho e sem normalização
+        return normalizar(np.frombuffer(blob, dtype=np.float32)), 1.0, None
+    formato, dim, escala, modelo = cabecalho
+    dados = np.frombuffer(blob, dtype=DTYPES[formato], offset=CABECALHO.size, count=dim)
+    return dados, escala, modelo
+
+class MatrizCompacta:
+    def __init__(self, dados: np.ndarray, escalas: np.ndarray):
+        self.dados = dados
+        self.escalas = escalas
+
+    @classmethod
+    def vazia(cls) -> "MatrizCompacta":
+        return cls(np.zeros((0, 0), dtype=np.float32), np.zeros(0, dtype=np.float32))
+
+    @classmethod
+    def de_blobs(cls, blobs: List[bytes]) -> "MatrizCompacta":
+        if not blobs:
+            return cls.vazia()
+        decodificados = [decodificar_vetor(blob) for blob in blobs]
+        dtypes = {dados.dtype for dados, _, _ in decodificados}
+        if len(dtypes) == 1:
+            dados = np.vstack([d for d, _, _ in decodificados])
+            escalas = np.array([e for _, e, _ in decodificados], dtype=np.float32)
+        else:
+            # formatos misturados (ex.: no meio de uma troca de formato): cai para float32
+            dados = np.vstack([d.astype(np.float32) * np.float32(e) for d, e, _ in decodificados])
+            escalas = np.ones(len(decodificados), dtype=np.float32)
+        return cls(dados, escalas)
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.dados.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.dados.nbytes + self.escalas.nbytes
+
+    def linha(self, idx: int) -> np.ndarray:
+        return self.dados[idx].astype(np.float32) * self.escalas[idx]
+
+    def __matmul__(self, consulta: np.ndarray) -> np.ndarray:
+        # produto direto no tipo guardado, sem converter a matriz inteira; a escala por linha é aplicada só no resultado
+        consulta = np.asarray(consulta, dtype=np.float32)
+        if self.dados.dtype == np.int8:
+            # a consulta também é quantizada: int8·int8 acumulado em int32
+            maximo = float(np.abs(consulta).max()) if consulta.size else 0.0
+            escala = maximo / 127.0 if maximo else 1.0
+            q = np.clip(np.rint(consulta / escala), -127, 127).astype(np.int8)
+            produto = np.einsum("ij,j->i", self.dados, q, dtype=np.int32).astype(np.float32)
+            return produto * (self.escalas * np.float32(escala))
+        if self.dados.dtype != np.float32:
+            return np.einsum("ij,j->i", self.dados, consulta, dtype=np.float32) * self.escalas
+        return (self.dados @ consulta) * self.escalas